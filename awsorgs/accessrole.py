@@ -6,12 +6,13 @@ Creates role 'OrganizationAccountAccessRole' allowing users in
 Org Master account 'AdministratorAccess' in invited account.
 
 Usage:
-  awsorgs-accessrole --master_id ID [--exec]
+  awsorgs-accessrole --master_id ID [--exec] [--profile FILE]
   awsorgs-accessrole --help
   awsorgs-accessrole --version
 
 Options:
   -m, --master_id ID    Master Account ID
+  --profile FILE        Profile the run and write a report to FILE.
   -h, --help            Show this help message and exit.
   -V, --version         Display version info and exit.
 """
@@ -21,17 +22,18 @@ import sys
 import yaml
 import json
 
-import boto3
 from botocore.exceptions import ClientError
 from docopt import docopt
 
 import awsorgs
 from awsorgs.utils import *
+from awsorgs.profiler import profiled
 
 ROLENAME = 'OrganizationAccountAccessRole'
 DESCRIPTION = 'Organization Access Role'
 POLICYNAME = 'AdministratorAccess'
 
+@profiled
 def main():
     args = docopt(__doc__, version=awsorgs.__version__)
     iam_client = boto3.client('iam')
@@ -5,12 +5,14 @@
 
 Usage:
   awsaccounts (report|create|alias|invite) [--config FILE]
-                                           [--spec-dir PATH] 
+                                           [--spec-dir PATH] [--spec-jobs N]
+                                           [--no-spec-cache]
                                            [--master-account-id ID]
                                            [--auth-account-id ID]
                                            [--org-access-role ROLE]
                                            [--invited-account-id ID]
                                            [--exec] [-q] [-d|-dd]
+                                           [--profile FILE]
   awsaccounts (--help|--version)
 
 Modes of operation:
@@ -24,6 +26,8 @@ Options:
   -V, --version             Display version info and exit.
   -f, --config FILE         AWS Org config file in yaml format.
   --spec-dir PATH           Location of AWS Org specification file directory.
+  --spec-jobs N             Parse and validate spec files in N processes.
+  --no-spec-cache           Do not read or write the validated spec cache.
   --master-account-id ID    AWS account Id of the Org master account.    
   --auth-account-id ID      AWS account Id of the authentication account.
   --org-access-role ROLE    IAM role for traversing accounts in the Org.
@@ -34,6 +38,7 @@ Options:
   -q, --quiet               Repress log output.
   -d, --debug               Increase log level to 'DEBUG'.
   -dd                       Include botocore and boto3 logs in log stream.
+  --profile FILE            Profile the run and write a report to FILE.
 
 """
 
@@ -41,16 +46,18 @@ Options:
 import yaml
 import time
 
-import boto3
-import botocore
 from botocore.exceptions import ClientError
 from docopt import docopt
 
 import awsorgs
 from awsorgs.utils import *
 from awsorgs.spec import *
+from awsorgs.trace import traced
+from awsorgs.profiler import profiled
+from awsorgs.daemon import forwarded
 
 
+@traced
 def create_accounts(org_client, args, log, deployed_accounts, account_spec):
     """
     Compare deployed_accounts to list of accounts in the accounts spec.
@@ -69,7 +76,7 @@ def create_accounts(org_client, args, log, deployed_accounts, account_spec):
             else:
                 email_addr = '%s@%s' % (a_spec['Name'], account_spec['default_domain'])
             log.info("Creating account '%s'" % (a_spec['Name']))
-            log.debug('account email: %s' % email_addr)
+            log.debug('account email: %s', email_addr)
             if args['--exec']:
                 new_account = org_client.create_account(
                         AccountName=a_spec['Name'],
@@ -117,7 +124,7 @@ def set_account_alias(account, log, args, account_spec, role):
         else:
             iam_client = boto3.client('iam', **credentials)
         aliases = iam_client.list_account_aliases()['AccountAliases']
-        log.debug('account_name: %s; aliases: %s' % (account['Name'], aliases))
+        log.debug('account_name: %s; aliases: %s', account['Name'], aliases)
         if not aliases:
             log.info("setting account alias to '%s' for account '%s'" %
                     (proposed_alias, account['Name']))
@@ -138,6 +145,7 @@ def set_account_alias(account, log, args, account_spec, role):
                     log.error(e)
 
 
+@traced
 def scan_invited_accounts(log, org_client):
     """Return a list of handshake IDs"""
     response = org_client.list_handshakes_for_organization(
@@ -148,10 +156,11 @@ def scan_invited_accounts(log, org_client):
                 Filter={'ActionType': 'INVITE'},
                 NextToken=response['NextToken'])
         handshakes += response['Handshakes']
-    log.debug(handshakes)
+    log.debug('%s', handshakes)
     return handshakes
 
 
+@traced
 def invite_account(log, args, org_client, deployed_accounts):
     """Invite account_id to join Org"""
     account_id = args['--invited-account-id']
@@ -168,9 +177,9 @@ def invite_account(log, args, org_client, deployed_accounts):
     account_invite = [invite for invite in invited_accounts 
             if lookup(invite['Parties'], 'Type', 'ACCOUNT', 'Id') == account_id]
     if account_invite:
-        log.debug('account_invite: %s' % account_invite)
+        log.debug('account_invite: %s', account_invite)
         invite_state = account_invite[0]['State']
-        log.debug('invite_state: %s' % invite_state)
+        log.debug('invite_state: %s', invite_state)
         if invite_state == 'ACCEPTED':
             log.error('Account %s has already accepted a previous invite' % account_id)
             return
@@ -209,18 +218,17 @@ def display_provisioned_accounts(log, deployed_accounts, status):
     """
     if status not in ('ACTIVE', 'SUSPENDED'):
         raise RuntimeError("'status' must be one of ('ACTIVE', 'SUSPENDED')")
-    sorted_account_names = sorted([a['Name'] for a in deployed_accounts
-            if a['Status'] == status])
-    if sorted_account_names:
+    sorted_accounts = sorted([a for a in deployed_accounts
+            if a['Status'] == status], key=lambda a: a['Name'])
+    if sorted_accounts:
         header = '%s Accounts in Org:' % status.capitalize()
         overbar = '_' * len(header)
         log.info("\n%s\n%s\n" % (overbar, header))
         fmt_str = "{:20}{:20}{:16}{}"
         log.info(fmt_str.format('Name:', 'Alias', 'Id:', 'Email:'))
-        for name in sorted_account_names:
-            account = lookup(deployed_accounts, 'Name', name)
+        for account in sorted_accounts:
             log.info(fmt_str.format(
-                    name,
+                    account['Name'],
                     account['Alias'],
                     account['Id'],
                     account['Email']))
@@ -229,15 +237,17 @@ def display_provisioned_accounts(log, deployed_accounts, status):
 def unmanaged_accounts(log, deployed_accounts, account_spec):
     deployed_account_names = [a['Name'] for a in deployed_accounts] 
     spec_account_names = [a['Name'] for a in account_spec['accounts']]
-    log.debug('deployed_account_names: %s' % deployed_account_names)
-    log.debug('spec_account_names: %s' % spec_account_names)
+    log.debug('deployed_account_names: %s', deployed_account_names)
+    log.debug('spec_account_names: %s', spec_account_names)
     return [a for a in deployed_account_names if a not in spec_account_names]
 
 
+@forwarded
+@profiled
 def main():
     args = docopt(__doc__, version=awsorgs.__version__)
     log = get_logger(args)
-    log.debug(args)
+    log.debug('%s', args)
     args = load_config(log, args)
     credentials = get_assume_role_credentials(
             args['--master-account-id'],
@@ -267,7 +277,7 @@ def main():
             log.warn("Unmanaged accounts in Org: %s" % (', '.join(unmanaged)))
 
     if args['alias']:
-        queue_threads(log, deployed_accounts, set_account_alias,
+        queue_accounts(log, deployed_accounts, set_account_alias,
                 f_args=(log, args, account_spec, args['--org-access-role']),
                 thread_count=10)
 
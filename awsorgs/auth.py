@@ -6,7 +6,8 @@ AWS Organization.
 
 Usage:
   awsauth (users|delegations|local-users|report) [--config FILE]
-                                                 [--spec-dir PATH] 
+                                                 [--spec-dir PATH] [--spec-jobs N]
+                                                 [--no-spec-cache]
                                                  [--master-account-id ID]
                                                  [--auth-account-id ID]
                                                  [--org-access-role ROLE]
@@ -14,7 +15,13 @@ Usage:
                                                  [--opt-ttl HOURS]
                                                  [--users --roles --credentials]
                                                  [--account NAME] [--full]
-                                                 [--exec] [-q] [-d|-dd]
+                                                 [--compact]
+                                                 [--format FORMAT] [--sorted]
+                                                 [--cache] [--cache-ttl HOURS]
+                                                 [--snapshot FILE] [--diff FILE]
+                                                 [--by-account] [--shards N]
+                                                 [--exec]
+                                                 [-q] [-d|-dd] [--profile FILE]
   awsauth (--help|--version)
 
 Modes of operation:
@@ -28,6 +35,10 @@ Options:
   -V, --version             Display version info and exit.
   --config FILE             AWS Org config file in yaml format.
   --spec-dir PATH           Location of AWS Org specification file directory.
+  --spec-jobs N             Parse and validate spec files in N processes.
+  --no-spec-cache           Do not read or write the validated spec cache.
+  --shards N                Split work in accounts across N processes.
+                            Not for 'users' mode, --snapshot or --diff.
   --master-account-id ID    AWS account Id of the Org master account.    
   --auth-account-id ID      AWS account Id of the authentication account.
   --org-access-role ROLE    IAM role for traversing accounts in the Org.
@@ -35,18 +46,42 @@ Options:
   -q, --quiet               Repress log output.
   -d, --debug               Increase log level to 'DEBUG'.
   -dd                       Include botocore and boto3 logs in log stream.
+  --profile FILE            Profile the run and write a report to FILE.
 
   users options:
   --disable-expired         Delete profile if one-time-password
                             exceeds --opt-ttl.
   --opt-ttl HOURS           One-time-password time to live in hours
                             [default: 24].
+  delegations and local-users options:
+  --by-account              Visit each account once, assuming the org access
+                            role once and applying all specs to it, instead
+                            of visiting every account for each spec.  Each
+                            spec still loads its own role or user.
   report options:
   --users                   Print user and groups report.
   --roles                   Print roles and custom policies report.
   --credentials             Print IAM credentials report.
   --full                    Print full details in reports.
+  --compact                 With --full, omit non-default policy versions
+                            and instance profiles from the default report.
   --account NAME            Just report for a single named account.
+  --format FORMAT           Report output format: yaml, jsonl or csv.
+                            With jsonl or csv, log messages go to stderr
+                            [default: yaml].
+  --sorted                  Print accounts in name order once all accounts
+                            are done.  Default is to print each account as
+                            soon as it completes.
+  --cache                   Reuse report results cached from previous runs
+                            for accounts whose IAM entity counts are
+                            unchanged.  Edits that keep the counts, such
+                            as policy changes, show up once the cache
+                            expires.  Not used for --credentials.
+  --cache-ttl HOURS         Maximum age of cached report results in hours
+                            [default: 1].
+  --snapshot FILE           Save report records to FILE as JSON lines.
+  --diff FILE               Print what changed since the snapshot saved in
+                            FILE instead of the report.
 
 """
 
@@ -54,8 +89,11 @@ import os
 import sys
 import yaml
 import json
+import datetime
+import functools
+import threading
+import collections
 
-import boto3
 from botocore.exceptions import ClientError
 from docopt import docopt
 
@@ -64,26 +102,113 @@ from awsorgs.utils import *
 from awsorgs.spec import *
 from awsorgs.loginprofile import *
 from awsorgs.reports import *
+from awsorgs.trace import traced
+from awsorgs.profiler import profiled
+from awsorgs.daemon import forwarded
+from awsorgs import shard
 
 
-def expire_users(log, args, deployed, auth_spec, credentials):
+# IAM throttles write calls per account.  Bound the number of threads
+# working in the auth account and let botocore pace its retries.
+IAM_THREAD_COUNT = 8
+
+
+def thread_iam_resources(credentials):
+    """
+    Return a function giving each calling thread its own iam resource for
+    credentials.  boto3 resources are not thread safe, so worker threads
+    must not share one.
+    """
+    local = threading.local()
+
+    def iam_resource():
+        if not hasattr(local, 'resource'):
+            local.resource = boto3.resource('iam', config=iam_client_config(),
+                    **credentials)
+        return local.resource
+    return iam_resource
+
+
+@functools.lru_cache(maxsize=None)
+def iam_client_config():
+    """Return botocore client config for IAM clients in the auth account"""
+    from botocore.config import Config
+    return Config(retries=dict(max_attempts=10, mode='adaptive'))
+
+
+def parse_report_date(value):
     """
-    Delete login profile for any users whose one-time-password has expired
+    Convert a credential report timestamp into a datetime object.
+    Returns None for values such as 'N/A' or 'no_information'.
     """
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def expire_candidates(log, iam_client, deployed, ttl):
+    """
+    Use the IAM credential report to select the deployed users whose
+    login profile could hold an expired one-time-password.  This must be a
+    superset of the users onetime_passwd_expired() would expire, which
+    goes by the login profile's create date.  A user is only skipped if
+    the report proves it has no login profile, or if the user itself was
+    created within 'ttl', and so its login profile too.
+    """
+    report = get_credential_report(log, iam_client)
+    report_age = utcnow() - report['GeneratedTime']
+    rows = {row['user']: row for row in scan_credential_report(report['Content'])}
+    candidates = []
     for name in [u['UserName'] for u in deployed['users']]:
-        user = validate_user(name, credentials)
-        if user:
-            login_profile = validate_login_profile(user)
-            if login_profile and onetime_passwd_expired(log, user, login_profile,
-                    int(args['--opt-ttl'])):
-                log.info('deleting login profile for user %s' % user.name)
-                if args['--exec']:
-                    login_profile.delete()
+        row = rows.get(name)
+        if row is None:
+            # user created since report was generated
+            candidates.append(name)
+            continue
+        created = parse_report_date(row['user_creation_time'])
+        if created is not None and utcnow() - created <= ttl:
+            continue
+        if row['password_enabled'] == 'true':
+            # UpdateLoginProfile moves password_last_changed but not the
+            # login profile's create date, so it can not rule a user out
+            candidates.append(name)
+        elif report_age > ttl:
+            # login profile may have been created since report was generated
+            candidates.append(name)
+    log.debug('expire candidates: %s', candidates)
+    return candidates
+
+
+@traced
+def expire_users(log, args, deployed, auth_spec, credentials):
+    """
+    Delete login profile for any users whose one-time-password has expired.
+    Candidate users are selected from the IAM credential report and their
+    login profiles checked in a thread pool.
+    """
+    iam_client = boto3.client('iam', config=iam_client_config(), **credentials)
+    iam_resource = thread_iam_resources(credentials)
+    ttl = datetime.timedelta(hours=int(args['--opt-ttl']))
+
+    # worker function for threading
+    def expire_user(name):
+        user = iam_resource().User(name)
+        login_profile = validate_login_profile(user)
+        if login_profile and onetime_passwd_expired(log, user, login_profile,
+                int(args['--opt-ttl'])):
+            log.info('deleting login profile for user %s' % user.name)
+            if args['--exec']:
+                login_profile.delete()
+
+    candidates = expire_candidates(log, iam_client, deployed, ttl)
+    queue_threads(log, candidates, expire_user, thread_count=IAM_THREAD_COUNT)
 
 
 def delete_user(user):
     """
-    Strip user attributes and delete user
+    Strip user attributes and delete user.  Runs serially, so it adds no
+    threads to the bounded pool of the caller.
 
     :param: user
     :type:  boto3 iam User resource object
@@ -106,93 +231,169 @@ def delete_user(user):
         x.delete()
     profile = user.LoginProfile()
     try:
-        profile.load()
         profile.delete()
     except profile.meta.client.exceptions.NoSuchEntityException:
         pass
     user.delete()
 
 
+def log_outcomes(log, resource_type, outcomes):
+    """
+    Log the outcome for each resource changed by a provisioning run.
+    outcomes::  dict of {resource_name: outcome}
+    """
+    changed = [name for name in sorted(outcomes)
+            if outcomes[name] != 'unchanged']
+    if changed:
+        log.info("%s provisioning outcomes:" % resource_type)
+        for name in changed:
+            log.info("  %s: %s" % (name, outcomes[name]))
+
+
+@traced
 def create_users(credentials, args, log, deployed, auth_spec):
     """
-    Manage IAM users based on user specification
+    Manage IAM users based on user specification.  Users are processed
+    concurrently in a bounded thread pool.
     """
-    iam_client = boto3.client('iam', **credentials)
-    iam_resource = boto3.resource('iam', **credentials)
-    for u_spec in auth_spec['users']:
+    iam_client = boto3.client('iam', config=iam_client_config(), **credentials)
+    iam_resource = thread_iam_resources(credentials)
+
+    # worker function for threading
+    def manage_user(task, outcomes, new_users):
+        u_spec, deployed_user = task
         path = munge_path(auth_spec['default_path'], u_spec)
-        deployed_user = lookup(deployed['users'], 'UserName', u_spec['Name'])
-        if deployed_user:
-            user = iam_resource.User(u_spec['Name'])
-            # delete user
-            if ensure_absent(u_spec):
-                log.info("Deleting user '%s'" % user.name)
-                if args['--exec']:
-                    delete_user(user)
-            # update user
-            elif user.path != path:
-                log.info("Updating path on user '%s'" % u_spec['Name'])
+        outcome = 'unchanged'
+        try:
+            if deployed_user:
+                user = iam_resource().User(u_spec['Name'])
+                # delete user
+                if ensure_absent(u_spec):
+                    log.info("Deleting user '%s'" % user.name)
+                    outcome = 'deleted'
+                    if args['--exec']:
+                        delete_user(user)
+                # update user
+                elif deployed_user['Path'] != path:
+                    log.info("Updating path on user '%s'" % u_spec['Name'])
+                    outcome = 'updated'
+                    if args['--exec']:
+                        user.update(NewPath=path)
+            # create new user
+            elif not ensure_absent(u_spec):
+                log.info("Creating user '%s'" % u_spec['Name'])
+                outcome = 'created'
                 if args['--exec']:
-                    user.update(NewPath=path)
-        # create new user
-        elif not ensure_absent(u_spec):
-            log.info("Creating user '%s'" % u_spec['Name'])
-            if args['--exec']:
-                response = iam_client.create_user(UserName=u_spec['Name'], Path=path)
-                log.info(response['User']['Arn'])
-                deployed['users'].append(response['User'])
-
-
+                    response = iam_client.create_user(
+                            UserName=u_spec['Name'], Path=path)
+                    log.info(response['User']['Arn'])
+                    new_users.append(response['User'])
+        except ClientError as e:
+            log.error("Failed to manage user '%s': %s" % (u_spec['Name'], e))
+            outcome = 'failed'
+        outcomes[u_spec['Name']] = outcome
+
+    deployed_users = {u['UserName']: u for u in deployed['users']}
+    tasks = [(u_spec, deployed_users.get(u_spec['Name']))
+            for u_spec in auth_spec['users']]
+    outcomes = {}
+    new_users = []
+    queue_threads(log, tasks, manage_user, f_args=(outcomes, new_users),
+            thread_count=IAM_THREAD_COUNT)
+
+    # bring deployed users and group membership up to date
+    deployed['users'] += new_users
+    if args['--exec']:
+        for name, outcome in outcomes.items():
+            if outcome == 'deleted':
+                deployed['users'].remove(deployed_users[name])
+                for group in deployed['groups']:
+                    if name in group.get('Members', []):
+                        group['Members'].remove(name)
+    log_outcomes(log, 'User', outcomes)
+
+
+@traced
 def create_groups(credentials, args, log, deployed, auth_spec):
     """
-    Manage IAM groups based on group specification
+    Manage IAM groups based on group specification.  Groups are processed
+    concurrently in a bounded thread pool.
     """
-    iam_client = boto3.client('iam', **credentials)
-    iam_resource = boto3.resource('iam', **credentials)
-    for g_spec in auth_spec['groups']:
+    iam_client = boto3.client('iam', config=iam_client_config(), **credentials)
+    iam_resource = thread_iam_resources(credentials)
+
+    # worker function for threading
+    def manage_group(task, outcomes, new_groups):
+        g_spec, deployed_group = task
         path = munge_path(auth_spec['default_path'], g_spec)
-        deployed_group = lookup(deployed['groups'], 'GroupName', g_spec['Name'])
-        if deployed_group:
-            group = iam_resource.Group(g_spec['Name'])
-            # delete group?
-            if ensure_absent(g_spec):
-                # check if group has users
-                if list(group.users.all()):
-                    log.error("Can not delete group '%s'. Still contains users"
-                             % g_spec['Name'])
-                else:
-                    log.info("Deleting group '%s'" % g_spec['Name'])
+        outcome = 'unchanged'
+        try:
+            if deployed_group:
+                group = iam_resource().Group(g_spec['Name'])
+                # delete group?
+                if ensure_absent(g_spec):
+                    # check if group has users
+                    if deployed_group.get('Members'):
+                        log.error("Can not delete group '%s'. Still contains users"
+                                 % g_spec['Name'])
+                        outcome = 'failed'
+                    else:
+                        log.info("Deleting group '%s'" % g_spec['Name'])
+                        outcome = 'deleted'
+                        if args['--exec']:
+                            for policy in group.policies.all():
+                                policy.delete()
+                            for policy in group.attached_policies.all():
+                                policy.detach_group(GroupName=g_spec['Name'])
+                            group.delete()
+                # update group?
+                elif deployed_group['Path'] != path:
+                    log.info("Updating path on group '%s'" % g_spec['Name'])
+                    outcome = 'updated'
                     if args['--exec']:
-                        for policy in group.policies.all():
-                            policy.delete()
-                        for policy in group.attached_policies.all():
-                            policy.detach_group(GroupName=g_spec['Name'])
-                        group.delete()
-                        deployed['groups'].remove(deployed_group)
-            # update group?
-            elif group.path != path:
-                log.info("Updating path on group '%s'" % g_spec['Name'])
+                        group.update(NewPath=path)
+            # create group
+            elif not ensure_absent(g_spec):
+                log.info("Creating group '%s'" % g_spec['Name'])
+                outcome = 'created'
                 if args['--exec']:
-                    group.update(NewPath=path)
-        # create group
-        elif not ensure_absent(g_spec):
-            log.info("Creating group '%s'" % g_spec['Name'])
-            if args['--exec']:
-                response = iam_client.create_group(
-                        GroupName=g_spec['Name'], Path=path)
-                log.info(response['Group']['Arn'])
-                deployed['groups'].append(response['Group'])
-
-
+                    response = iam_client.create_group(
+                            GroupName=g_spec['Name'], Path=path)
+                    log.info(response['Group']['Arn'])
+                    new_groups.append(response['Group'])
+        except ClientError as e:
+            log.error("Failed to manage group '%s': %s" % (g_spec['Name'], e))
+            outcome = 'failed'
+        outcomes[g_spec['Name']] = outcome
+
+    deployed_groups = {g['GroupName']: g for g in deployed['groups']}
+    tasks = [(g_spec, deployed_groups.get(g_spec['Name']))
+            for g_spec in auth_spec['groups']]
+    outcomes = {}
+    new_groups = []
+    queue_threads(log, tasks, manage_group, f_args=(outcomes, new_groups),
+            thread_count=IAM_THREAD_COUNT)
+
+    # bring deployed groups up to date
+    deployed['groups'] += new_groups
+    if args['--exec']:
+        for name, outcome in outcomes.items():
+            if outcome == 'deleted':
+                deployed['groups'].remove(deployed_groups[name])
+    log_outcomes(log, 'Group', outcomes)
+
+
+@traced
 def manage_group_members(credentials, args, log, deployed, auth_spec):
     """
     Populate users into groups based on group specification.
     """
     iam_resource = boto3.resource('iam', **credentials)
     for g_spec in auth_spec['groups']:
-        if lookup(deployed['groups'], 'GroupName', g_spec['Name']):
+        deployed_group = lookup(deployed['groups'], 'GroupName', g_spec['Name'])
+        if deployed_group:
             group = iam_resource.Group(g_spec['Name'])
-            current_members = [user.name for user in group.users.all()] 
+            current_members = deployed_group.get('Members', [])
             # build list of specified group members
             spec_members = []
             if 'Members' in g_spec and g_spec['Members']:
@@ -237,6 +438,7 @@ def manage_group_members(credentials, args, log, deployed, auth_spec):
                         group.remove_user(UserName=username)
 
 
+@traced
 def manage_group_policies(credentials, args, log, deployed, auth_spec):
     """
     Attach managed policies to groups based on group specification
@@ -245,23 +447,23 @@ def manage_group_policies(credentials, args, log, deployed, auth_spec):
     iam_resource = boto3.resource('iam', **credentials)
     auth_account = lookup(deployed['accounts'], 'Id',
             auth_spec['auth_account_id'], 'Name')
-    log.debug("auth account: '%s'" % auth_account)
+    log.debug("auth account: '%s'", auth_account)
     for g_spec in auth_spec['groups']:
-        log.debug("processing group spec for '%s':\n%s" % (g_spec['Name'], g_spec))
+        log.debug("processing group spec for '%s':\n%s", g_spec['Name'], g_spec)
         if 'Policies' in g_spec and g_spec['Policies']:
             if (lookup(deployed['groups'], 'GroupName', g_spec['Name'])
                     and not ensure_absent(g_spec)):
                 group = iam_resource.Group(g_spec['Name'])
                 attached_policies = [p.policy_name for p
                         in list(group.attached_policies.all())]
-                log.debug("attached policies: '%s'" % attached_policies)
-                log.debug("specified policies: '%s'" % g_spec['Policies'])
+                log.debug("attached policies: '%s'", attached_policies)
+                log.debug("specified policies: '%s'", g_spec['Policies'])
                 # attach missing policies
                 for policy_name in g_spec['Policies']:
                     if not policy_name in attached_policies:
                         policy_arn = get_policy_arn(iam_client, auth_account,
                                 policy_name, args, log, auth_spec)
-                        log.debug("policy Arn for '%s': %s" % (policy_name, policy_arn))
+                        log.debug("policy Arn for '%s': %s", policy_name, policy_arn)
                         log.info("Attaching policy '%s' to group '%s' in "
                                 "account '%s'" % (policy_name, g_spec['Name'],
                                 auth_account))
@@ -283,30 +485,43 @@ def manage_group_policies(credentials, args, log, deployed, auth_spec):
                             group.detach_policy(PolicyArn=policy_arn)
 
 
-def get_policy_arn(iam_client, account_name, policy_name, args, log, auth_spec):
+@traced
+def get_policy_arn(iam_client, account_name, policy_name, args, log, auth_spec,
+        policy_cache=None):
     """
     Return the policy arn of the named IAM policy in an account.
     Checks AWS scope first, then calls manage_custom_policy() for
     local scope policies.
-    """
-    log.debug("policyName: '%s'" % policy_name)
-    aws_policies = iam_client.list_policies(Scope='AWS',
-            MaxItems=500)['Policies']
-    policy_arn = lookup(aws_policies, 'PolicyName', policy_name, 'Arn')
-    log.debug('policy_arn: %s' % policy_arn)
-    if policy_arn:
-        return policy_arn
-    else:
-        return manage_custom_policy(iam_client, account_name, policy_name, args,
-                log, auth_spec)
-
 
+    policy_cache is an optional dict kept for one account.  It holds the
+    AWS scope policy list and each arn returned, so each custom policy
+    is managed once per account.
+    """
+    log.debug("policyName: '%s'", policy_name)
+    if policy_cache is None:
+        policy_cache = {}
+    arns = policy_cache.setdefault('arns', {})
+    if policy_name in arns:
+        return arns[policy_name]
+    if 'aws' not in policy_cache:
+        policy_cache['aws'] = iam_client.list_policies(Scope='AWS',
+                MaxItems=500)['Policies']
+    policy_arn = lookup(policy_cache['aws'], 'PolicyName', policy_name, 'Arn')
+    log.debug('policy_arn: %s', policy_arn)
+    if not policy_arn:
+        policy_arn = manage_custom_policy(iam_client, account_name,
+                policy_name, args, log, auth_spec)
+    arns[policy_name] = policy_arn
+    return policy_arn
+
+
+@traced
 def manage_custom_policy(iam_client, account_name, policy_name, args, log, auth_spec):
     """
     Create or update a custom IAM policy in an account based on
     a policy specification.  Returns the policy arn.
     """
-    log.debug("account: '%s', policyName: '%s'" % (account_name, policy_name))
+    log.debug("account: '%s', policyName: '%s'", account_name, policy_name)
     p_spec = lookup(auth_spec['custom_policies'], 'PolicyName', policy_name)
     if not p_spec:
         log.error("Custom Policy spec for '%s' not found in auth-spec." % policy_name)
@@ -318,9 +533,9 @@ def manage_custom_policy(iam_client, account_name, policy_name, args, log, auth_
 
     # check if custom policy exists
     custom_policies = iam_client.list_policies(Scope='Local')['Policies']
-    log.debug("account: '%s', custom policies: '%s'" % (
-            account_name,
-            [p['Arn'] for p in custom_policies]))
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("account: '%s', custom policies: '%s'",
+                account_name, [p['Arn'] for p in custom_policies])
     policy = lookup(custom_policies, 'PolicyName', policy_name)
     if not policy:
         log.info("Creating custom policy '%s' in account '%s':\n%s" %
@@ -340,16 +555,16 @@ def manage_custom_policy(iam_client, account_name, policy_name, args, log, auth_
                 PolicyArn=policy['Arn'],
                 VersionId=policy['DefaultVersionId']
                 )['PolicyVersion']['Document']
-        log.debug("account: '%s', policy_doc: %s" % (account_name, policy_doc))
-        log.debug("account: '%s', current_doc: %s" % (account_name, current_doc))
+        log.debug("account: '%s', policy_doc: %s", account_name, policy_doc)
+        log.debug("account: '%s', current_doc: %s", account_name, current_doc)
 
         # compare each statement as dict
         update_required = False
         for i in range(len(current_doc['Statement'])):
             if current_doc['Statement'][i] != policy_doc['Statement'][i]:
                 update_required = True
-                log.debug('account: %s, update_required: %s' %
-                        (account_name, update_required))
+                log.debug('account: %s, update_required: %s',
+                        account_name, update_required)
 
         # update policy and set as default version
         if update_required:
@@ -358,7 +573,7 @@ def manage_custom_policy(iam_client, account_name, policy_name, args, log, auth_
                     account_name, 
                     string_differ(yamlfmt(current_doc), yamlfmt(policy_doc))))
             if args['--exec']:
-                log.debug("check for non-default policy versions for '%s'" % policy_name)
+                log.debug("check for non-default policy versions for '%s'", policy_name)
                 for v in iam_client.list_policy_versions(
                         PolicyArn=policy['Arn'])['Versions']:
                     if not v['IsDefaultVersion']:
@@ -375,13 +590,14 @@ def manage_custom_policy(iam_client, account_name, policy_name, args, log, auth_
         return policy['Arn']
 
 
+@traced
 def set_group_assume_role_policies(args, log, deployed, auth_spec,
         trusting_accounts, d_spec):
     """
     Assign and manage assume role trust policies on IAM groups in
     Auth account.
     """
-    log.debug('role: %s' % d_spec['RoleName'])
+    log.debug('role: %s', d_spec['RoleName'])
     credentials = get_assume_role_credentials(
             args['--auth-account-id'],
             args['--org-access-role'])
@@ -411,11 +627,12 @@ def set_group_assume_role_policies(args, log, deployed, auth_spec,
         return
 
     # keep track of managed group policies as we process them
-    managed_policies = []
+    managed_policies = set()
+    account_ids = dict((a['Name'], a['Id']) for a in deployed['accounts'])
     for account in trusting_accounts:
-        account_id = lookup(deployed['accounts'], 'Name', account, 'Id')
+        account_id = account_ids.get(account)
         policy_name = "%s-%s" % (account, d_spec['RoleName'])
-        managed_policies.append(policy_name)
+        managed_policies.add(policy_name)
 
         # assemble assume role policy document
         statement = dict(
@@ -460,21 +677,41 @@ def set_group_assume_role_policies(args, log, deployed, auth_spec,
                 group.Policy(policy_name).delete()
 
 
+def account_visit(account, args, log):
+    """
+    Assume the org access role in an account.  Returns dict of the iam
+    client and resource and a policy_cache for get_policy_arn(), shared
+    by all specs applied to the account in one visit.  Returns None if
+    the role can not be assumed.
+    """
+    credentials = get_assume_role_credentials(account['Id'],
+            args['--org-access-role'])
+    if isinstance(credentials, RuntimeError):
+        log.error(credentials)
+        return None
+    return dict(
+            iam_client=boto3.client('iam', **credentials),
+            iam_resource=boto3.resource('iam', **credentials),
+            policy_cache={})
+
+
 def manage_local_user_in_accounts(
-            account, args, log, auth_spec, deployed, accounts, lu_spec):
+            account, args, log, auth_spec, deployed, accounts, lu_spec,
+            visit=None):
     """
     Create and manage a local user in an account per user specification.
     """
 
     account_name = account['Name']
-    log.debug('account: %s, local user: %s' % (account_name, lu_spec['Name']))
+    log.debug('account: %s, local user: %s', account_name, lu_spec['Name'])
     path_spec = munge_path(auth_spec['default_path'], lu_spec)
-    credentials = get_assume_role_credentials(account['Id'], args['--org-access-role'])
-    if isinstance(credentials, RuntimeError):
-        log.error(credentials)
-        return
-    iam_client = boto3.client('iam', **credentials)
-    iam_resource = boto3.resource('iam', **credentials)
+    if visit is None:
+        visit = account_visit(account, args, log)
+        if visit is None:
+            return
+    iam_client = visit['iam_client']
+    iam_resource = visit['iam_resource']
+    policy_cache = visit['policy_cache']
 
     # get iam user object.
     user = iam_resource.User(lu_spec['Name'])
@@ -484,7 +721,7 @@ def manage_local_user_in_accounts(
         user_exists = False
     else:
         user_exists = True
-        log.debug('account: %s, local user exists: %s' % (account_name, user.arn))
+        log.debug('account: %s, local user exists: %s', account_name, user.arn)
 
     # check for unmanaged user in account
     if user_exists:
@@ -514,7 +751,7 @@ def manage_local_user_in_accounts(
                 user.load()
                 for policy_name in lu_spec['Policies']:
                     policy_arn = get_policy_arn(iam_client, account_name,
-                            policy_name, args, log, auth_spec)
+                            policy_name, args, log, auth_spec, policy_cache)
                     log.info("Attaching policy '%s' to local user '%s' "
                             "in account '%s'" %
                             (policy_name, user.name, account_name))
@@ -529,38 +766,37 @@ def manage_local_user_in_accounts(
                 try:
                     user.update(NewPath=path_spec)
                 except AttributeError as e:
-                    log.debug('boto3 error when calling user.update(): %s' % e)
+                    log.debug('boto3 error when calling user.update(): %s', e)
 
         # manage policy attachments
         attached_policies = [p.policy_name for p in list(user.attached_policies.all())]
         for policy_name in lu_spec['Policies']:
             if not policy_name in attached_policies:
                 policy_arn = get_policy_arn(iam_client, account_name, policy_name,
-                                            args, log, auth_spec)
+                                            args, log, auth_spec, policy_cache)
                 log.info("Attaching policy '%s' to local user '%s' in account '%s'" %
                         (policy_name, user.name, account_name))
                 if args['--exec'] and policy_arn:
                     user.attach_policy(PolicyArn=policy_arn)
             elif lookup(auth_spec['custom_policies'], 'PolicyName',policy_name):
                 policy_arn = get_policy_arn(iam_client, account_name, policy_name,
-                                            args, log, auth_spec)
+                                            args, log, auth_spec, policy_cache)
         # datach obsolete policies
         for policy_name in attached_policies:
             if not policy_name in lu_spec['Policies']:
                 policy_arn = get_policy_arn(iam_client, account_name, policy_name,
-                        args, log, auth_spec)
+                        args, log, auth_spec, policy_cache)
                 log.info("Detaching policy '%s' from local user '%s' in account '%s'" %
                         (policy_name, user.name, account_name))
                 if args['--exec'] and policy_arn:
                     user.detach_policy(PolicyArn=policy_arn)
 
 
-def manage_local_users(lu_spec, args, log, deployed, auth_spec):
+def plan_local_user(lu_spec, args, log, deployed, auth_spec):
     """
-    Create and manage local IAM users in specified accounts and 
-    attach policies to users based on local_user specifications.
+    Return the names of accounts a local_user specification applies to.
     """
-    log.debug('considering %s' % lu_spec['Name'])
+    log.debug('considering %s', lu_spec['Name'])
     # munge accounts list
     if lu_spec['Account'] == 'ALL':
         accounts = [a['Name'] for a in deployed['accounts']]
@@ -569,33 +805,42 @@ def manage_local_users(lu_spec, args, log, deployed, auth_spec):
                     if a not in lu_spec['ExcludeAccounts']]
     else:
         accounts = lu_spec['Account']
+    deployed_names = set(a['Name'] for a in deployed['accounts'])
     for account_name in accounts:
-        if not lookup(deployed['accounts'], 'Name', account_name):
+        if account_name not in deployed_names:
             log.error("Can not manage local user '%s' in account "
                     "'%s'.  Account '%s' not found in Organization" %
                     (lu_spec['Name'], account_name, account_name))
             accounts.remove(account_name)
+    return accounts
+
+
+def manage_local_users(lu_spec, args, log, deployed, auth_spec):
+    """
+    Create and manage local IAM users in specified accounts and 
+    attach policies to users based on local_user specifications.
+    """
+    accounts = plan_local_user(lu_spec, args, log, deployed, auth_spec)
     # run manage_local_user_in_accounts() task in thread pool
-    queue_threads(log, deployed['accounts'], manage_local_user_in_accounts,
+    queue_accounts(log, deployed['accounts'], manage_local_user_in_accounts,
             f_args=(args, log, auth_spec, deployed, accounts, lu_spec))
 
 
 def manage_delegation_role(account, args, log, auth_spec, deployed,
-            trusting_accounts, d_spec):
+            trusting_accounts, d_spec, visit=None):
     """
     Create and manage a cross account access delegetion role in an
     account based on delegetion specification.
     """
     account_name = account['Name']
-    log.debug('account: %s, role: %s' % (account_name, d_spec['RoleName']))
-    credentials = get_assume_role_credentials(
-            account['Id'],
-            args['--org-access-role'])
-    if isinstance(credentials, RuntimeError):
-        log.error(credentials)
-        return
-    iam_client = boto3.client('iam', **credentials)
-    iam_resource = boto3.resource('iam', **credentials)
+    log.debug('account: %s, role: %s', account_name, d_spec['RoleName'])
+    if visit is None:
+        visit = account_visit(account, args, log)
+        if visit is None:
+            return
+    iam_client = visit['iam_client']
+    iam_resource = visit['iam_resource']
+    policy_cache = visit['policy_cache']
     role = iam_resource.Role(d_spec['RoleName'])
 
     # check if role should not exist
@@ -659,7 +904,7 @@ def manage_delegation_role(account, args, log, auth_spec, deployed,
                     role.load()
                     for policy_name in d_spec['Policies']:
                         policy_arn = get_policy_arn(iam_client, account_name,
-                                policy_name, args, log, auth_spec)
+                                policy_name, args, log, auth_spec, policy_cache)
                         log.info("Attaching policy '%s' to role '%s' "
                                 "in account '%s':\n%s" % (
                                         policy_name, 
@@ -709,35 +954,35 @@ def manage_delegation_role(account, args, log, auth_spec, deployed,
         # attach missing policies
         if not policy_name in attached_policies:
             policy_arn = get_policy_arn(iam_client, account_name, policy_name,
-                    args, log, auth_spec)
+                    args, log, auth_spec, policy_cache)
             log.info("Attaching policy '%s' to role '%s' in account '%s'" %
                     (policy_name, d_spec['RoleName'], account_name))
             if args['--exec'] and policy_arn:
                 role.attach_policy(PolicyArn=policy_arn)
         elif lookup(auth_spec['custom_policies'], 'PolicyName',policy_name):
             policy_arn = get_policy_arn(iam_client, account_name, policy_name,
-                    args, log, auth_spec)
+                    args, log, auth_spec, policy_cache)
     for policy_name in attached_policies:
         # datach obsolete policies
         if not policy_name in d_spec['Policies']:
             policy_arn = get_policy_arn(iam_client, account_name, policy_name,
-                    args, log, auth_spec)
+                    args, log, auth_spec, policy_cache)
             log.info("Detaching policy '%s' from role '%s' in account '%s'" %
                     (policy_name, d_spec['RoleName'], account_name))
             if args['--exec'] and policy_arn:
                 role.detach_policy(PolicyArn=policy_arn)
 
 
-def manage_delegations(d_spec, args, log, deployed, auth_spec):
+def plan_delegation(d_spec, args, log, deployed, auth_spec):
     """
-    Create and manage cross account access delegations based on 
-    delegation specifications.  Manages delegation roles in 
-    trusting accounts and group policies in Auth (trusted) account.
+    Validate a delegation specification and manage its group policies in
+    the Auth (trusted) account.  Returns the names of trusting accounts,
+    or None if the delegation can not be managed.
     """
-    log.debug('considering %s' % d_spec['RoleName'])
+    log.debug('considering %s', d_spec['RoleName'])
     if d_spec['RoleName'] == args['--org-access-role']:
         log.error("Refusing to manage delegation '%s'" % d_spec['RoleName'])
-        return
+        return None
 
     # munge trusting_accounts list
     if d_spec['TrustingAccount'] == 'ALL':
@@ -747,8 +992,9 @@ def manage_delegations(d_spec, args, log, deployed, auth_spec):
                     if a not in d_spec['ExcludeAccounts']]
     else:
         trusting_accounts = d_spec['TrustingAccount']
+    deployed_names = set(a['Name'] for a in deployed['accounts'])
     for account_name in trusting_accounts:
-        if not lookup(deployed['accounts'], 'Name', account_name):
+        if account_name not in deployed_names:
             log.error("Can not manage delegation role '%s' in account "
                     "'%s'.  Account '%s' not found in Organization" %
                     (d_spec['RoleName'], account_name, account_name))
@@ -758,54 +1004,113 @@ def manage_delegations(d_spec, args, log, deployed, auth_spec):
     if 'TrustedGroup' in d_spec and 'TrustedAccount' in d_spec:
         log.error("can not declare both 'TrustedGroup' or 'TrustedAccount' in "
                 "delegation spec for role '%s'" % d_spec['RoleName'])
-        return
+        return None
     elif 'TrustedGroup' not in d_spec and 'TrustedAccount' not in d_spec:
         log.error("neither 'TrustedGroup' or 'TrustedAccount' declared in "
                 "delegation spec for role '%s'" % d_spec['RoleName'])
-        return
+        return None
     elif 'TrustedAccount' in d_spec and d_spec['TrustedAccount']:
         # this is a service role. skip setting group policy
         pass
-    else:
-        # this is a user role. set group policies in Auth account
+    elif shard.is_first():
+        # this is a user role. set group policies in Auth account once
         set_group_assume_role_policies(args, log, deployed, auth_spec,
                 trusting_accounts, d_spec)
+    return trusting_accounts
+
 
+def manage_delegations(d_spec, args, log, deployed, auth_spec):
+    """
+    Create and manage cross account access delegations based on 
+    delegation specifications.  Manages delegation roles in 
+    trusting accounts and group policies in Auth (trusted) account.
+    """
+    trusting_accounts = plan_delegation(d_spec, args, log, deployed, auth_spec)
+    if trusting_accounts is None:
+        return
     # run manage_delegation_role() task in thread pool
-    queue_threads(log, deployed['accounts'], manage_delegation_role,
+    queue_accounts(log, deployed['accounts'], manage_delegation_role,
             f_args=(args, log, auth_spec, deployed, trusting_accounts, d_spec))
 
 
-def main():
-    args = docopt(__doc__, version=awsorgs.__version__)
-    log = get_logger(args)
-    log.debug("%s: args:\n%s" % (__name__, args))
-    args = load_config(log, args)
-    auth_spec = validate_spec(log, args)
+def schedule_accounts(accounts, tasks):
+    """
+    Order accounts for account major runs.  Accounts targeted by the
+    most specs go first, so the longest visits do not all start late.
+    """
+    weights = collections.Counter(name for _, _, targets in tasks
+            for name in targets)
+    return sorted(accounts, key=lambda a: (-weights[a['Name']], a['Name']))
 
-    org_credentials = get_assume_role_credentials(
-            args['--master-account-id'],
-            args['--org-access-role'])
-    if isinstance(org_credentials, RuntimeError):
-        log.critical(org_credentials)
-        sys.exit(1)
-    org_client = boto3.client('organizations', **org_credentials)
-    validate_master_id(org_client, auth_spec)
 
-    auth_credentials = get_assume_role_credentials(
-            args['--auth-account-id'],
-            args['--org-access-role'])
-    if isinstance(auth_credentials, RuntimeError):
-        log.critical(auth_credentials)
-        sys.exit(1)
-    iam_client = boto3.client('iam', **auth_credentials)
-    deployed = dict(
-            users = iam_client.list_users()['Users'],
-            groups = iam_client.list_groups()['Groups'],
-            accounts = [a for a in scan_deployed_accounts(log, org_client)
-                    if a['Status'] == 'ACTIVE'])
+def manage_account(account, args, log, auth_spec, deployed, tasks):
+    """
+    Apply every delegation and local_user task to an account in one
+    visit, assuming the org access role once.
+    """
+    visit = account_visit(account, args, log)
+    if visit is None:
+        return
+    for func, spec, targets in tasks:
+        # a failing spec must not stop the others in this account
+        try:
+            func(account, args, log, auth_spec, deployed, targets, spec,
+                    visit=visit)
+        except Exception:
+            log.exception("%s failed for spec '%s' in account '%s'",
+                    func.__name__, spec.get('RoleName') or spec.get('Name'),
+                    account['Name'])
+
 
+@traced
+def manage_accounts(args, log, deployed, auth_spec):
+    """
+    Account major delegations and local-users.  Plan all specs, then
+    visit each account once to apply them.
+    """
+    # Thread worker function to plan a spec
+    def plan_spec(item, plans):
+        index, planner, spec = item
+        targets = planner(spec, args, log, deployed, auth_spec)
+        if targets is not None:
+            plans[index] = targets
+
+    items = []
+    if args['delegations']:
+        items += [(manage_delegation_role, plan_delegation, d_spec)
+                for d_spec in auth_spec['delegations']]
+    if args['local-users']:
+        items += [(manage_local_user_in_accounts, plan_local_user, lu_spec)
+                for lu_spec in auth_spec['local_users']]
+    plans = {}
+    queue_threads(log, [(i, planner, spec) for i, (_, planner, spec)
+            in enumerate(items)], plan_spec, f_args=(plans,))
+    # apply specs in spec file order
+    tasks = [(func, spec, plans[i]) for i, (func, _, spec) in enumerate(items)
+            if i in plans]
+    queue_accounts(log, schedule_accounts(deployed['accounts'], tasks),
+            manage_account, f_args=(args, log, auth_spec, deployed, tasks))
+
+
+def run_modes(args, log, deployed, auth_spec, auth_credentials):
+    """Run the report or manage mode selected in args"""
     if args['report']:
+        if args['--format'] not in REPORT_FORMATS:
+            log.critical("unknown report format '%s'. choose from: %s" %
+                    (args['--format'], ', '.join(sorted(REPORT_FORMATS))))
+            sys.exit(1)
+        if args['--diff']:
+            report_fmt = None
+        else:
+            report_fmt = args['--format']
+        snapshot = open_report_snapshot(log, args)
+        if args['--cache']:
+            cache = dict(
+                    dir=os.path.expanduser(DEFAULT_REPORT_CACHE_DIR),
+                    ttl=datetime.timedelta(hours=int(args['--cache-ttl'])))
+            os.makedirs(cache['dir'], mode=0o700, exist_ok=True)
+        else:
+            cache = None
         if args['--account']:
             deployed['accounts'] = [lookup(
                 deployed['accounts'], 'Name', args['--account']
@@ -814,31 +1119,55 @@ def main():
             report_maker(log, deployed['accounts'], args['--org-access-role'], 
                 user_group_report, "IAM Users and Groups in all Org Accounts:",
                 verbose=args['--full'],
+                fmt=report_fmt,
+                sort=args['--sorted'],
+                cache=cache,
+                snapshot=snapshot,
             )
         if args['--roles']:
             report_maker(log, deployed['accounts'], args['--org-access-role'], 
                 role_report, "IAM Roles and Custom Policies in all Org Accounts:",
                 verbose=args['--full'],
+                fmt=report_fmt,
+                sort=args['--sorted'],
+                cache=cache,
+                snapshot=snapshot,
             )
         if args['--credentials']:
+            account_credentials = generate_credential_reports(log,
+                    deployed['accounts'], args['--org-access-role'])
             report_maker(log, deployed['accounts'], args['--org-access-role'], 
-                credentials_report, "IAM Credentials Report in all Org Accounts:"
+                credentials_report, "IAM Credentials Report in all Org Accounts:",
+                fmt=report_fmt,
+                sort=args['--sorted'],
+                snapshot=snapshot,
+                account_credentials=account_credentials,
             )
         if not (args['--users'] or args['--credentials'] or args['--roles']):
             report_maker(log, deployed['accounts'], args['--org-access-role'], 
                 account_authorization_report, "IAM Account Authorization:",
                 verbose=args['--full'],
+                compact=args['--compact'],
+                fmt=report_fmt,
+                sort=args['--sorted'],
+                cache=cache,
+                snapshot=snapshot,
             )
+        close_report_snapshot(log, args, snapshot)
 
     if args['users']:
         if args['--disable-expired']:
-            expire_users(log, args, deployed, auth_spec, credentials)
+            expire_users(log, args, deployed, auth_spec, auth_credentials)
         else:
             create_users(auth_credentials, args, log, deployed, auth_spec)
             create_groups(auth_credentials, args, log, deployed, auth_spec)
             manage_group_members(auth_credentials, args, log, deployed, auth_spec)
             manage_group_policies(auth_credentials, args, log, deployed, auth_spec)
 
+    if args['--by-account'] and (args['delegations'] or args['local-users']):
+        manage_accounts(args, log, deployed, auth_spec)
+        return
+
     if args['delegations']:
         queue_threads(log, auth_spec['delegations'], manage_delegations,
             f_args=(args, log, deployed, auth_spec))
@@ -847,5 +1176,54 @@ def main():
         queue_threads(log, auth_spec['local_users'], manage_local_users,
             f_args=(args, log, deployed, auth_spec))
 
+
+@forwarded
+@profiled
+def main():
+    args = docopt(__doc__, version=awsorgs.__version__)
+    log = get_logger(args)
+    log.debug("%s: args:\n%s", __name__, args)
+    args = load_config(log, args)
+    auth_spec = validate_spec(log, args)
+
+    org_credentials = get_assume_role_credentials(
+            args['--master-account-id'],
+            args['--org-access-role'])
+    if isinstance(org_credentials, RuntimeError):
+        log.critical(org_credentials)
+        sys.exit(1)
+    org_client = boto3.client('organizations', **org_credentials)
+    validate_master_id(org_client, auth_spec)
+
+    auth_credentials = get_assume_role_credentials(
+            args['--auth-account-id'],
+            args['--org-access-role'])
+    if isinstance(auth_credentials, RuntimeError):
+        log.critical(auth_credentials)
+        sys.exit(1)
+    iam_client = boto3.client('iam', **auth_credentials)
+    auth_details = scan_auth_account_details(log, iam_client)
+    deployed = dict(
+            users = auth_details['users'],
+            groups = auth_details['groups'],
+            accounts = [a for a in scan_deployed_accounts(log, org_client)
+                    if a['Status'] == 'ACTIVE'])
+
+    if args['--shards'] and int(args['--shards']) > 1:
+        if args['users'] or args['--snapshot'] or args['--diff']:
+            log.critical("--shards can not be used with 'users' mode, "
+                    "--snapshot or --diff")
+            sys.exit(1)
+        # shards print accounts in name order so reports merge in order
+        args['--sorted'] = True
+        exit_code = shard.run_shards(log, deployed['accounts'],
+                int(args['--shards']), run_modes,
+                f_args=(args, log, deployed, auth_spec, auth_credentials))
+        if exit_code:
+            sys.exit(exit_code)
+        return
+    run_modes(args, log, deployed, auth_spec, auth_credentials)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+"""Serve awsorgs console scripts from a long running process.
+
+The daemon keeps the validated spec, deployed accounts, auth account
+users and groups, account aliases and assumed role credentials in
+memory between requests.  Cached deployed state expires after --ttl
+seconds.  It is dropped before and after any request which makes
+changes, so changes are always planned against fresh state.
+Credentials are kept until shortly before they expire.
+
+Console scripts forward their command line to the daemon when the
+environment variable AWSORGS_DAEMON names its socket:
+
+  AWSORGS_DAEMON=~/.awsorgs/daemon.sock awsauth report
+
+Requests are run one at a time with the credentials and environment of
+the daemon.  If the daemon can not be reached the command runs locally.
+A request still running after --timeout seconds fails, and the daemon
+stops, since a running thread can not be killed.
+
+Usage:
+  awsorgs-daemon [--socket PATH] [--ttl SECONDS] [--timeout SECONDS] [-q] [-d]
+  awsorgs-daemon (--status|--refresh|--stop) [--socket PATH]
+  awsorgs-daemon (--help|--version)
+
+Options:
+  -h, --help            Show this help message and exit.
+  -V, --version         Display version info and exit.
+  -s, --socket PATH     Unix socket to listen on [default: ~/.awsorgs/daemon.sock].
+  -t, --ttl SECONDS     Seconds to keep deployed state cached [default: 300].
+  --timeout SECONDS     Seconds a request may run [default: 900].
+  --status              Show cache statistics of a running daemon.
+  --refresh             Drop all cached state of a running daemon.
+  --stop                Stop a running daemon.
+  -q, --quiet           Repress log output.
+  -d, --debug           Increase log level to 'DEBUG'.
+
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import threading
+import functools
+import importlib
+import traceback
+import contextlib
+import socketserver
+
+from docopt import docopt
+
+import awsorgs
+import awsorgs.warmcache
+from awsorgs.utils import yamlfmt
+
+
+DAEMON_ENV_VAR = 'AWSORGS_DAEMON'
+
+# console script modules the daemon will run
+SERVED_MODULES = (
+    'awsorgs.orgs',
+    'awsorgs.accounts',
+    'awsorgs.auth',
+    'awsorgs.loginprofile',
+)
+
+# command line options which make changes in AWS
+CHANGE_OPTIONS = ('--exec', '--new', '--reset', '--disable',
+        '--disable-expired', '--reenable')
+
+# True in the daemon process while serving requests
+_serving = False
+
+
+def connect(socket_path):
+    """Return a socket connected to the daemon at socket_path"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(os.path.expanduser(socket_path))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def call(sock, request):
+    """Send request dict over a connected socket.  Return response dict"""
+    with sock:
+        sock.sendall(json.dumps(request).encode())
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return json.loads(b''.join(chunks).decode())
+
+
+def module_name(func):
+    """Return the importable name of the module defining a main() function"""
+    name = func.__module__
+    if name == '__main__':
+        main_module = sys.modules['__main__']
+        if main_module.__spec__ is not None:
+            name = main_module.__spec__.name
+        else:
+            # run as a script, e.g. python awsorgs/auth.py
+            name = 'awsorgs.' + os.path.splitext(
+                    os.path.basename(main_module.__file__))[0]
+    return name
+
+
+def forwarded(main):
+    """
+    Decorator for console script main() functions.  Runs the command in
+    the daemon named by AWSORGS_DAEMON, if set, and exits with its status.
+    """
+    @functools.wraps(main)
+    def wrapper(*args, **kwargs):
+        socket_path = os.environ.get(DAEMON_ENV_VAR)
+        if _serving or not socket_path:
+            return main(*args, **kwargs)
+        try:
+            sock = connect(socket_path)
+        except OSError as e:
+            sys.stderr.write('awsorgs-daemon not reachable at %s: %s. '
+                    'running locally\n' % (socket_path, e))
+            return main(*args, **kwargs)
+        response = call(sock, dict(
+                action='run',
+                module=module_name(main),
+                prog=os.path.basename(sys.argv[0]),
+                argv=sys.argv[1:],
+                cwd=os.getcwd()))
+        sys.stdout.write(response['stdout'])
+        sys.stderr.write(response['stderr'])
+        sys.exit(response['exit_code'])
+    return wrapper
+
+
+def reset_logging():
+    """
+    Return logging to the state of a fresh process, so get_logger() can
+    set it up again for the next request.
+    """
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.setLevel(logging.WARNING)
+    logging.getLogger('botocore').propagate = True
+    logging.getLogger('boto3').propagate = True
+
+
+def exit_status(code, stderr):
+    """Translate a SystemExit code the way the interpreter does"""
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    stderr.write('%s\n' % code)
+    return 1
+
+
+def makes_changes(argv):
+    return any(arg.split('=')[0] in CHANGE_OPTIONS for arg in argv)
+
+
+def run_main(main, timeout, stderr):
+    """
+    Run main() in a worker thread.  Returns its exit status, or None if it
+    is still running after timeout seconds.
+    """
+    result = {}
+
+    def target():
+        try:
+            main()
+            result['exit_code'] = 0
+        except SystemExit as e:
+            result['exit_code'] = exit_status(e.code, stderr)
+        except Exception:
+            traceback.print_exc()
+            result['exit_code'] = 1
+
+    worker = threading.Thread(target=target, name='request', daemon=True)
+    worker.start()
+    worker.join(timeout)
+    return result.get('exit_code')
+
+
+def run_command(log, request, timeout=None):
+    """
+    Run a console script main() for a 'run' request.  The response has
+    'timed_out' set if main() did not return within timeout seconds.
+    """
+    if request['module'] not in SERVED_MODULES:
+        return dict(exit_code=2, stdout='', timed_out=False,
+                stderr='awsorgs-daemon does not serve %s\n' % request['module'])
+    main = importlib.import_module(request['module']).main
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    saved_argv = sys.argv
+    saved_cwd = os.getcwd()
+    start = time.perf_counter()
+    changes = makes_changes(request['argv'])
+    if changes:
+        # plan changes against deployed state read fresh from AWS
+        dropped = awsorgs.warmcache.clear(awsorgs.warmcache.STATE)
+        log.debug('dropped %s cached state entries', dropped)
+    reset_logging()
+    try:
+        os.chdir(request['cwd'])
+        sys.argv = [request['prog']] + request['argv']
+        with contextlib.redirect_stdout(stdout), \
+                contextlib.redirect_stderr(stderr):
+            exit_code = run_main(main, timeout, stderr)
+    finally:
+        sys.argv = saved_argv
+        os.chdir(saved_cwd)
+        reset_logging()
+    timed_out = exit_code is None
+    if timed_out:
+        log.critical('%s %s: still running after %ss. stopping',
+                request['prog'], ' '.join(request['argv']), timeout)
+        stderr.write('awsorgs-daemon request timed out after %ss\n' % timeout)
+        exit_code = 1
+    if changes:
+        dropped = awsorgs.warmcache.clear(awsorgs.warmcache.STATE)
+        log.debug('dropped %s cached state entries', dropped)
+    log.info('%s %s: exit %s in %.3fs', request['prog'],
+            ' '.join(request['argv']), exit_code,
+            time.perf_counter() - start)
+    return dict(exit_code=exit_code, stdout=stdout.getvalue(),
+            stderr=stderr.getvalue(), timed_out=timed_out)
+
+
+def dispatch(server, request):
+    """Return the response to a request dict"""
+    action = request.get('action')
+    if action == 'run':
+        server.requests += 1
+        response = run_command(server.log, request, server.request_timeout)
+        if response.pop('timed_out'):
+            server.stopping = True
+        return response
+    if action == 'status':
+        return dict(exit_code=0, stderr='', stdout=yamlfmt(dict(
+                pid=os.getpid(),
+                uptime=round(time.monotonic() - server.started),
+                requests=server.requests,
+                cache=awsorgs.warmcache.stats())))
+    if action == 'refresh':
+        dropped = awsorgs.warmcache.clear()
+        server.log.info('dropped %s cached entries', dropped)
+        return dict(exit_code=0, stdout='', stderr='')
+    if action == 'stop':
+        server.stopping = True
+        return dict(exit_code=0, stdout='', stderr='')
+    return dict(exit_code=2, stdout='',
+            stderr="unknown awsorgs-daemon action '%s'\n" % action)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.read().decode())
+            response = dispatch(self.server, request)
+        except (ValueError, KeyError, TypeError) as e:
+            response = dict(exit_code=2, stdout='',
+                    stderr='bad awsorgs-daemon request: %s\n' % e)
+        self.wfile.write(json.dumps(response).encode())
+
+
+def remove_stale_socket(log, socket_path):
+    """Remove socket_path unless a daemon is listening on it"""
+    if not os.path.exists(socket_path):
+        return
+    try:
+        connect(socket_path).close()
+    except OSError:
+        log.debug('removing stale socket %s', socket_path)
+        os.unlink(socket_path)
+        return
+    log.critical('awsorgs-daemon already running on %s', socket_path)
+    sys.exit(1)
+
+
+def serve(log, socket_path, ttl, timeout=None):
+    """Serve requests on socket_path, one at a time, until stopped"""
+    global _serving
+    socket_path = os.path.expanduser(socket_path)
+    os.makedirs(os.path.dirname(socket_path) or '.', exist_ok=True)
+    remove_stale_socket(log, socket_path)
+    for name in SERVED_MODULES:
+        importlib.import_module(name)
+    # only the owner may connect
+    umask = os.umask(0o077)
+    try:
+        server = socketserver.UnixStreamServer(socket_path, RequestHandler)
+    finally:
+        os.umask(umask)
+    server.log = log
+    server.started = time.monotonic()
+    server.requests = 0
+    server.stopping = False
+    server.request_timeout = timeout
+    awsorgs.warmcache.enable(ttl)
+    _serving = True
+    log.info('listening on %s', socket_path)
+    try:
+        while not server.stopping:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _serving = False
+        awsorgs.warmcache.disable()
+        server.server_close()
+        os.unlink(socket_path)
+        log.info('stopped')
+
+
+def get_daemon_logger(args):
+    """Log to stderr, apart from the loggers set up for each request"""
+    log = logging.getLogger(__name__)
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter(
+            '%(asctime)s %(name)s: %(levelname)-9s%(message)s'))
+    log.addHandler(handler)
+    log.propagate = False
+    log.setLevel(logging.INFO)
+    if args['--debug']:
+        log.setLevel(logging.DEBUG)
+    if args['--quiet']:
+        log.setLevel(logging.CRITICAL)
+    return log
+
+
+def main():
+    args = docopt(__doc__, version=awsorgs.__version__)
+    for action in ('status', 'refresh', 'stop'):
+        if args['--' + action]:
+            try:
+                response = call(connect(args['--socket']), dict(action=action))
+            except OSError as e:
+                sys.exit('awsorgs-daemon not reachable at %s: %s'
+                        % (args['--socket'], e))
+            sys.stdout.write(response['stdout'])
+            sys.stderr.write(response['stderr'])
+            sys.exit(response['exit_code'])
+    log = get_daemon_logger(args)
+    serve(log, args['--socket'], float(args['--ttl']),
+            float(args['--timeout']))
+
+
+if __name__ == '__main__':
+    main()
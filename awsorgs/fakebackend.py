@@ -0,0 +1,1448 @@
+"""In-process stand-in for the AWS Organizations, IAM and STS APIs.
+
+A FakeBackend holds the state of an organization and the IAM state of each
+of its accounts in memory.  Installing it registers event handlers on the
+boto3 default session, the factory behind every boto3.client() and
+boto3.resource() call in awsorgs.  Requests are then answered from the
+fake state and never reach the network.  Parameters are still validated
+by botocore and responses go through botocore's after-call handlers, so
+awsorgs code runs unchanged.
+
+    backend = FakeBackend(master_account_id='111111111111', latency=0.01)
+    backend.load_state(state)
+    backend.install()
+    ...
+    print(backend.call_counts())
+    backend.uninstall()
+
+Per call latency, throttling and call accounting are configurable so large
+organizations can be exercised offline.  Only the operations awsorgs uses
+are implemented.
+"""
+
+import io
+import sys
+import csv
+import json
+import time
+import random
+import datetime
+import threading
+import itertools
+import collections
+import urllib.parse
+
+from botocore import xform_name
+from botocore.awsrequest import AWSResponse
+
+from awsorgs.utils import boto3
+
+
+FAKE_REGION = 'us-east-1'
+FAKE_SECRET_KEY = 'fake-secret-access-key'
+ORG_ACCESS_ROLE = 'OrganizationAccountAccessRole'
+DEFAULT_SC_POLICY = 'FullAWSAccess'
+
+# A handful of real AWS managed policy names, listed first so lookups on
+# the first page of list_policies() find them.  The rest of the catalogue
+# is padded with synthetic names to a realistic size.
+AWS_MANAGED_POLICIES = [
+    'AdministratorAccess',
+    'PowerUserAccess',
+    'ReadOnlyAccess',
+    'ViewOnlyAccess',
+    'SecurityAudit',
+    'IAMFullAccess',
+    'IAMReadOnlyAccess',
+    'IAMUserChangePassword',
+    'Billing',
+    'SupportUser',
+    'AWSSupportAccess',
+    'AmazonEC2FullAccess',
+    'AmazonEC2ReadOnlyAccess',
+    'AmazonS3FullAccess',
+    'AmazonS3ReadOnlyAccess',
+    'AmazonVPCFullAccess',
+    'AWSCloudTrail_FullAccess',
+    'CloudWatchFullAccess',
+    'AWSOrganizationsFullAccess',
+    'AWSOrganizationsReadOnlyAccess',
+]
+AWS_MANAGED_POLICY_COUNT = 1000
+
+# Entity counts returned by page operations when the caller does not set
+# MaxItems / MaxResults.
+IAM_PAGE_SIZE = 100
+ORG_PAGE_SIZE = 20
+
+CREDENTIAL_REPORT_FIELDS = [
+    'user', 'arn', 'user_creation_time', 'password_enabled',
+    'password_last_used', 'password_last_changed', 'password_next_rotation',
+    'mfa_active', 'access_key_1_active', 'access_key_1_last_rotated',
+    'access_key_1_last_used_date', 'access_key_1_last_used_region',
+    'access_key_1_last_used_service', 'access_key_2_active',
+    'access_key_2_last_rotated', 'access_key_2_last_used_date',
+    'access_key_2_last_used_region', 'access_key_2_last_used_service',
+    'cert_1_active', 'cert_1_last_rotated', 'cert_2_active',
+    'cert_2_last_rotated',
+]
+
+
+class FakeError(Exception):
+    """An AWS error response: error code, message and http status"""
+
+    def __init__(self, code, message, status=400):
+        super(FakeError, self).__init__(message)
+        self.code = code
+        self.message = message
+        self.status = status
+
+
+def utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def encode_document(document):
+    """IAM returns policy documents as url encoded json"""
+    return urllib.parse.quote(json.dumps(document))
+
+
+def decode_document(document):
+    """Policy documents are passed to IAM as json strings"""
+    if isinstance(document, str):
+        return json.loads(document)
+    return document
+
+
+def default_trust_policy(account_id):
+    return dict(Version='2012-10-17', Statement=[dict(
+            Effect='Allow',
+            Principal=dict(AWS='arn:aws:iam::%s:root' % account_id),
+            Action='sts:AssumeRole')])
+
+
+def default_policy_document():
+    return dict(Version='2012-10-17', Statement=[dict(
+            Effect='Allow', Action='*', Resource='*')])
+
+
+def paginate(items, params, key, marker='Marker', limit='MaxItems',
+        page_size=IAM_PAGE_SIZE):
+    """
+    Return a response dict holding one page of 'items' under 'key'.
+    IAM style pages use Marker/MaxItems and set IsTruncated.  Organizations
+    style pages (marker='NextToken', limit='MaxResults') only set NextToken.
+    """
+    start = int(params.get(marker) or 0)
+    size = params.get(limit) or page_size
+    page = items[start:start + size]
+    response = {key: page}
+    truncated = start + size < len(items)
+    if marker == 'Marker':
+        response['IsTruncated'] = truncated
+    if truncated:
+        response[marker] = str(start + size)
+    return response
+
+
+class FakeBackend(object):
+    """
+    In memory Organizations, IAM and STS state plus the botocore event
+    handlers that serve it.
+
+    latency::       seconds to sleep in each call.
+    latencies::     dict of per operation latency overrides, keyed by
+                    'service.Operation', e.g. {'iam.ListPolicies': 0.2}.
+    throttle_rate:: probability that any single attempt is throttled.
+                    Throttled attempts are retried inside the backend
+                    with exponential backoff starting at 'retry_delay',
+                    as botocore would, up to 'max_attempts'.
+    seed::          seed for throttling decisions.
+    """
+
+    def __init__(self, master_account_id='111111111111',
+            master_account_name='master', latency=0.0, latencies=None,
+            throttle_rate=0.0, max_attempts=10, retry_delay=0.0, seed=0):
+        self.latency = latency
+        self.latencies = latencies or {}
+        self.throttle_rate = throttle_rate
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.ids = itertools.count(1)
+        self.session = None
+        self.reset_counts()
+
+        # access key -> caller identity
+        self.identities = {}
+
+        # organization state
+        self.master_account_id = master_account_id
+        self.org = dict(
+            Id='o-fake%08x' % int(master_account_id),
+            Arn='arn:aws:organizations::%s:organization/o-fake' % master_account_id,
+            FeatureSet='ALL',
+            MasterAccountArn='arn:aws:organizations::%s:account/o-fake/%s' %
+                    (master_account_id, master_account_id),
+            MasterAccountId=master_account_id,
+            MasterAccountEmail='%s@example.com' % master_account_name,
+            AvailablePolicyTypes=[dict(Type='SERVICE_CONTROL_POLICY',
+                    Status='ENABLED')],
+        )
+        self.root = dict(
+            Id='r-fake',
+            Arn='arn:aws:organizations::%s:root/o-fake/r-fake' % master_account_id,
+            Name='Root',
+            PolicyTypes=[dict(Type='SERVICE_CONTROL_POLICY', Status='ENABLED')],
+        )
+        self.ous = {}
+        self.accounts = {}
+        self.parents = {}
+        self.children = collections.defaultdict(list)
+        self.sc_policies = {}
+        self.policy_targets = collections.defaultdict(list)
+        self.create_statuses = []
+        self.handshakes = []
+        self.iam_accounts = {}
+        self.aws_policies = self.make_aws_policies()
+
+        full_access = self.add_sc_policy(DEFAULT_SC_POLICY,
+                'Allows access to every operation', default_policy_document(),
+                aws_managed=True)
+        self.policy_targets[full_access].append(self.root['Id'])
+        self.add_account(master_account_name, master_account_id,
+                email=self.org['MasterAccountEmail'], parent_id=self.root['Id'],
+                joined_method='CREATED')
+
+    # Installation
+
+    def install(self, account_id=None):
+        """
+        Point the boto3 default session at this backend.  Clients and
+        resources created afterwards are served from the fake state, with
+        default credentials belonging to 'account_id', or to the master
+        account if not given.
+        """
+        boto3.setup_default_session(
+                region_name=FAKE_REGION,
+                aws_access_key_id=self.access_key(
+                        account_id or self.master_account_id),
+                aws_secret_access_key=FAKE_SECRET_KEY)
+        self.session = boto3.DEFAULT_SESSION
+        self.session.events.register('before-parameter-build',
+                self.capture_params, unique_id='awsorgs-fakebackend-params')
+        self.session.events.register('before-call',
+                self.handle_call, unique_id='awsorgs-fakebackend-call')
+        return self
+
+    def uninstall(self):
+        """Drop the boto3 default session set up by install()"""
+        if self.session is not None and boto3.DEFAULT_SESSION is self.session:
+            boto3.DEFAULT_SESSION = None
+            if sys.modules['boto3'].DEFAULT_SESSION is self.session:
+                raise RuntimeError('boto3 default session was not restored')
+        self.session = None
+
+    def access_key(self, account_id, role_name=None):
+        """Return the fake access key id for an identity in account_id"""
+        key = 'FAKE%s%s' % (account_id, ('-' + role_name) if role_name else '')
+        if role_name:
+            arn = 'arn:aws:sts::%s:assumed-role/%s/%s' % (
+                    account_id, role_name, key)
+        else:
+            arn = 'arn:aws:iam::%s:user/admin' % account_id
+        self.identities[key] = dict(Account=account_id, Arn=arn)
+        return key
+
+    def capture_params(self, params, context, **kwargs):
+        """before-parameter-build handler: keep the api params for handle_call"""
+        context['fake_params'] = dict(params)
+
+    def handle_call(self, model, request_signer, context, **kwargs):
+        """before-call handler: answer the request from the fake state"""
+        service = model.service_model.service_name
+        credentials = request_signer._credentials
+        access_key = credentials.access_key if credentials else None
+        status, parsed = self.call(access_key, service, model.name,
+                context.get('fake_params', {}))
+        http = AWSResponse('https://%s.fake.amazonaws.com/' % service,
+                status, {}, None)
+        return http, parsed
+
+    # Call accounting
+
+    def reset_counts(self):
+        """Zero call, throttle and per account counters"""
+        self.counts_lock = threading.Lock()
+        self.calls = collections.Counter()
+        self.throttles = collections.Counter()
+        self.account_calls = collections.Counter()
+        self.errors = collections.Counter()
+
+    def call_counts(self):
+        """Return dict of call counts keyed by 'service.Operation'"""
+        with self.counts_lock:
+            return dict(sorted(self.calls.items()))
+
+    def call_report(self):
+        """Return a summary of calls, throttles and errors"""
+        with self.counts_lock:
+            return dict(
+                total_calls=sum(self.calls.values()),
+                calls=dict(sorted(self.calls.items())),
+                throttles=dict(sorted(self.throttles.items())),
+                errors=dict(sorted(self.errors.items())),
+                accounts_called=len(self.account_calls),
+            )
+
+    def call(self, access_key, service, operation, params):
+        """
+        Serve one api call.  Returns tuple (http_status, parsed_response).
+        Sleeps for the configured latency and simulates throttling and
+        retries before the operation is applied to the state.
+        """
+        op_key = '%s.%s' % (service, operation)
+        identity = self.identities.get(access_key)
+        account_id = identity['Account'] if identity else None
+        with self.counts_lock:
+            self.calls[op_key] += 1
+            self.account_calls[account_id] += 1
+
+        attempts = 0
+        while self.throttle_rate and self.random.random() < self.throttle_rate:
+            with self.counts_lock:
+                self.throttles[op_key] += 1
+            attempts += 1
+            if attempts >= self.max_attempts:
+                return self.error_response(FakeError('Throttling',
+                        'Rate exceeded'), attempts, op_key)
+            time.sleep(self.retry_delay * 2 ** (attempts - 1))
+        delay = self.latencies.get(op_key, self.latency)
+        if delay:
+            time.sleep(delay)
+
+        if identity is None:
+            return self.error_response(FakeError('InvalidClientTokenId',
+                    'The security token included in the request is invalid',
+                    403), attempts, op_key)
+        prefix = 'org' if service == 'organizations' else service
+        method = getattr(self, '%s_%s' % (prefix, xform_name(operation)), None)
+        if method is None:
+            return self.error_response(FakeError('InvalidAction',
+                    'fake backend does not implement %s' % op_key),
+                    attempts, op_key)
+        try:
+            with self.lock:
+                response = method(identity, params) or {}
+        except FakeError as e:
+            return self.error_response(e, attempts, op_key)
+        response['ResponseMetadata'] = dict(RequestId='fake-%s' % next(self.ids),
+                HTTPStatusCode=200, HTTPHeaders={}, RetryAttempts=attempts)
+        return 200, response
+
+    def error_response(self, error, attempts, op_key):
+        with self.counts_lock:
+            self.errors['%s:%s' % (op_key, error.code)] += 1
+        return error.status, dict(
+            Error=dict(Code=error.code, Message=error.message),
+            ResponseMetadata=dict(RequestId='fake-%s' % next(self.ids),
+                    HTTPStatusCode=error.status, HTTPHeaders={},
+                    RetryAttempts=attempts),
+        )
+
+    # State building
+
+    def new_id(self, prefix, width=16):
+        return '%s%0*X' % (prefix, width, next(self.ids))
+
+    def make_aws_policies(self):
+        names = list(AWS_MANAGED_POLICIES)
+        names += ['AWSServicePolicy%04d' % i
+                for i in range(AWS_MANAGED_POLICY_COUNT - len(names))]
+        now = utcnow()
+        policies = collections.OrderedDict()
+        for name in names:
+            arn = 'arn:aws:iam::aws:policy/%s' % name
+            policies[arn] = dict(
+                PolicyName=name, PolicyId=self.new_id('ANPA'), Arn=arn,
+                Path='/', DefaultVersionId='v1', AttachmentCount=0,
+                IsAttachable=True, CreateDate=now, UpdateDate=now,
+                Description='AWS managed policy %s' % name,
+                Versions=[dict(VersionId='v1', IsDefaultVersion=True,
+                        CreateDate=now, Document=default_policy_document())],
+            )
+        return policies
+
+    def iam(self, account_id):
+        """Return the IAM state of an account"""
+        try:
+            return self.iam_accounts[account_id]
+        except KeyError:
+            raise FakeError('NoSuchEntity', 'account %s not found' % account_id, 404)
+
+    def add_ou(self, name, parent_id=None):
+        """Add an organizational unit.  Returns its Id"""
+        parent_id = parent_id or self.root['Id']
+        ou_id = 'ou-fake-%08x' % next(self.ids)
+        self.ous[ou_id] = dict(Id=ou_id, Name=name,
+                Arn='arn:aws:organizations::%s:ou/o-fake/%s' %
+                        (self.master_account_id, ou_id))
+        self.parents[ou_id] = parent_id
+        self.children[parent_id].append(ou_id)
+        return ou_id
+
+    def add_account(self, name, account_id=None, email=None, parent_id=None,
+            status='ACTIVE', joined_method='CREATED', alias=None):
+        """
+        Add a member account with an empty IAM state and an
+        OrganizationAccountAccessRole trusting the master account.
+        Returns the account Id.
+        """
+        account_id = account_id or '%012d' % (900000000000 + next(self.ids))
+        parent_id = parent_id or self.root['Id']
+        self.accounts[account_id] = dict(
+            Id=account_id, Name=name, Status=status,
+            Email=email or '%s@example.com' % name,
+            Arn='arn:aws:organizations::%s:account/o-fake/%s' %
+                    (self.master_account_id, account_id),
+            JoinedMethod=joined_method, JoinedTimestamp=utcnow(),
+        )
+        self.parents[account_id] = parent_id
+        self.children[parent_id].append(account_id)
+        self.iam_accounts[account_id] = dict(
+            users=collections.OrderedDict(),
+            groups=collections.OrderedDict(),
+            roles=collections.OrderedDict(),
+            policies=collections.OrderedDict(),
+            aliases=[alias] if alias else [],
+            report_time=None,
+        )
+        if account_id != self.master_account_id:
+            self.create_role(account_id, ORG_ACCESS_ROLE,
+                    default_trust_policy(self.master_account_id),
+                    policies=['arn:aws:iam::aws:policy/AdministratorAccess'])
+        return account_id
+
+    def add_sc_policy(self, name, description, content, aws_managed=False):
+        """Add a service control policy.  Returns its Id"""
+        policy_id = 'p-%s' % (name if aws_managed else '%08x' % next(self.ids))
+        self.sc_policies[policy_id] = dict(
+            PolicySummary=dict(
+                Id=policy_id, Name=name, Description=description,
+                Arn='arn:aws:organizations::%s:policy/o-fake/'
+                        'service_control_policy/%s' %
+                        (self.master_account_id, policy_id),
+                Type='SERVICE_CONTROL_POLICY', AwsManaged=aws_managed),
+            Content=content if isinstance(content, str) else json.dumps(content),
+        )
+        return policy_id
+
+    def policy_arn(self, account_id, policy):
+        """Resolve a policy name or arn to an arn in account_id"""
+        if policy.startswith('arn:'):
+            return policy
+        aws_arn = 'arn:aws:iam::aws:policy/%s' % policy
+        if aws_arn in self.aws_policies:
+            return aws_arn
+        for arn, p in self.iam(account_id)['policies'].items():
+            if p['PolicyName'] == policy:
+                return arn
+        raise ValueError('no such policy %s in account %s' % (policy, account_id))
+
+    def create_user(self, account_id, name, path='/', groups=(), policies=(),
+            login_profile=None, access_keys=0):
+        iam = self.iam(account_id)
+        iam['users'][name] = dict(
+            UserName=name, UserId=self.new_id('AIDA'), Path=path,
+            Arn='arn:aws:iam::%s:user%s%s' % (account_id, path, name),
+            CreateDate=utcnow(), Groups=[], AttachedPolicies=[],
+            InlinePolicies=collections.OrderedDict(), LoginProfile=None,
+            AccessKeys=[], MFADevices=[], SigningCertificates=[],
+        )
+        user = iam['users'][name]
+        for group_name in groups:
+            self.add_user_to_group(account_id, group_name, name)
+        for policy in policies:
+            self.attach(account_id, user, self.policy_arn(account_id, policy))
+        if login_profile is not None:
+            user['LoginProfile'] = dict(UserName=name,
+                    CreateDate=login_profile.get('CreateDate', utcnow()),
+                    PasswordResetRequired=login_profile.get(
+                            'PasswordResetRequired', True))
+        for _ in range(access_keys):
+            user['AccessKeys'].append(dict(UserName=name,
+                    AccessKeyId=self.new_id('AKIA'), Status='Active',
+                    CreateDate=utcnow()))
+        return user
+
+    def create_group(self, account_id, name, path='/', policies=(),
+            inline_policies=None):
+        iam = self.iam(account_id)
+        iam['groups'][name] = dict(
+            GroupName=name, GroupId=self.new_id('AGPA'), Path=path,
+            Arn='arn:aws:iam::%s:group%s%s' % (account_id, path, name),
+            CreateDate=utcnow(), Users=[], AttachedPolicies=[],
+            InlinePolicies=collections.OrderedDict(inline_policies or {}),
+        )
+        group = iam['groups'][name]
+        for policy in policies:
+            self.attach(account_id, group, self.policy_arn(account_id, policy))
+        return group
+
+    def create_role(self, account_id, name, trust_policy, path='/',
+            description=None, max_session_duration=3600, policies=()):
+        iam = self.iam(account_id)
+        iam['roles'][name] = dict(
+            RoleName=name, RoleId=self.new_id('AROA'), Path=path,
+            Arn='arn:aws:iam::%s:role%s%s' % (account_id, path, name),
+            CreateDate=utcnow(), AssumeRolePolicyDocument=trust_policy,
+            Description=description, MaxSessionDuration=max_session_duration,
+            AttachedPolicies=[], InlinePolicies=collections.OrderedDict(),
+        )
+        role = iam['roles'][name]
+        for policy in policies:
+            self.attach(account_id, role, self.policy_arn(account_id, policy))
+        return role
+
+    def create_managed_policy(self, account_id, name, document, path='/',
+            description=None):
+        iam = self.iam(account_id)
+        arn = 'arn:aws:iam::%s:policy%s%s' % (account_id, path, name)
+        now = utcnow()
+        iam['policies'][arn] = dict(
+            PolicyName=name, PolicyId=self.new_id('ANPA'), Arn=arn, Path=path,
+            DefaultVersionId='v1', AttachmentCount=0, IsAttachable=True,
+            Description=description, CreateDate=now, UpdateDate=now,
+            Versions=[dict(VersionId='v1', IsDefaultVersion=True,
+                    CreateDate=now, Document=document)],
+            NextVersion=2,
+        )
+        return iam['policies'][arn]
+
+    def add_user_to_group(self, account_id, group_name, user_name):
+        iam = self.iam(account_id)
+        user = self.get_entity(iam, 'users', user_name)
+        group = self.get_entity(iam, 'groups', group_name)
+        if group_name not in user['Groups']:
+            user['Groups'].append(group_name)
+            group['Users'].append(user_name)
+
+    def attach(self, account_id, entity, arn):
+        policy = self.managed_policy(account_id, arn)
+        if arn not in entity['AttachedPolicies']:
+            entity['AttachedPolicies'].append(arn)
+            policy['AttachmentCount'] += 1
+
+    def detach(self, account_id, entity, arn):
+        if arn not in entity['AttachedPolicies']:
+            raise FakeError('NoSuchEntity', 'Policy %s is not attached' % arn, 404)
+        entity['AttachedPolicies'].remove(arn)
+        self.managed_policy(account_id, arn)['AttachmentCount'] -= 1
+
+    def load_state(self, state):
+        """
+        Load deployed state, as produced by the synthetic org generator:
+
+        organizational_units::  list of dict(Name, Parent), parents first.
+                                Parent is an OU name or 'root'.
+        accounts::              list of dict(Name, Id, Email, Parent, Status,
+                                Alias).
+        sc_policies::           list of dict(Name, Description, Content,
+                                Targets).  Targets are OU names.
+        iam::                   dict keyed by account name of dict(users,
+                                groups, roles, policies).  See add_iam_state().
+        """
+        with self.lock:
+            ou_ids = dict(root=self.root['Id'])
+            for ou in state.get('organizational_units', []):
+                ou_ids[ou['Name']] = self.add_ou(ou['Name'],
+                        ou_ids[ou.get('Parent', 'root')])
+            account_ids = {self.accounts[self.master_account_id]['Name']:
+                    self.master_account_id}
+            for account in state.get('accounts', []):
+                parent_id = ou_ids[account.get('Parent', 'root')]
+                if account.get('Id') == self.master_account_id:
+                    master = self.accounts[self.master_account_id]
+                    master['Name'] = account['Name']
+                    master['Email'] = account.get('Email', master['Email'])
+                    self.move(self.master_account_id, parent_id)
+                    if account.get('Alias'):
+                        self.iam(self.master_account_id)['aliases'] = [account['Alias']]
+                    account_ids[account['Name']] = self.master_account_id
+                    continue
+                account_ids[account['Name']] = self.add_account(
+                        account['Name'], account.get('Id'),
+                        email=account.get('Email'), parent_id=parent_id,
+                        status=account.get('Status', 'ACTIVE'),
+                        alias=account.get('Alias'))
+            for policy in state.get('sc_policies', []):
+                policy_id = self.add_sc_policy(policy['Name'],
+                        policy.get('Description', ''), policy['Content'])
+                for target in policy.get('Targets', []):
+                    self.policy_targets[policy_id].append(ou_ids[target])
+            for account_name, iam_state in state.get('iam', {}).items():
+                self.add_iam_state(account_ids[account_name], iam_state)
+
+    def add_iam_state(self, account_id, iam_state):
+        """
+        Load IAM entities into an account.  iam_state holds lists of
+        policies (Name, Document, Path, Description), groups (Name, Path,
+        Policies, InlinePolicies), users (Name, Path, Groups, Policies,
+        LoginProfile, AccessKeys) and roles (Name, Path, Description,
+        MaxSessionDuration, AssumeRolePolicyDocument, Policies).  Policies
+        are referred to by name or arn.
+        """
+        for p in iam_state.get('policies', []):
+            self.create_managed_policy(account_id, p['Name'], p['Document'],
+                    path=p.get('Path', '/'), description=p.get('Description'))
+        for g in iam_state.get('groups', []):
+            self.create_group(account_id, g['Name'], path=g.get('Path', '/'),
+                    policies=g.get('Policies', []),
+                    inline_policies=g.get('InlinePolicies'))
+        for u in iam_state.get('users', []):
+            self.create_user(account_id, u['Name'], path=u.get('Path', '/'),
+                    groups=u.get('Groups', []), policies=u.get('Policies', []),
+                    login_profile=u.get('LoginProfile'),
+                    access_keys=u.get('AccessKeys', 0))
+        for r in iam_state.get('roles', []):
+            self.create_role(account_id, r['Name'],
+                    r.get('AssumeRolePolicyDocument',
+                            default_trust_policy(self.master_account_id)),
+                    path=r.get('Path', '/'), description=r.get('Description'),
+                    max_session_duration=r.get('MaxSessionDuration', 3600),
+                    policies=r.get('Policies', []))
+
+    # STS
+
+    def sts_get_caller_identity(self, identity, params):
+        return dict(UserId='AIDAFAKE', Account=identity['Account'],
+                Arn=identity['Arn'])
+
+    def sts_assume_role(self, identity, params):
+        arn = params['RoleArn']
+        account_id = arn.split(':')[4]
+        role_name = arn.split('/')[-1]
+        if (account_id not in self.iam_accounts
+                or role_name not in self.iam_accounts[account_id]['roles']):
+            raise FakeError('AccessDenied', 'User %s is not authorized to '
+                    'perform: sts:AssumeRole on resource: %s' %
+                    (identity['Arn'], arn), 403)
+        access_key = self.access_key(account_id, role_name)
+        return dict(
+            Credentials=dict(AccessKeyId=access_key,
+                    SecretAccessKey=FAKE_SECRET_KEY,
+                    SessionToken='fake-session-token',
+                    Expiration=utcnow() + datetime.timedelta(hours=1)),
+            AssumedRoleUser=dict(AssumedRoleId='AROAFAKE:%s' %
+                    params['RoleSessionName'],
+                    Arn=self.identities[access_key]['Arn']),
+        )
+
+    # Organizations
+
+    def org_check_master(self, identity):
+        if identity['Account'] != self.master_account_id:
+            raise FakeError('AccessDeniedException', 'You don\'t have '
+                    'permissions to access this resource.', 403)
+
+    def org_page(self, items, params, key):
+        return paginate(items, params, key, marker='NextToken',
+                limit='MaxResults', page_size=ORG_PAGE_SIZE)
+
+    def org_target(self, target_id):
+        if target_id == self.root['Id']:
+            return dict(TargetId=target_id, Arn=self.root['Arn'],
+                    Name=self.root['Name'], Type='ROOT')
+        if target_id in self.ous:
+            ou = self.ous[target_id]
+            return dict(TargetId=target_id, Arn=ou['Arn'], Name=ou['Name'],
+                    Type='ORGANIZATIONAL_UNIT')
+        if target_id in self.accounts:
+            account = self.accounts[target_id]
+            return dict(TargetId=target_id, Arn=account['Arn'],
+                    Name=account['Name'], Type='ACCOUNT')
+        raise FakeError('TargetNotFoundException', 'target %s not found' % target_id)
+
+    def org_sc_policy(self, policy_id):
+        try:
+            return self.sc_policies[policy_id]
+        except KeyError:
+            raise FakeError('PolicyNotFoundException',
+                    'policy %s not found' % policy_id)
+
+    def move(self, child_id, parent_id):
+        self.children[self.parents[child_id]].remove(child_id)
+        self.parents[child_id] = parent_id
+        self.children[parent_id].append(child_id)
+
+    def org_describe_organization(self, identity, params):
+        return dict(Organization=dict(self.org))
+
+    def org_list_roots(self, identity, params):
+        self.org_check_master(identity)
+        return self.org_page([dict(self.root)], params, 'Roots')
+
+    def org_enable_policy_type(self, identity, params):
+        self.org_check_master(identity)
+        return dict(Root=dict(self.root))
+
+    def org_list_accounts(self, identity, params):
+        self.org_check_master(identity)
+        return self.org_page([dict(a) for a in self.accounts.values()],
+                params, 'Accounts')
+
+    def org_list_accounts_for_parent(self, identity, params):
+        self.org_check_master(identity)
+        return self.org_page([dict(self.accounts[c])
+                for c in self.children.get(params['ParentId'], [])
+                if c in self.accounts], params, 'Accounts')
+
+    def org_list_organizational_units_for_parent(self, identity, params):
+        self.org_check_master(identity)
+        return self.org_page([dict(self.ous[c])
+                for c in self.children.get(params['ParentId'], [])
+                if c in self.ous], params, 'OrganizationalUnits')
+
+    def org_list_parents(self, identity, params):
+        self.org_check_master(identity)
+        parent_id = self.parents.get(params['ChildId'])
+        if parent_id is None:
+            raise FakeError('ChildNotFoundException',
+                    'child %s not found' % params['ChildId'])
+        parent_type = 'ROOT' if parent_id == self.root['Id'] else 'ORGANIZATIONAL_UNIT'
+        return dict(Parents=[dict(Id=parent_id, Type=parent_type)])
+
+    def org_create_organizational_unit(self, identity, params):
+        self.org_check_master(identity)
+        parent_id = params['ParentId']
+        for child in self.children.get(parent_id, []):
+            if child in self.ous and self.ous[child]['Name'] == params['Name']:
+                raise FakeError('DuplicateOrganizationalUnitException',
+                        'OU %s already exists' % params['Name'])
+        ou_id = self.add_ou(params['Name'], parent_id)
+        return dict(OrganizationalUnit=dict(self.ous[ou_id]))
+
+    def org_delete_organizational_unit(self, identity, params):
+        self.org_check_master(identity)
+        ou_id = params['OrganizationalUnitId']
+        if ou_id not in self.ous:
+            raise FakeError('OrganizationalUnitNotFoundException',
+                    'OU %s not found' % ou_id)
+        if self.children.get(ou_id):
+            raise FakeError('OrganizationalUnitNotEmptyException',
+                    'OU %s is not empty' % ou_id)
+        self.children[self.parents.pop(ou_id)].remove(ou_id)
+        del self.ous[ou_id]
+        for targets in self.policy_targets.values():
+            if ou_id in targets:
+                targets.remove(ou_id)
+
+    def org_move_account(self, identity, params):
+        self.org_check_master(identity)
+        account_id = params['AccountId']
+        if self.parents.get(account_id) != params['SourceParentId']:
+            raise FakeError('SourceParentNotFoundException',
+                    'account %s is not in %s' %
+                    (account_id, params['SourceParentId']))
+        self.org_target(params['DestinationParentId'])
+        self.move(account_id, params['DestinationParentId'])
+
+    def org_list_policies(self, identity, params):
+        self.org_check_master(identity)
+        return self.org_page([dict(p['PolicySummary'])
+                for p in self.sc_policies.values()], params, 'Policies')
+
+    def org_list_policies_for_target(self, identity, params):
+        self.org_check_master(identity)
+        target_id = params['TargetId']
+        self.org_target(target_id)
+        return self.org_page([dict(p['PolicySummary'])
+                for policy_id, p in self.sc_policies.items()
+                if target_id in self.policy_targets.get(policy_id, [])],
+                params, 'Policies')
+
+    def org_list_targets_for_policy(self, identity, params):
+        self.org_check_master(identity)
+        self.org_sc_policy(params['PolicyId'])
+        return self.org_page([self.org_target(t)
+                for t in self.policy_targets.get(params['PolicyId'], [])],
+                params, 'Targets')
+
+    def org_describe_policy(self, identity, params):
+        self.org_check_master(identity)
+        policy = self.org_sc_policy(params['PolicyId'])
+        return dict(Policy=dict(PolicySummary=dict(policy['PolicySummary']),
+                Content=policy['Content']))
+
+    def org_create_policy(self, identity, params):
+        self.org_check_master(identity)
+        for p in self.sc_policies.values():
+            if p['PolicySummary']['Name'] == params['Name']:
+                raise FakeError('DuplicatePolicyException',
+                        'policy %s already exists' % params['Name'])
+        policy_id = self.add_sc_policy(params['Name'], params['Description'],
+                params['Content'])
+        return self.org_describe_policy(identity, dict(PolicyId=policy_id))
+
+    def org_update_policy(self, identity, params):
+        self.org_check_master(identity)
+        policy = self.org_sc_policy(params['PolicyId'])
+        for key in ['Name', 'Description']:
+            if key in params:
+                policy['PolicySummary'][key] = params[key]
+        if 'Content' in params:
+            policy['Content'] = params['Content']
+        return self.org_describe_policy(identity, params)
+
+    def org_delete_policy(self, identity, params):
+        self.org_check_master(identity)
+        self.org_sc_policy(params['PolicyId'])
+        if self.policy_targets.get(params['PolicyId']):
+            raise FakeError('PolicyInUseException',
+                    'policy %s is attached' % params['PolicyId'])
+        del self.sc_policies[params['PolicyId']]
+
+    def org_attach_policy(self, identity, params):
+        self.org_check_master(identity)
+        self.org_sc_policy(params['PolicyId'])
+        self.org_target(params['TargetId'])
+        targets = self.policy_targets[params['PolicyId']]
+        if params['TargetId'] in targets:
+            raise FakeError('DuplicatePolicyAttachmentException',
+                    'policy already attached')
+        targets.append(params['TargetId'])
+
+    def org_detach_policy(self, identity, params):
+        self.org_check_master(identity)
+        targets = self.policy_targets[params['PolicyId']]
+        if params['TargetId'] not in targets:
+            raise FakeError('PolicyNotAttachedException', 'policy not attached')
+        targets.remove(params['TargetId'])
+
+    def org_create_account(self, identity, params):
+        self.org_check_master(identity)
+        account_id = self.add_account(params['AccountName'],
+                email=params['Email'])
+        status = dict(Id='car-%032x' % next(self.ids),
+                AccountName=params['AccountName'], State='SUCCEEDED',
+                RequestedTimestamp=utcnow(), CompletedTimestamp=utcnow(),
+                AccountId=account_id)
+        self.create_statuses.append(status)
+        return dict(CreateAccountStatus=dict(status))
+
+    def org_describe_create_account_status(self, identity, params):
+        self.org_check_master(identity)
+        for status in self.create_statuses:
+            if status['Id'] == params['CreateAccountRequestId']:
+                return dict(CreateAccountStatus=dict(status))
+        raise FakeError('CreateAccountStatusNotFoundException',
+                'request %s not found' % params['CreateAccountRequestId'])
+
+    def org_list_create_account_status(self, identity, params):
+        self.org_check_master(identity)
+        states = params.get('States')
+        return self.org_page([dict(s) for s in self.create_statuses
+                if not states or s['State'] in states],
+                params, 'CreateAccountStatuses')
+
+    def org_list_handshakes_for_organization(self, identity, params):
+        self.org_check_master(identity)
+        action = params.get('Filter', {}).get('ActionType')
+        return self.org_page([dict(h) for h in self.handshakes
+                if not action or h['Action'] == action], params, 'Handshakes')
+
+    def org_invite_account_to_organization(self, identity, params):
+        self.org_check_master(identity)
+        handshake = dict(
+            Id='h-%032x' % next(self.ids), State='OPEN', Action='INVITE',
+            Parties=[dict(params['Target']),
+                    dict(Id=self.org['Id'], Type='ORGANIZATION')],
+            RequestedTimestamp=utcnow(),
+            ExpirationTimestamp=utcnow() + datetime.timedelta(days=15),
+        )
+        self.handshakes.append(handshake)
+        return dict(Handshake=dict(handshake))
+
+    # IAM helpers
+
+    def get_entity(self, iam, kind, name):
+        try:
+            return iam[kind][name]
+        except KeyError:
+            raise FakeError('NoSuchEntity', 'The %s with name %s cannot be '
+                    'found.' % (kind[:-1], name), 404)
+
+    def check_new_entity(self, iam, kind, name):
+        if name in iam[kind]:
+            raise FakeError('EntityAlreadyExists', '%s with name %s already '
+                    'exists.' % (kind[:-1].capitalize(), name), 409)
+
+    def managed_policy(self, account_id, arn):
+        policy = (self.aws_policies.get(arn)
+                or self.iam(account_id)['policies'].get(arn))
+        if policy is None:
+            raise FakeError('NoSuchEntity', 'Policy %s does not exist' % arn, 404)
+        return policy
+
+    def attached_policies(self, account_id, entity):
+        return [dict(PolicyName=self.managed_policy(account_id, arn)['PolicyName'],
+                PolicyArn=arn) for arn in entity['AttachedPolicies']]
+
+    def user_info(self, user):
+        return {k: user[k] for k in
+                ['Path', 'UserName', 'UserId', 'Arn', 'CreateDate']}
+
+    def group_info(self, group):
+        return {k: group[k] for k in
+                ['Path', 'GroupName', 'GroupId', 'Arn', 'CreateDate']}
+
+    def role_info(self, role, document=True):
+        info = {k: role[k] for k in ['Path', 'RoleName', 'RoleId', 'Arn',
+                'CreateDate', 'MaxSessionDuration']}
+        if role['Description'] is not None:
+            info['Description'] = role['Description']
+        if document:
+            info['AssumeRolePolicyDocument'] = encode_document(
+                    role['AssumeRolePolicyDocument'])
+        return info
+
+    def policy_info(self, policy):
+        info = {k: policy[k] for k in ['PolicyName', 'PolicyId', 'Arn', 'Path',
+                'DefaultVersionId', 'AttachmentCount', 'IsAttachable',
+                'CreateDate', 'UpdateDate']}
+        info['PermissionsBoundaryUsageCount'] = 0
+        return info
+
+    def version_info(self, version, document=True):
+        info = {k: version[k] for k in
+                ['VersionId', 'IsDefaultVersion', 'CreateDate']}
+        if document:
+            info['Document'] = encode_document(version['Document'])
+        return info
+
+    # IAM account
+
+    def iam_list_account_aliases(self, identity, params):
+        iam = self.iam(identity['Account'])
+        return dict(AccountAliases=list(iam['aliases']), IsTruncated=False)
+
+    def iam_create_account_alias(self, identity, params):
+        iam = self.iam(identity['Account'])
+        if iam['aliases']:
+            raise FakeError('EntityAlreadyExists', 'account already has an alias', 409)
+        iam['aliases'] = [params['AccountAlias']]
+
+    def iam_delete_account_alias(self, identity, params):
+        iam = self.iam(identity['Account'])
+        if params['AccountAlias'] not in iam['aliases']:
+            raise FakeError('NoSuchEntity', 'no such alias', 404)
+        iam['aliases'] = []
+
+    def iam_get_account_summary(self, identity, params):
+        iam = self.iam(identity['Account'])
+        return dict(SummaryMap=dict(
+            Users=len(iam['users']), UsersQuota=5000,
+            Groups=len(iam['groups']), GroupsQuota=300,
+            Roles=len(iam['roles']), RolesQuota=1000,
+            Policies=len(iam['policies']), PoliciesQuota=1500,
+            PolicyVersionsInUse=sum(p['AttachmentCount']
+                    for p in iam['policies'].values()),
+            PolicyVersionsInUseQuota=10000,
+            GroupPolicySizeQuota=5120,
+            AccessKeysPerUserQuota=2,
+            AttachedPoliciesPerUserQuota=10,
+            AccountMFAEnabled=0,
+        ))
+
+    def iam_generate_credential_report(self, identity, params):
+        iam = self.iam(identity['Account'])
+        iam['report_time'] = utcnow()
+        return dict(State='COMPLETE', Description='report generated')
+
+    def iam_get_credential_report(self, identity, params):
+        iam = self.iam(identity['Account'])
+        if iam['report_time'] is None:
+            raise FakeError('ReportNotPresent', 'credential report not present', 410)
+        out = io.StringIO()
+        writer = csv.DictWriter(out, CREDENTIAL_REPORT_FIELDS, restval='N/A')
+        writer.writeheader()
+        for user in iam['users'].values():
+            profile = user['LoginProfile']
+            row = dict(user=user['UserName'], arn=user['Arn'],
+                    user_creation_time=user['CreateDate'].isoformat(),
+                    password_enabled='true' if profile else 'false',
+                    mfa_active='true' if user['MFADevices'] else 'false',
+                    cert_1_active='false', cert_2_active='false')
+            if profile:
+                row['password_last_changed'] = profile['CreateDate'].isoformat()
+                row['password_last_used'] = 'no_information'
+            for i in (1, 2):
+                keys = user['AccessKeys']
+                row['access_key_%s_active' % i] = 'true' if (len(keys) >= i
+                        and keys[i - 1]['Status'] == 'Active') else 'false'
+            writer.writerow(row)
+        return dict(Content=out.getvalue().encode('utf-8'),
+                ReportFormat='text/csv', GeneratedTime=iam['report_time'])
+
+    def iam_get_account_authorization_details(self, identity, params):
+        account_id = identity['Account']
+        iam = self.iam(account_id)
+        filters = params.get('Filter') or ['User', 'Group', 'Role',
+                'LocalManagedPolicy', 'AWSManagedPolicy']
+        entities = []
+        if 'User' in filters:
+            entities += [('UserDetailList', u) for u in iam['users'].values()]
+        if 'Group' in filters:
+            entities += [('GroupDetailList', g) for g in iam['groups'].values()]
+        if 'Role' in filters:
+            entities += [('RoleDetailList', r) for r in iam['roles'].values()]
+        if 'LocalManagedPolicy' in filters:
+            entities += [('Policies', p) for p in iam['policies'].values()]
+        if 'AWSManagedPolicy' in filters:
+            attached = set()
+            for kind in ['users', 'groups', 'roles']:
+                for entity in iam[kind].values():
+                    attached.update(entity['AttachedPolicies'])
+            entities += [('Policies', p) for arn, p in self.aws_policies.items()
+                    if arn in attached]
+        page = paginate(entities, params, 'Entities')
+        response = dict(UserDetailList=[], GroupDetailList=[],
+                RoleDetailList=[], Policies=[], IsTruncated=page['IsTruncated'])
+        if 'Marker' in page:
+            response['Marker'] = page['Marker']
+        for key, entity in page['Entities']:
+            response[key].append(self.detail(account_id, key, entity))
+        return response
+
+    def detail(self, account_id, key, entity):
+        """Format an entity as in get_account_authorization_details"""
+        def inline(policies):
+            return [dict(PolicyName=name, PolicyDocument=encode_document(doc))
+                    for name, doc in policies.items()]
+        if key == 'UserDetailList':
+            detail = self.user_info(entity)
+            detail.update(GroupList=list(entity['Groups']),
+                    UserPolicyList=inline(entity['InlinePolicies']),
+                    AttachedManagedPolicies=self.attached_policies(account_id, entity),
+                    Tags=[])
+        elif key == 'GroupDetailList':
+            detail = self.group_info(entity)
+            detail.update(GroupPolicyList=inline(entity['InlinePolicies']),
+                    AttachedManagedPolicies=self.attached_policies(account_id, entity))
+        elif key == 'RoleDetailList':
+            detail = self.role_info(entity)
+            detail.update(InstanceProfileList=[],
+                    RolePolicyList=inline(entity['InlinePolicies']),
+                    AttachedManagedPolicies=self.attached_policies(account_id, entity),
+                    Tags=[], RoleLastUsed={})
+        else:
+            detail = self.policy_info(entity)
+            if entity.get('Description'):
+                detail['Description'] = entity['Description']
+            detail['PolicyVersionList'] = [self.version_info(v)
+                    for v in entity['Versions']]
+        return detail
+
+    # IAM managed policies
+
+    def iam_list_policies(self, identity, params):
+        iam = self.iam(identity['Account'])
+        scope = params.get('Scope', 'All')
+        policies = []
+        if scope in ('All', 'AWS'):
+            policies += list(self.aws_policies.values())
+        if scope in ('All', 'Local'):
+            policies += list(iam['policies'].values())
+        if params.get('OnlyAttached'):
+            policies = [p for p in policies if p['AttachmentCount']]
+        if params.get('PathPrefix'):
+            policies = [p for p in policies
+                    if p['Path'].startswith(params['PathPrefix'])]
+        return paginate([self.policy_info(p) for p in policies], params,
+                'Policies')
+
+    def iam_get_policy(self, identity, params):
+        policy = self.managed_policy(identity['Account'], params['PolicyArn'])
+        info = self.policy_info(policy)
+        if policy.get('Description'):
+            info['Description'] = policy['Description']
+        return dict(Policy=info)
+
+    def iam_create_policy(self, identity, params):
+        account_id = identity['Account']
+        path = params.get('Path', '/')
+        arn = 'arn:aws:iam::%s:policy%s%s' % (account_id, path, params['PolicyName'])
+        if arn in self.iam(account_id)['policies']:
+            raise FakeError('EntityAlreadyExists', 'A policy called %s already '
+                    'exists.' % params['PolicyName'], 409)
+        policy = self.create_managed_policy(account_id, params['PolicyName'],
+                decode_document(params['PolicyDocument']), path=path,
+                description=params.get('Description'))
+        return dict(Policy=self.policy_info(policy))
+
+    def iam_delete_policy(self, identity, params):
+        account_id = identity['Account']
+        policy = self.managed_policy(account_id, params['PolicyArn'])
+        if policy['AttachmentCount']:
+            raise FakeError('DeleteConflict', 'policy is attached', 409)
+        del self.iam(account_id)['policies'][params['PolicyArn']]
+
+    def iam_get_policy_version(self, identity, params):
+        policy = self.managed_policy(identity['Account'], params['PolicyArn'])
+        for version in policy['Versions']:
+            if version['VersionId'] == params['VersionId']:
+                return dict(PolicyVersion=self.version_info(version))
+        raise FakeError('NoSuchEntity', 'version %s not found' %
+                params['VersionId'], 404)
+
+    def iam_list_policy_versions(self, identity, params):
+        policy = self.managed_policy(identity['Account'], params['PolicyArn'])
+        return paginate([self.version_info(v, document=False)
+                for v in policy['Versions']], params, 'Versions')
+
+    def iam_create_policy_version(self, identity, params):
+        policy = self.managed_policy(identity['Account'], params['PolicyArn'])
+        if len(policy['Versions']) >= 5:
+            raise FakeError('LimitExceeded', 'A managed policy can have up to '
+                    '5 versions.', 409)
+        version = dict(VersionId='v%s' % policy['NextVersion'],
+                IsDefaultVersion=False, CreateDate=utcnow(),
+                Document=decode_document(params['PolicyDocument']))
+        policy['NextVersion'] += 1
+        policy['Versions'].append(version)
+        if params.get('SetAsDefault'):
+            for v in policy['Versions']:
+                v['IsDefaultVersion'] = v is version
+            policy['DefaultVersionId'] = version['VersionId']
+            policy['UpdateDate'] = version['CreateDate']
+        return dict(PolicyVersion=self.version_info(version, document=False))
+
+    def iam_delete_policy_version(self, identity, params):
+        policy = self.managed_policy(identity['Account'], params['PolicyArn'])
+        for version in policy['Versions']:
+            if version['VersionId'] == params['VersionId']:
+                if version['IsDefaultVersion']:
+                    raise FakeError('DeleteConflict', 'Cannot delete the '
+                            'default version of a policy.', 409)
+                policy['Versions'].remove(version)
+                return
+        raise FakeError('NoSuchEntity', 'version %s not found' %
+                params['VersionId'], 404)
+
+    # IAM users
+
+    def iam_list_users(self, identity, params):
+        iam = self.iam(identity['Account'])
+        users = [self.user_info(u) for u in iam['users'].values()
+                if u['Path'].startswith(params.get('PathPrefix', '/'))]
+        return paginate(users, params, 'Users')
+
+    def iam_get_user(self, identity, params):
+        iam = self.iam(identity['Account'])
+        return dict(User=self.user_info(
+                self.get_entity(iam, 'users', params['UserName'])))
+
+    def iam_create_user(self, identity, params):
+        iam = self.iam(identity['Account'])
+        self.check_new_entity(iam, 'users', params['UserName'])
+        user = self.create_user(identity['Account'], params['UserName'],
+                path=params.get('Path', '/'))
+        return dict(User=self.user_info(user))
+
+    def iam_update_user(self, identity, params):
+        account_id = identity['Account']
+        user = self.get_entity(self.iam(account_id), 'users', params['UserName'])
+        if 'NewPath' in params:
+            user['Path'] = params['NewPath']
+            user['Arn'] = 'arn:aws:iam::%s:user%s%s' % (
+                    account_id, user['Path'], user['UserName'])
+
+    def iam_delete_user(self, identity, params):
+        iam = self.iam(identity['Account'])
+        user = self.get_entity(iam, 'users', params['UserName'])
+        for key in ['Groups', 'AttachedPolicies', 'InlinePolicies', 'AccessKeys',
+                'MFADevices', 'SigningCertificates', 'LoginProfile']:
+            if user[key]:
+                raise FakeError('DeleteConflict', 'Cannot delete entity, must '
+                        'remove %s first.' % key, 409)
+        del iam['users'][params['UserName']]
+
+    def iam_get_login_profile(self, identity, params):
+        user = self.get_entity(self.iam(identity['Account']), 'users',
+                params['UserName'])
+        if not user['LoginProfile']:
+            raise FakeError('NoSuchEntity', 'Login Profile for User %s cannot '
+                    'be found.' % params['UserName'], 404)
+        return dict(LoginProfile=dict(user['LoginProfile']))
+
+    def iam_create_login_profile(self, identity, params):
+        user = self.get_entity(self.iam(identity['Account']), 'users',
+                params['UserName'])
+        if user['LoginProfile']:
+            raise FakeError('EntityAlreadyExists', 'Login Profile for user %s '
+                    'already exists.' % params['UserName'], 409)
+        user['LoginProfile'] = dict(UserName=user['UserName'],
+                CreateDate=utcnow(),
+                PasswordResetRequired=params.get('PasswordResetRequired', False))
+        return dict(LoginProfile=dict(user['LoginProfile']))
+
+    def iam_update_login_profile(self, identity, params):
+        self.iam_get_login_profile(identity, params)
+        user = self.iam(identity['Account'])['users'][params['UserName']]
+        if 'PasswordResetRequired' in params:
+            user['LoginProfile']['PasswordResetRequired'] = params['PasswordResetRequired']
+
+    def iam_delete_login_profile(self, identity, params):
+        self.iam_get_login_profile(identity, params)
+        self.iam(identity['Account'])['users'][params['UserName']]['LoginProfile'] = None
+
+    def iam_list_access_keys(self, identity, params):
+        user = self.get_entity(self.iam(identity['Account']), 'users',
+                params['UserName'])
+        return paginate([dict(k) for k in user['AccessKeys']], params,
+                'AccessKeyMetadata')
+
+    def access_key_index(self, identity, params):
+        user = self.get_entity(self.iam(identity['Account']), 'users',
+                params['UserName'])
+        for i, key in enumerate(user['AccessKeys']):
+            if key['AccessKeyId'] == params['AccessKeyId']:
+                return user, i
+        raise FakeError('NoSuchEntity', 'access key %s not found' %
+                params['AccessKeyId'], 404)
+
+    def iam_update_access_key(self, identity, params):
+        user, i = self.access_key_index(identity, params)
+        user['AccessKeys'][i]['Status'] = params['Status']
+
+    def iam_delete_access_key(self, identity, params):
+        user, i = self.access_key_index(identity, params)
+        del user['AccessKeys'][i]
+
+    def iam_list_attached_user_policies(self, identity, params):
+        account_id = identity['Account']
+        user = self.get_entity(self.iam(account_id), 'users', params['UserName'])
+        return paginate(self.attached_policies(account_id, user), params,
+                'AttachedPolicies')
+
+    def iam_attach_user_policy(self, identity, params):
+        account_id = identity['Account']
+        user = self.get_entity(self.iam(account_id), 'users', params['UserName'])
+        self.attach(account_id, user, params['PolicyArn'])
+
+    def iam_detach_user_policy(self, identity, params):
+        account_id = identity['Account']
+        user = self.get_entity(self.iam(account_id), 'users', params['UserName'])
+        self.detach(account_id, user, params['PolicyArn'])
+
+    def iam_list_groups_for_user(self, identity, params):
+        iam = self.iam(identity['Account'])
+        user = self.get_entity(iam, 'users', params['UserName'])
+        return paginate([self.group_info(iam['groups'][g]) for g in user['Groups']],
+                params, 'Groups')
+
+    def iam_add_user_to_group(self, identity, params):
+        self.add_user_to_group(identity['Account'], params['GroupName'],
+                params['UserName'])
+
+    def iam_remove_user_from_group(self, identity, params):
+        iam = self.iam(identity['Account'])
+        user = self.get_entity(iam, 'users', params['UserName'])
+        group = self.get_entity(iam, 'groups', params['GroupName'])
+        if params['GroupName'] not in user['Groups']:
+            raise FakeError('NoSuchEntity', 'user %s is not in group %s' %
+                    (params['UserName'], params['GroupName']), 404)
+        user['Groups'].remove(params['GroupName'])
+        group['Users'].remove(params['UserName'])
+
+    def iam_list_mfa_devices(self, identity, params):
+        user = self.get_entity(self.iam(identity['Account']), 'users',
+                params['UserName'])
+        return paginate([dict(d) for d in user['MFADevices']], params,
+                'MFADevices')
+
+    def iam_deactivate_mfa_device(self, identity, params):
+        user = self.get_entity(self.iam(identity['Account']), 'users',
+                params['UserName'])
+        user['MFADevices'] = [d for d in user['MFADevices']
+                if d['SerialNumber'] != params['SerialNumber']]
+
+    def iam_list_signing_certificates(self, identity, params):
+        user = self.get_entity(self.iam(identity['Account']), 'users',
+                params['UserName'])
+        return paginate([dict(c) for c in user['SigningCertificates']], params,
+                'Certificates')
+
+    def iam_delete_signing_certificate(self, identity, params):
+        user = self.get_entity(self.iam(identity['Account']), 'users',
+                params['UserName'])
+        user['SigningCertificates'] = [c for c in user['SigningCertificates']
+                if c['CertificateId'] != params['CertificateId']]
+
+    def iam_list_user_policies(self, identity, params):
+        user = self.get_entity(self.iam(identity['Account']), 'users',
+                params['UserName'])
+        return paginate(list(user['InlinePolicies']), params, 'PolicyNames')
+
+    def iam_delete_user_policy(self, identity, params):
+        user = self.get_entity(self.iam(identity['Account']), 'users',
+                params['UserName'])
+        if user['InlinePolicies'].pop(params['PolicyName'], None) is None:
+            raise FakeError('NoSuchEntity', 'policy %s not found' %
+                    params['PolicyName'], 404)
+
+    # IAM groups
+
+    def iam_list_groups(self, identity, params):
+        iam = self.iam(identity['Account'])
+        return paginate([self.group_info(g) for g in iam['groups'].values()],
+                params, 'Groups')
+
+    def iam_get_group(self, identity, params):
+        iam = self.iam(identity['Account'])
+        group = self.get_entity(iam, 'groups', params['GroupName'])
+        response = paginate([self.user_info(iam['users'][u])
+                for u in group['Users']], params, 'Users')
+        response['Group'] = self.group_info(group)
+        return response
+
+    def iam_create_group(self, identity, params):
+        iam = self.iam(identity['Account'])
+        self.check_new_entity(iam, 'groups', params['GroupName'])
+        group = self.create_group(identity['Account'], params['GroupName'],
+                path=params.get('Path', '/'))
+        return dict(Group=self.group_info(group))
+
+    def iam_update_group(self, identity, params):
+        account_id = identity['Account']
+        group = self.get_entity(self.iam(account_id), 'groups', params['GroupName'])
+        if 'NewPath' in params:
+            group['Path'] = params['NewPath']
+            group['Arn'] = 'arn:aws:iam::%s:group%s%s' % (
+                    account_id, group['Path'], group['GroupName'])
+
+    def iam_delete_group(self, identity, params):
+        iam = self.iam(identity['Account'])
+        group = self.get_entity(iam, 'groups', params['GroupName'])
+        for key in ['Users', 'AttachedPolicies', 'InlinePolicies']:
+            if group[key]:
+                raise FakeError('DeleteConflict', 'Cannot delete entity, must '
+                        'remove %s first.' % key, 409)
+        del iam['groups'][params['GroupName']]
+
+    def iam_list_group_policies(self, identity, params):
+        group = self.get_entity(self.iam(identity['Account']), 'groups',
+                params['GroupName'])
+        return paginate(list(group['InlinePolicies']), params, 'PolicyNames')
+
+    def iam_get_group_policy(self, identity, params):
+        group = self.get_entity(self.iam(identity['Account']), 'groups',
+                params['GroupName'])
+        if params['PolicyName'] not in group['InlinePolicies']:
+            raise FakeError('NoSuchEntity', 'The group policy with name %s '
+                    'cannot be found.' % params['PolicyName'], 404)
+        return dict(GroupName=group['GroupName'],
+                PolicyName=params['PolicyName'],
+                PolicyDocument=encode_document(
+                        group['InlinePolicies'][params['PolicyName']]))
+
+    def iam_put_group_policy(self, identity, params):
+        group = self.get_entity(self.iam(identity['Account']), 'groups',
+                params['GroupName'])
+        group['InlinePolicies'][params['PolicyName']] = decode_document(
+                params['PolicyDocument'])
+
+    def iam_delete_group_policy(self, identity, params):
+        group = self.get_entity(self.iam(identity['Account']), 'groups',
+                params['GroupName'])
+        if group['InlinePolicies'].pop(params['PolicyName'], None) is None:
+            raise FakeError('NoSuchEntity', 'policy %s not found' %
+                    params['PolicyName'], 404)
+
+    def iam_list_attached_group_policies(self, identity, params):
+        account_id = identity['Account']
+        group = self.get_entity(self.iam(account_id), 'groups', params['GroupName'])
+        return paginate(self.attached_policies(account_id, group), params,
+                'AttachedPolicies')
+
+    def iam_attach_group_policy(self, identity, params):
+        account_id = identity['Account']
+        group = self.get_entity(self.iam(account_id), 'groups', params['GroupName'])
+        self.attach(account_id, group, params['PolicyArn'])
+
+    def iam_detach_group_policy(self, identity, params):
+        account_id = identity['Account']
+        group = self.get_entity(self.iam(account_id), 'groups', params['GroupName'])
+        self.detach(account_id, group, params['PolicyArn'])
+
+    # IAM roles
+
+    def iam_list_roles(self, identity, params):
+        iam = self.iam(identity['Account'])
+        return paginate([self.role_info(r) for r in iam['roles'].values()
+                if r['Path'].startswith(params.get('PathPrefix', '/'))],
+                params, 'Roles')
+
+    def iam_get_role(self, identity, params):
+        role = self.get_entity(self.iam(identity['Account']), 'roles',
+                params['RoleName'])
+        return dict(Role=self.role_info(role))
+
+    def iam_create_role(self, identity, params):
+        iam = self.iam(identity['Account'])
+        self.check_new_entity(iam, 'roles', params['RoleName'])
+        role = self.create_role(identity['Account'], params['RoleName'],
+                decode_document(params['AssumeRolePolicyDocument']),
+                path=params.get('Path', '/'),
+                description=params.get('Description'),
+                max_session_duration=params.get('MaxSessionDuration', 3600))
+        return dict(Role=self.role_info(role))
+
+    def iam_delete_role(self, identity, params):
+        iam = self.iam(identity['Account'])
+        role = self.get_entity(iam, 'roles', params['RoleName'])
+        if role['AttachedPolicies'] or role['InlinePolicies']:
+            raise FakeError('DeleteConflict', 'Cannot delete entity, must '
+                    'detach all policies first.', 409)
+        del iam['roles'][params['RoleName']]
+
+    def iam_update_role(self, identity, params):
+        role = self.get_entity(self.iam(identity['Account']), 'roles',
+                params['RoleName'])
+        if 'Description' in params:
+            role['Description'] = params['Description']
+        if 'MaxSessionDuration' in params:
+            role['MaxSessionDuration'] = params['MaxSessionDuration']
+
+    def iam_update_role_description(self, identity, params):
+        role = self.get_entity(self.iam(identity['Account']), 'roles',
+                params['RoleName'])
+        role['Description'] = params['Description']
+        return dict(Role=self.role_info(role))
+
+    def iam_update_assume_role_policy(self, identity, params):
+        role = self.get_entity(self.iam(identity['Account']), 'roles',
+                params['RoleName'])
+        role['AssumeRolePolicyDocument'] = decode_document(params['PolicyDocument'])
+
+    def iam_list_attached_role_policies(self, identity, params):
+        account_id = identity['Account']
+        role = self.get_entity(self.iam(account_id), 'roles', params['RoleName'])
+        return paginate(self.attached_policies(account_id, role), params,
+                'AttachedPolicies')
+
+    def iam_attach_role_policy(self, identity, params):
+        account_id = identity['Account']
+        role = self.get_entity(self.iam(account_id), 'roles', params['RoleName'])
+        self.attach(account_id, role, params['PolicyArn'])
+
+    def iam_detach_role_policy(self, identity, params):
+        account_id = identity['Account']
+        role = self.get_entity(self.iam(account_id), 'roles', params['RoleName'])
+        self.detach(account_id, role, params['PolicyArn'])
+
+    def iam_list_role_policies(self, identity, params):
+        role = self.get_entity(self.iam(identity['Account']), 'roles',
+                params['RoleName'])
+        return paginate(list(role['InlinePolicies']), params, 'PolicyNames')
@@ -0,0 +1,362 @@
+"""Synthetic organizations for scale testing.
+
+generate_org() builds an organization of any size in two matching forms.
+One is a set of spec files that validate_spec() accepts.  The other is
+the deployed state of the same organization, in the format taken by
+FakeBackend.load_state().  Parameters control the size and shape of the
+organization and how much of the spec is already deployed.  The same
+seed always produces the same organization.
+
+    org = generate_org(accounts=5000, delegations=40, trust_all=0.75)
+    write_spec_dir(org, spec_dir)
+    backend = load_backend(org, latency=0.01).install()
+"""
+
+import os
+import json
+import random
+import datetime
+import collections
+
+import yaml
+
+from awsorgs.utils import munge_path
+from awsorgs.fakebackend import FakeBackend, AWS_MANAGED_POLICIES
+
+
+MASTER_ACCOUNT_ID = '111111111111'
+AUTH_ACCOUNT_ID = '222222222222'
+ORG_ACCESS_ROLE = 'OrganizationAccountAccessRole'
+
+COMMON_SPEC = dict(
+    master_account_id=MASTER_ACCOUNT_ID,
+    auth_account_id=AUTH_ACCOUNT_ID,
+    default_domain='example.com',
+    default_sc_policy='FullAWSAccess',
+    default_ou='root',
+    default_path='awsauth',
+    default_smtp_server='localhost',
+    org_admin_team='admins',
+)
+
+SERVICES = ['s3', 'ec2', 'rds', 'lambda', 'dynamodb', 'sqs', 'sns',
+        'cloudwatch', 'logs', 'kms', 'route53', 'elasticloadbalancing']
+
+
+def pick(rng, pool, count):
+    """Return 'count' distinct items from 'pool' in pool order"""
+    chosen = set(rng.sample(range(len(pool)), min(count, len(pool))))
+    return [item for i, item in enumerate(pool) if i in chosen]
+
+
+def pick_policies(rng, custom_policies, count, custom_fraction):
+    """Return a list of AWS managed and custom policy names"""
+    policies = []
+    for _ in range(count):
+        if custom_policies and rng.random() < custom_fraction:
+            name = rng.choice(custom_policies)['PolicyName']
+        else:
+            name = rng.choice(AWS_MANAGED_POLICIES)
+        if name not in policies:
+            policies.append(name)
+    return policies
+
+
+def make_ou_tree(rng, depth, fanout, sc_policy_names):
+    """
+    Return list of OU names in tree order and a dict of OU specs keyed by
+    name.  The root spec is keyed 'root'.
+    """
+    names = []
+    specs = dict(root=dict(Name='root', Accounts=[], Child_OU=[]))
+    level = ['root']
+    for _ in range(depth):
+        next_level = []
+        for parent in level:
+            for _ in range(fanout):
+                name = 'ou%05d' % len(names)
+                spec = dict(Name=name, Accounts=[], Child_OU=[])
+                if sc_policy_names:
+                    spec['SC_Policies'] = pick(rng, sc_policy_names,
+                            rng.randint(0, 2))
+                specs[parent]['Child_OU'].append(spec)
+                specs[name] = spec
+                names.append(name)
+                next_level.append(name)
+        level = next_level
+    return names, specs
+
+
+def group_policy_doc(account_id, path, role_name):
+    statement = dict(Effect='Allow', Action='sts:AssumeRole',
+            Resource='arn:aws:iam::%s:role%s%s' % (account_id, path, role_name))
+    return dict(Version='2012-10-17', Statement=[statement])
+
+
+def trust_policy_doc(trusted_account_id, mfa=True):
+    statement = dict(Effect='Allow',
+            Principal=dict(AWS='arn:aws:iam::%s:root' % trusted_account_id),
+            Action='sts:AssumeRole')
+    if mfa:
+        statement['Condition'] = {'Bool': {'aws:MultiFactorAuthPresent': 'true'}}
+    return dict(Version='2012-10-17', Statement=[statement])
+
+
+def generate_org(accounts=100, ou_depth=3, ou_fanout=3, account_skew=1.0,
+        sc_policies=10, teams=10, users=200, groups=20, group_size=20,
+        delegations=20, trust_all=0.5, delegation_accounts=10,
+        local_users=10, local_all=0.5, custom_policies=10,
+        custom_fraction=0.3, policies_per_entity=2, login_profiles=0.5,
+        drift=0.0, seed=0):
+    """
+    Return a synthetic organization as dict(spec, state, master_account_id,
+    auth_account_id).  'spec' maps spec file names to their contents.
+    'state' is the deployed state for FakeBackend.load_state().
+
+    accounts::              member accounts, besides master and auth.
+    ou_depth, ou_fanout::   shape of the OU tree under root.
+    account_skew::          zipf exponent spreading accounts over OUs.
+                            0 spreads them evenly.
+    trust_all::             fraction of delegations with TrustingAccount: ALL.
+                            The rest trust 'delegation_accounts' accounts.
+    local_all::             fraction of local users in Account: ALL.
+    custom_fraction::       fraction of policy references naming a custom
+                            policy rather than an AWS managed one.
+    login_profiles::        fraction of deployed users with a login profile.
+    drift::                 fraction of spec'd resources left undeployed
+                            or deployed out of date.
+    """
+    rng = random.Random(seed)
+    path = munge_path(COMMON_SPEC['default_path'], {})
+    drifted = lambda: drift and rng.random() < drift
+
+    # organization
+    sc_policy_specs = [dict(Name='scp%04d' % i,
+            Description='service control policy %d' % i, Effect='Deny',
+            Actions=['%s:*' % s for s in pick(rng, SERVICES, rng.randint(1, 4))])
+            for i in range(sc_policies)]
+    ou_names, ou_specs = make_ou_tree(rng, ou_depth, ou_fanout,
+            [p['Name'] for p in sc_policy_specs])
+    team_specs = [dict(Name='admins' if i == 0 else 'team%03d' % i,
+            Description='team %d' % i, BusinessContacts=[], TechnicalContacts=[])
+            for i in range(max(teams, 1))]
+    account_specs = [dict(Name='master', Team='admins'),
+            dict(Name='auth', Team='admins')]
+    account_specs += [dict(Name='account%05d' % i,
+            Team=rng.choice(team_specs)['Name'])
+            for i in range(accounts)]
+    account_ids = dict(master=MASTER_ACCOUNT_ID, auth=AUTH_ACCOUNT_ID)
+    for i, a_spec in enumerate(account_specs[2:]):
+        account_ids[a_spec['Name']] = '%012d' % (300000000000 + i)
+    ou_spec_names = ['root'] + ou_names
+    weights = [1.0 / (rank + 1) ** account_skew
+            for rank in range(len(ou_spec_names))]
+    rng.shuffle(ou_spec_names)
+    account_ou = dict(master='root', auth='root')
+    for a_spec in account_specs[2:]:
+        account_ou[a_spec['Name']] = rng.choices(ou_spec_names, weights)[0]
+    for a_spec in account_specs:
+        ou_specs[account_ou[a_spec['Name']]]['Accounts'].append(a_spec['Name'])
+    account_names = [a['Name'] for a in account_specs]
+
+    # auth
+    custom_policy_specs = [dict(PolicyName='custom%04d' % i,
+            Description='custom policy %d' % i,
+            Statement=[dict(Effect='Allow',
+                    Action=['%s:Describe*' % s, '%s:List*' % s],
+                    Resource='*') for s in pick(rng, SERVICES, rng.randint(1, 3))])
+            for i in range(custom_policies)]
+    user_specs = [dict(Name='user%06d' % i, Team=rng.choice(team_specs)['Name'],
+            Email='user%06d@example.com' % i) for i in range(users)]
+    user_names = [u['Name'] for u in user_specs]
+    for t_spec in team_specs:
+        t_spec['BusinessContacts'] = pick(rng, user_names, 1)
+        t_spec['TechnicalContacts'] = pick(rng, user_names, 2)
+    group_specs = [dict(Name='all-users', Members='ALL', Policies=[])]
+    group_specs += [dict(Name='group%04d' % i,
+            Members=pick(rng, user_names, group_size),
+            Policies=pick_policies(rng, custom_policy_specs,
+                    policies_per_entity, custom_fraction))
+            for i in range(max(groups - 1, 0))]
+    delegation_specs = []
+    for i in range(delegations):
+        d_spec = dict(RoleName='Role%04d' % i,
+                Description='delegation role %d' % i,
+                TrustedGroup=rng.choice(group_specs)['Name'],
+                RequireMFA=True, Duration=3600,
+                Policies=pick_policies(rng, custom_policy_specs,
+                        policies_per_entity, custom_fraction))
+        if rng.random() < trust_all:
+            d_spec['TrustingAccount'] = 'ALL'
+        else:
+            d_spec['TrustingAccount'] = pick(rng, account_names,
+                    delegation_accounts)
+        delegation_specs.append(d_spec)
+    local_user_specs = []
+    for i in range(local_users):
+        lu_spec = dict(Name='service%04d' % i, Team=rng.choice(team_specs)['Name'],
+                Description='local user %d' % i,
+                Policies=pick_policies(rng, custom_policy_specs,
+                        policies_per_entity, custom_fraction))
+        if rng.random() < local_all:
+            lu_spec['Account'] = 'ALL'
+        else:
+            lu_spec['Account'] = pick(rng, account_names, delegation_accounts)
+        local_user_specs.append(lu_spec)
+
+    spec = dict(
+        common=dict(COMMON_SPEC),
+        organizational_units=dict(organizational_units=[ou_specs['root']]),
+        sc_policies=dict(sc_policies=sc_policy_specs),
+        teams=dict(teams=team_specs),
+        accounts=dict(accounts=account_specs),
+        users=dict(users=user_specs),
+        groups=dict(groups=group_specs),
+        delegations=dict(delegations=delegation_specs),
+        local_users=dict(local_users=local_user_specs),
+        custom_policies=dict(custom_policies=custom_policy_specs),
+    )
+
+    # deployed organization
+    deployed_ous = []
+    ou_parent = dict(root='root')
+    for parent_name in ['root'] + ou_names:
+        for child in ou_specs[parent_name]['Child_OU']:
+            ou_parent[child['Name']] = parent_name
+    placed = dict(root='root')
+    for name in ou_names:
+        parent = placed[ou_parent[name]]
+        if not ou_specs[name]['Child_OU'] and drifted():
+            placed[name] = parent
+        else:
+            placed[name] = name
+            deployed_ous.append(dict(Name=name, Parent=parent))
+    deployed_accounts = [dict(Name=a['Name'], Id=account_ids[a['Name']],
+            Email='%s@example.com' % a['Name'],
+            Parent=placed[account_ou[a['Name']]],
+            Alias=None if drifted() else a['Name'].lower())
+            for a in account_specs]
+    targets = collections.defaultdict(list)
+    for name in ou_names:
+        if placed[name] == name:
+            for policy_name in ou_specs[name].get('SC_Policies', []):
+                if not drifted():
+                    targets[policy_name].append(name)
+    deployed_sc_policies = []
+    for p_spec in sc_policy_specs:
+        statement = dict(Effect=p_spec['Effect'], Action=p_spec['Actions'],
+                Resource='*')
+        if drifted():
+            statement['Action'] = statement['Action'][:1] + ['iam:*']
+        deployed_sc_policies.append(dict(Name=p_spec['Name'],
+                Description=p_spec['Description'],
+                Content=json.dumps(dict(Version='2012-10-17',
+                        Statement=[statement])),
+                Targets=targets[p_spec['Name']]))
+
+    # deployed iam
+    iam = dict((name, dict(policies={}, groups=[], users=[], roles=[]))
+            for name in account_names)
+    custom_by_name = dict((p['PolicyName'], p) for p in custom_policy_specs)
+
+    def deploy_policies(account_name, policy_names):
+        deployed = []
+        for policy_name in policy_names:
+            if drifted():
+                continue
+            p_spec = custom_by_name.get(policy_name)
+            if p_spec and policy_name not in iam[account_name]['policies']:
+                iam[account_name]['policies'][policy_name] = dict(
+                        Name=policy_name, Path=path,
+                        Description=p_spec['Description'],
+                        Document=dict(Version='2012-10-17',
+                                Statement=p_spec['Statement']))
+            deployed.append(policy_name)
+        return deployed
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    user_groups = collections.defaultdict(list)
+    inline_policies = collections.defaultdict(dict)
+    for g_spec in group_specs:
+        members = user_names if g_spec['Members'] == 'ALL' else g_spec['Members']
+        for user_name in members:
+            if not drifted():
+                user_groups[user_name].append(g_spec['Name'])
+    for d_spec in delegation_specs:
+        if d_spec['TrustingAccount'] == 'ALL':
+            trusting = account_names
+        else:
+            trusting = d_spec['TrustingAccount']
+        for account_name in trusting:
+            if not drifted():
+                inline_policies[d_spec['TrustedGroup']][
+                        '%s-%s' % (account_name, d_spec['RoleName'])] = \
+                        group_policy_doc(account_ids[account_name], path,
+                                d_spec['RoleName'])
+            if drifted():
+                continue
+            iam[account_name]['roles'].append(dict(Name=d_spec['RoleName'],
+                    Path=path, Description=d_spec['Description'],
+                    MaxSessionDuration=d_spec['Duration'],
+                    AssumeRolePolicyDocument=trust_policy_doc(AUTH_ACCOUNT_ID),
+                    Policies=deploy_policies(account_name, d_spec['Policies'])))
+    for lu_spec in local_user_specs:
+        if lu_spec['Account'] == 'ALL':
+            local_accounts = account_names
+        else:
+            local_accounts = lu_spec['Account']
+        for account_name in local_accounts:
+            if drifted():
+                continue
+            iam[account_name]['users'].append(dict(Name=lu_spec['Name'],
+                    Path=path, AccessKeys=1,
+                    Policies=deploy_policies(account_name, lu_spec['Policies'])))
+    iam['master']['roles'].append(dict(Name=ORG_ACCESS_ROLE,
+            AssumeRolePolicyDocument=trust_policy_doc(AUTH_ACCOUNT_ID, mfa=False),
+            Policies=['AdministratorAccess']))
+    auth_iam = iam['auth']
+    for g_spec in group_specs:
+        if drifted():
+            continue
+        auth_iam['groups'].append(dict(Name=g_spec['Name'], Path=path,
+                Policies=deploy_policies('auth', g_spec['Policies']),
+                InlinePolicies=dict(inline_policies[g_spec['Name']])))
+    deployed_groups = set(g['Name'] for g in auth_iam['groups'])
+    for u_spec in user_specs:
+        if drifted():
+            continue
+        user = dict(Name=u_spec['Name'], Path=path,
+                Groups=[g for g in user_groups[u_spec['Name']]
+                        if g in deployed_groups])
+        if rng.random() < login_profiles:
+            user['LoginProfile'] = dict(PasswordResetRequired=False,
+                    CreateDate=now - datetime.timedelta(
+                            hours=rng.randint(0, 24 * 30)))
+        auth_iam['users'].append(user)
+    for iam_state in iam.values():
+        iam_state['policies'] = list(iam_state['policies'].values())
+
+    state = dict(
+        organizational_units=deployed_ous,
+        accounts=deployed_accounts,
+        sc_policies=deployed_sc_policies,
+        iam=iam,
+    )
+    return dict(spec=spec, state=state, master_account_id=MASTER_ACCOUNT_ID,
+            auth_account_id=AUTH_ACCOUNT_ID)
+
+
+def write_spec_dir(org, spec_dir):
+    """Write the spec of a generated org as one yaml file per top level key"""
+    os.makedirs(spec_dir, exist_ok=True)
+    for name, content in org['spec'].items():
+        with open(os.path.join(spec_dir, '%s.yaml' % name), 'w') as f:
+            yaml.safe_dump(content, f, default_flow_style=False)
+
+
+def load_backend(org, **kwargs):
+    """Return a FakeBackend loaded with the deployed state of a generated org"""
+    backend = FakeBackend(master_account_id=org['master_account_id'],
+            master_account_name='master', **kwargs)
+    backend.load_state(org['state'])
+    return backend
@@ -13,7 +13,7 @@ Usage:
                        [--disable-expired]
                        [--opt-ttl HOURS]
                        [--password PASSWORD]
-                       [-q] [-d|-dd]
+                       [-q] [-d|-dd] [--profile FILE]
   awsloginprofile (--help|--version)
 
 Options:
@@ -36,6 +36,7 @@ Options:
   -q, --quiet               Repress log output.
   -d, --debug               Increase log level to 'DEBUG'.
   -dd                       Include botocore and boto3 logs in log stream.
+  --profile FILE            Profile the run and write a report to FILE.
 
 """
 
@@ -46,11 +47,8 @@ import yaml
 import logging
 from string import Template
 import datetime
-import smtplib
-from email.message import EmailMessage
 
 
-import boto3
 from botocore.exceptions import ClientError
 from docopt import docopt
 from passwordgenerator import pwgenerator
@@ -60,6 +58,8 @@ import awsorgs
 from awsorgs.utils import *
 from awsorgs.spec import *
 from awsorgs.reports import *
+from awsorgs.profiler import profiled
+from awsorgs.daemon import forwarded
 
 
 # Relative path within awsorgs project to template file used by prep_email()
@@ -78,18 +78,23 @@ def get_user_name():
     return sts.get_caller_identity()['Arn'].split('/')[-1]
 
 
-def list_delegations(log, user, aliases=None):
+def list_delegations(log, user, aliases=None, deployed_groups=None):
     """
     Return list of assume_role resource arns for all groups for user.
     If aliases are supplied, substitute an alias for account Id in each arn.
+    deployed_groups is the 'groups' list from scan_auth_account_details().
+    If not supplied, only the user's own groups are queried.
     """
-    groups = list(user.groups.all())
-    assume_role_policies = []
-    for group in user.groups.all():
-        assume_role_policies += [p for p in list(group.policies.all())
-                if p.policy_document['Statement'][0]['Action'] == 'sts:AssumeRole']
-    role_arns = [policy.policy_document['Statement'][0]['Resource'] for policy
-            in assume_role_policies]
+    role_arns = []
+    if deployed_groups is None:
+        for group in user.groups.all():
+            role_arns += list_assume_role_resources(dict(GroupPolicyList=[
+                    dict(PolicyDocument=p.policy_document)
+                    for p in group.policies.all()]))
+    else:
+        for group in deployed_groups:
+            if user.name in group.get('Members', []):
+                role_arns += list_assume_role_resources(group)
     if aliases:
         for i in range(len(role_arns)):
             account_id = role_arns[i].split(':')[4]
@@ -105,7 +110,7 @@ def format_delegation_table(delegation_arns, aliases):
     for assume_role_arn in delegation_arns:
         account_id = assume_role_arn.split(':')[4]
         if aliases:
-            alias = aliases[account_id]
+            alias = aliases.get(account_id, str())
         else:
             alias = str()
         spacer = (24 - len(alias)) * ' '
@@ -114,11 +119,12 @@ def format_delegation_table(delegation_arns, aliases):
     return delegation_string
 
 
-def user_report(log, aliases, user, login_profile):
+def user_report(log, aliases, user, login_profile, deployed_groups=None):
     """Generate report of IAM user's login profile, password usage, and
     assume_role delegations for any groups user is member of.
     """
-    delegation_table = list_delegations(log, user)
+    delegation_table = list_delegations(log, user,
+            deployed_groups=deployed_groups)
     spacer = '{:<24}{}'
     log.info('\n')
     log.info(spacer.format('User:', user.name))
@@ -137,8 +143,7 @@ def user_report(log, aliases, user, login_profile):
             log.info(spacer.format('Password last used:', user.password_last_used))
     else:
         log.info(spacer.format('User login profile:', login_profile))
-    assume_role_arns = list_delegations(log, user, aliases)
-    if assume_role_arns:
+    if delegation_table:
         log.info('Delegations:\n{}'.format(
             format_delegation_table(delegation_table, aliases)
         ))
@@ -183,7 +188,7 @@ def munge_passwd(passwd=None):
 
 
 def create_profile(log, user, passwd, require_reset):
-    log.debug('creating login profile for user %s' % user.name)
+    log.debug('creating login profile for user %s', user.name)
     return user.create_login_profile(
         Password=passwd,
         PasswordResetRequired=require_reset,
@@ -195,7 +200,7 @@ def reset_profile(log, user, login_profile, passwd, require_reset):
     This ensures the password creation date gets reset when updating a password.
     """
     if login_profile:
-        log.debug('resetting login profile for user %s' % user.name)
+        log.debug('resetting login profile for user %s', user.name)
         login_profile.delete()
         return login_profile.create(
             Password=passwd,
@@ -229,24 +234,24 @@ def set_access_key_status(log, user, enable=True):
 def onetime_passwd_expired(log, user, login_profile, hours):
     """Test if initial one-time-only password is expired"""
     if login_profile and login_profile.password_reset_required:
-        log.debug('now: %s' % utcnow().isoformat())
-        log.debug('ttl: %s' % datetime.timedelta(hours=hours))
-        log.debug('delta: %s' % (utcnow() - login_profile.create_date))
+        log.debug('now: %s', utcnow().isoformat())
+        log.debug('ttl: %s', datetime.timedelta(hours=hours))
+        log.debug('delta: %s', utcnow() - login_profile.create_date)
         return (utcnow() - login_profile.create_date) > datetime.timedelta(hours=hours)
     return False
 
 
 def prep_email(log, aliases, user, passwd):
     """Generate email body from template"""
-    log.debug("loading file: '%s'" % EMAIL_TEMPLATE)
+    log.debug("loading file: '%s'", EMAIL_TEMPLATE)
     trusted_id=boto3.client('sts').get_caller_identity()['Account']
     if aliases:
         trusted_account = aliases[trusted_id]
     else:
         trusted_account = trusted_id
     delegation_table = list_delegations(log, user)
-    log.debug('delegation_table: %s' % delegation_table)
-    template = os.path.abspath(pkg_resources.resource_filename(__name__, EMAIL_TEMPLATE))
+    log.debug('delegation_table: %s', delegation_table)
+    template = os.path.join(os.path.dirname(os.path.abspath(__file__)), EMAIL_TEMPLATE)
     mapping = dict(
         user_name=user.name,
         onetimepw=passwd,
@@ -258,6 +263,7 @@ def prep_email(log, aliases, user, passwd):
 
 
 def build_email_message(user, message_body, spec):
+    from email.message import EmailMessage
     org_admin_team = lookup(spec['teams'], 'Name', spec['org_admin_team'])
     msg = EmailMessage()
     msg.set_content(message_body)
@@ -268,6 +274,7 @@ def build_email_message(user, message_body, spec):
     return msg
 
 def send_email(msg, smtp_server):
+    import smtplib
     s = smtplib.SMTP(smtp_server)
     s.send_message(msg)
     s.quit()
@@ -282,6 +289,8 @@ def handle_email(log, args, spec, aliases, user, passwd):
         send_email(msg, spec['default_smtp_server'])
 
 
+@forwarded
+@profiled
 def main():
     args = docopt(__doc__, version=awsorgs.__version__)
     # HACK ALERT!
@@ -296,7 +305,7 @@ def main():
     else:
         args['report'] = False
     log = get_logger(args)
-    log.debug("%s: args:\n%s" % (__name__, args))
+    log.debug("%s: args:\n%s", __name__, args)
     args = load_config(log, args)
     spec = validate_spec(log, args)
 
@@ -315,7 +324,7 @@ def main():
     org_client = boto3.client('organizations', **org_credentials)
     deployed_accounts = scan_deployed_accounts(log, org_client)
     aliases = get_account_aliases(log, deployed_accounts, args['--org-access-role'])
-    log.debug(aliases)
+    log.debug('%s', aliases)
 
     if args['--new']:
         if not login_profile:
@@ -5,11 +5,13 @@
 
 Usage:
   awsorgs (report|organization) [--config FILE]
-                                [--spec-dir PATH] 
+                                [--spec-dir PATH] [--spec-jobs N]
+                                [--no-spec-cache]
                                 [--master-account-id ID]
                                 [--auth-account-id ID]
                                 [--org-access-role ROLE]
-                                [--exec] [-q] [-d|-dd]
+                                [--snapshot FILE] [--diff FILE]
+                                [--exec] [-q] [-d|-dd] [--profile FILE]
   awsorgs (--help|--version)
 
 Modes of operation:
@@ -21,13 +23,19 @@ Options:
   -V, --version             Display version info and exit.
   --config FILE             AWS Org config file in yaml format.
   --spec-dir PATH           Location of AWS Org specification file directory.
+  --spec-jobs N             Parse and validate spec files in N processes.
+  --no-spec-cache           Do not read or write the validated spec cache.
   --master-account-id ID    AWS account Id of the Org master account.    
   --auth-account-id ID      AWS account Id of the authentication account.
   --org-access-role ROLE    IAM role for traversing accounts in the Org.
   --exec                    Execute proposed changes to AWS Org.
+  --snapshot FILE           Save report records to FILE as JSON lines.
+  --diff FILE               Print what changed since the snapshot saved in
+                            FILE instead of the report.
   -q, --quiet               Repress log output.
   -d, --debug               Increase log level to 'DEBUG'.
   -dd                       Include botocore and boto3 logs in log stream.
+  --profile FILE            Profile the run and write a report to FILE.
 
 """
 
@@ -35,35 +43,38 @@ Options:
 import yaml
 import json
 import time
+import collections
 
-import boto3
 from docopt import docopt
 
 import awsorgs
 import awsorgs.utils
 from awsorgs.utils import *
 from awsorgs.spec import *
+from awsorgs.reports import *
+from awsorgs.trace import traced
+from awsorgs.profiler import profiled
+from awsorgs.daemon import forwarded
 
 
+@traced
 def validate_accounts_unique_in_org(log, root_spec):
     """
     Make sure accounts are unique across org
     """
-    # recursively build mapping of accounts to ou_names
-    def map_accounts(spec, account_map={}):
-        if 'Accounts' in spec and spec['Accounts']:
+    # build mapping of accounts to ou_names, walking OUs depth first
+    account_map = collections.defaultdict(list)
+    stack = [root_spec]
+    while stack:
+        spec = stack.pop()
+        if spec.get('Accounts'):
             for account in spec['Accounts']:
-                if account in account_map:
-                    account_map[account].append(spec['Name'])
-                else:
-                    account_map[account] = [(spec['Name'])]
-        if 'Child_OU' in spec and spec['Child_OU']:
-            for child_spec in spec['Child_OU']:
-                map_accounts(child_spec, account_map)
-        return account_map
+                account_map[account].append(spec['Name'])
+        if spec.get('Child_OU'):
+            stack.extend(reversed(spec['Child_OU']))
     # find accounts set to more than one OU
     unique = True
-    for account, ou in list(map_accounts(root_spec).items()):
+    for account, ou in account_map.items():
         if len(ou) > 1:
             log.error("Account '%s' set in multiple OU: %s" % (account, ou))
             unique = False
@@ -108,6 +119,7 @@ def list_policies_in_ou (org_client, ou_id):
     return sorted([ou['Name'] for ou in policies_in_ou])
 
 
+@traced
 def scan_deployed_policies(org_client):
     """
     Return list of Service Control Policies deployed in Organization
@@ -115,6 +127,7 @@ def scan_deployed_policies(org_client):
     return org_client.list_policies(Filter='SERVICE_CONTROL_POLICY')['Policies']
 
 
+@traced
 def scan_deployed_ou(log, org_client, root_id):
     """
     Recursively traverse deployed AWS Organization.  Return list of
@@ -135,8 +148,8 @@ def scan_deployed_ou(log, org_client, root_id):
             response = org_client.list_accounts_for_parent(
                 ParentId=parent_id, NextToken=response['NextToken'])
             accounts += response['Accounts']
-        log.debug('parent_name: %s; ou: %s' % (parent_name, yamlfmt(child_ou)))
-        log.debug('parent_name: %s; accounts: %s' % (parent_name, yamlfmt(accounts)))
+        log.debug('parent_name: %s; ou: %s', parent_name, LazyYaml(child_ou))
+        log.debug('parent_name: %s; accounts: %s', parent_name, LazyYaml(accounts))
 
         if not deployed_ou:
             deployed_ou.append(dict(
@@ -157,7 +170,8 @@ def scan_deployed_ou(log, org_client, root_id):
     # build the table 
     deployed_ou = []
     build_deployed_ou_table(org_client, 'root', root_id, deployed_ou)
-    log.debug(yamlfmt(deployed_ou))
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug('%s', LazyYaml(deployed_ou))
     return deployed_ou
 
 
@@ -180,6 +194,33 @@ def display_provisioned_policies(org_client, log, deployed):
                 separators=(',', ': ')))
 
 
+def org_report_records(org_client, deployed):
+    """
+    Yield report records describing the deployed Organization: its
+    organizational units, service control policies and accounts.
+    """
+    for ou in deployed['ou']:
+        yield dict(Type='OrganizationalUnits', Item=dict(
+                Name=ou['Name'],
+                Id=ou['Id'],
+                Accounts=sorted(ou.get('Accounts', [])),
+                Child_OU=sorted(ou.get('Child_OU', [])),
+                SC_Policies=list_policies_in_ou(org_client, ou['Id'])))
+    for policy in deployed['policies']:
+        yield dict(Type='ServiceControlPolicies', Item=dict(
+                Name=policy['Name'],
+                Id=policy['Id'],
+                Description=policy['Description'],
+                Content=json.loads(org_client.describe_policy(
+                        PolicyId=policy['Id'])['Policy']['Content'])))
+    for account in deployed['accounts']:
+        yield dict(Type='Accounts', Item=dict(
+                Name=account['Name'],
+                Id=account['Id'],
+                Email=account['Email'],
+                Status=account['Status']))
+
+
 def display_provisioned_ou(org_client, log, deployed_ou, parent_name, indent=0):
     """
     Recursive function to display the deployed AWS Organization structure.
@@ -208,6 +249,7 @@ def display_provisioned_ou(org_client, log, deployed_ou, parent_name, indent=0):
             display_provisioned_ou(org_client, log, deployed_ou, ou_name, indent)
 
 
+@traced
 def manage_account_moves(org_client, args, log, deployed, ou_spec, dest_parent_id):
     """
     Alter deployed AWS Organization.  Ensure accounts are contained
@@ -230,6 +272,7 @@ def manage_account_moves(org_client, args, log, deployed, ou_spec, dest_parent_i
                                 DestinationParentId=dest_parent_id)
 
 
+@traced
 def place_unmanged_accounts(org_client, args, log, deployed, account_list, dest_parent):
     """
     Move any unmanaged accounts into the default OU.
@@ -248,6 +291,7 @@ def place_unmanged_accounts(org_client, args, log, deployed, account_list, dest_
                         DestinationParentId=dest_parent_id)
 
 
+@traced
 def manage_policies(org_client, args, log, deployed, org_spec):
     """
     Manage Service Control Policies in the AWS Organization.  Make updates
@@ -256,7 +300,7 @@ def manage_policies(org_client, args, log, deployed, org_spec):
     """
     for p_spec in org_spec['sc_policies']:
         policy_name = p_spec['Name']
-        log.debug("considering sc_policy: %s" % policy_name)
+        log.debug("considering sc_policy: %s", policy_name)
         # dont touch default policy
         if policy_name == org_spec['default_sc_policy']:
             continue
@@ -275,7 +319,7 @@ def manage_policies(org_client, args, log, deployed, org_spec):
         # create or update sc_policy
         statement = dict(Effect=p_spec['Effect'], Action=p_spec['Actions'], Resource='*')
         policy_doc = json.dumps(dict(Version='2012-10-17', Statement=[statement]))
-        log.debug("spec sc_policy_doc: %s" % yamlfmt(policy_doc))
+        log.debug("spec sc_policy_doc: %s", LazyYaml(policy_doc))
         # create new policy
         if not policy:
             log.info("Creating policy '%s'" % policy_name)
@@ -289,7 +333,7 @@ def manage_policies(org_client, args, log, deployed, org_spec):
         else:
             deployed_policy_doc = json.dumps(json.loads(org_client.describe_policy(
                     PolicyId=policy['Id'])['Policy']['Content']))
-            log.debug("real sc_policy_doc: %s" % yamlfmt(deployed_policy_doc))
+            log.debug("real sc_policy_doc: %s", LazyYaml(deployed_policy_doc))
             if (p_spec['Description'] != policy['Description']
                 or policy_doc != deployed_policy_doc):
                 log.info("Updating policy '%s'" % policy_name)
@@ -300,6 +344,7 @@ def manage_policies(org_client, args, log, deployed, org_spec):
                             Description=p_spec['Description'],)
 
 
+@traced
 def manage_policy_attachments(org_client, args, log, deployed, org_spec, ou_spec, ou_id):
     """
     Attach or detach specified Service Control Policy to a deployed 
@@ -337,6 +382,7 @@ def manage_policy_attachments(org_client, args, log, deployed, org_spec, ou_spec
                     TargetId=ou_id)
 
 
+@traced
 def manage_ou(org_client, args, log, deployed, org_spec, ou_spec_list, parent_name):
     """
     Recursive function to manage OrganizationalUnits in the AWS
@@ -389,10 +435,12 @@ def manage_ou(org_client, args, log, deployed, org_spec, ou_spec_list, parent_na
                             ou_spec['Child_OU'], new_ou['Name'])
 
 
+@forwarded
+@profiled
 def main():
     args = docopt(__doc__, version=awsorgs.__version__)
     log = get_logger(args)
-    log.debug(args)
+    log.debug('%s', args)
     args = load_config(log, args)
     credentials = get_assume_role_credentials(
             args['--master-account-id'],
@@ -408,11 +456,17 @@ def main():
             ou = scan_deployed_ou(log, org_client, root_id))
 
     if args['report']:
-        header = 'Provisioned Organizational Units in Org:'
-        overbar = '_' * len(header)
-        log.info("\n%s\n%s" % (overbar, header))
-        display_provisioned_ou(org_client, log, deployed['ou'], 'root')
-        display_provisioned_policies(org_client, log, deployed)
+        snapshot = open_report_snapshot(log, args)
+        if snapshot is not None:
+            snapshot.writelines([snapshot_line('org_report', 'Organization', r)
+                    for r in org_report_records(org_client, deployed)])
+        if not args['--diff']:
+            header = 'Provisioned Organizational Units in Org:'
+            overbar = '_' * len(header)
+            log.info("\n%s\n%s" % (overbar, header))
+            display_provisioned_ou(org_client, log, deployed['ou'], 'root')
+            display_provisioned_policies(org_client, log, deployed)
+        close_report_snapshot(log, args, snapshot)
 
     if args['organization']:
         org_spec = validate_spec(log, args)
@@ -437,7 +491,8 @@ def main():
 
         # check for unmanaged resources
         for key in list(managed.keys()):
-            unmanaged= [a['Name'] for a in deployed[key] if a['Name'] not in managed[key]]
+            managed_names = set(managed[key])
+            unmanaged= [a['Name'] for a in deployed[key] if a['Name'] not in managed_names]
             if unmanaged:
                 log.warn("Unmanaged %s in Organization: %s" % (key,', '.join(unmanaged)))
                 if key ==  'accounts':
@@ -0,0 +1,123 @@
+"""Run a console script main() under cProfile.
+
+Each awsorgs entry point is wrapped with @profiled.  When the command
+line has '--profile FILE', main() runs under cProfile.  So does every
+thread it starts, such as queue_threads workers, each with its own
+profiler.  A text report sorted by cumulative time is written to FILE.
+It has one section for the main thread, one for all other threads
+combined, and one for each of the busiest threads.  Combined stats for
+all threads are also saved to FILE.prof for use with pstats or snakeviz.
+
+From python 3.12 only one profiler can be active at a time, and the one
+started for main() sees every thread.  Threads then run without their
+own profiler and the report has a single section for all threads.
+
+Without --profile, the wrapper only scans sys.argv.
+"""
+
+import io
+import sys
+import pstats
+import cProfile
+import functools
+import threading
+
+
+PROFILE_OPTION = '--profile'
+
+# number of lines per report section and busiest threads reported
+REPORT_LINES = 40
+REPORT_THREADS = 5
+
+
+def profile_file(argv):
+    """Return the --profile FILE value in argv or None"""
+    for i, arg in enumerate(argv):
+        if arg == PROFILE_OPTION and i + 1 < len(argv):
+            return argv[i + 1]
+        if arg.startswith(PROFILE_OPTION + '='):
+            return arg.split('=', 1)[1]
+    return None
+
+
+def profile_threads(thread_profiles):
+    """
+    Run threads started from now on under their own cProfile.Profile,
+    appending (thread_name, profile) to thread_profiles as each thread
+    finishes.  profile is None for a thread whose profiler could not be
+    enabled because another one is active.  Returns the original
+    Thread.run to restore afterwards.
+    """
+    lock = threading.Lock()
+    real_run = threading.Thread.run
+
+    def run(thread):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # "Another profiling tool is already active"
+            with lock:
+                thread_profiles.append((thread.name, None))
+            return real_run(thread)
+        try:
+            return real_run(thread)
+        finally:
+            profile.disable()
+            with lock:
+                thread_profiles.append((thread.name, profile))
+
+    threading.Thread.run = run
+    return real_run
+
+
+def stats_section(title, stats):
+    out = io.StringIO()
+    stats.stream = out
+    stats.sort_stats('cumulative').print_stats(REPORT_LINES)
+    return '%s\n%s\n%s' % (title, '=' * len(title), out.getvalue())
+
+
+def write_profile(report_file, main_profile, thread_profiles):
+    """Write the text report to report_file and raw stats to report_file.prof"""
+    if any(profile is None for _, profile in thread_profiles):
+        # the main thread's profiler saw all threads
+        thread_profiles = []
+        title = 'all threads'
+    else:
+        title = 'main thread'
+    sections = [stats_section(title, pstats.Stats(main_profile))]
+    combined = pstats.Stats(main_profile)
+    if thread_profiles:
+        threads = pstats.Stats(thread_profiles[0][1])
+        for _, profile in thread_profiles[1:]:
+            threads.add(profile)
+        combined.add(threads)
+        sections.append(stats_section('%s other threads combined'
+                % len(thread_profiles), threads))
+        busiest = sorted(thread_profiles,
+                key=lambda tp: pstats.Stats(tp[1]).total_tt, reverse=True)
+        for name, profile in busiest[:REPORT_THREADS]:
+            sections.append(stats_section('thread %s' % name,
+                    pstats.Stats(profile)))
+    with open(report_file, 'w') as f:
+        f.write('\n'.join(sections))
+    combined.dump_stats(report_file + '.prof')
+
+
+def profiled(main):
+    """Decorator for console script main() functions adding --profile"""
+    @functools.wraps(main)
+    def wrapper(*args, **kwargs):
+        report_file = profile_file(sys.argv[1:])
+        if report_file is None:
+            return main(*args, **kwargs)
+        main_profile = cProfile.Profile()
+        thread_profiles = []
+        real_run = profile_threads(thread_profiles)
+        try:
+            return main_profile.runcall(main, *args, **kwargs)
+        finally:
+            threading.Thread.run = real_run
+            write_profile(report_file, main_profile, list(thread_profiles))
+    return wrapper
@@ -9,7 +9,17 @@ Todo:
 
 import io
 import csv
+import json
+import time
+import hashlib
+import datetime
+import tempfile
+import itertools
+
+from botocore.exceptions import ClientError
 from awsorgs.utils import *
+from awsorgs.trace import traced
+from awsorgs import shard
 
 
 # Report_maker utilities
@@ -38,36 +48,338 @@ def get_iam_objects(iam_client_function, object_key, f_args=dict()):
     return iam_objects
 
 
-def report_maker(log, accounts, role, query_func, report_header=None, **qf_args):
+def format_yaml_records(account_name, records):
+    """
+    A report_maker formatter.  Renders an account's records as yaml,
+    one section per run of records of the same Type.
+    """
+    messages = [overbar("Account:    %s" % account_name)]
+    for record_type, group in itertools.groupby(records, lambda r: r['Type']):
+        items = [r['Item'] for r in group]
+        if record_type == 'Error':
+            messages += [str(item) for item in items]
+        else:
+            messages.append(yamlfmt({record_type: items}))
+    return '\n'.join(messages)
+
+
+def format_jsonl_records(account_name, records):
+    """
+    A report_maker formatter.  Renders one JSON object per record.
+    """
+    return '\n'.join([json.dumps(
+            dict(Account=account_name, Type=r['Type'], Item=r['Item']),
+            default=str) for r in records])
+
+
+def format_csv_records(account_name, records):
+    """
+    A report_maker formatter.  Renders one csv row per record.  Items which
+    are not plain strings are JSON encoded.
+    """
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator='\n')
+    for r in records:
+        item = r['Item']
+        if not isinstance(item, str):
+            item = json.dumps(item, default=str)
+        writer.writerow([account_name, r['Type'], item])
+    return output.getvalue().rstrip('\n')
+
+
+REPORT_FORMATS = dict(
+    yaml=format_yaml_records,
+    jsonl=format_jsonl_records,
+    csv=format_csv_records,
+)
+
+# guards report output written by report_maker threads
+_output_lock = threading.Lock()
+
+
+def write_report_output(log, fmt, output):
+    """
+    Write rendered report output.  yaml reports are logged along with
+    other messages.  jsonl and csv records are written straight to stdout,
+    so log messages, which get_logger() sends to stderr for these formats,
+    do not end up among them.
+    """
+    if fmt == 'yaml':
+        log.info(output)
+        return
+    with _output_lock:
+        sys.stdout.write(output + shard.record_end())
+        sys.stdout.flush()
+
+
+# Location of per-account report_maker result cache
+DEFAULT_REPORT_CACHE_DIR = '~/.awsorgs/cache/reports'
+
+
+def account_change_signal(iam_client):
+    """
+    Return a cheap fingerprint of the IAM state of an account: the
+    get_account_summary entity counters, leaving out quotas.  This is a
+    single api call.  It moves when entities or policy versions are added
+    or removed, but not when a policy or trust policy is edited in place,
+    so cached records must also expire after the cache ttl.
+    """
+    summary = iam_client.get_account_summary()['SummaryMap']
+    return {k: v for k, v in summary.items()
+            if 'Quota' not in k and 'Size' not in k}
+
+
+def query_args_string(qf_args):
+    """Return report_maker query function arguments as a stable string"""
+    return ','.join(['%s=%s' % (k, qf_args[k]) for k in sorted(qf_args)])
+
+
+def report_name(query_func, qf_args):
+    """
+    Name a report by its query function and arguments, so snapshots taken
+    with different report options can be told apart.
+    """
+    if not qf_args:
+        return query_func.__name__
+    return '%s(%s)' % (query_func.__name__, query_args_string(qf_args))
+
+
+def report_cache_file(cache_dir, account, query_func, qf_args):
+    """
+    Return path to the cache file for a query function and its arguments
+    in an account.
+    """
+    arg_string = query_args_string(qf_args)
+    arg_hash = hashlib.sha1(arg_string.encode()).hexdigest()[:12]
+    return os.path.join(cache_dir, '%s-%s-%s.yaml' %
+            (account['Id'], query_func.__name__, arg_hash))
+
+
+@traced
+def cached_query(log, account, credentials, query_func, qf_args, cache):
+    """
+    Run a report_maker query function in an account, reusing the records
+    cached from a previous run if the account change signal has not moved
+    and the cached records are younger than the cache ttl.
+    cache::  dict(dir=cache_dir, ttl=datetime.timedelta)
+    """
+    iam_client = boto3.client('iam', **credentials)
+    signal = account_change_signal(iam_client)
+    cache_file = report_cache_file(cache['dir'], account, query_func, qf_args)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    if os.path.isfile(cache_file):
+        try:
+            with open(cache_file) as f:
+                entry = yamlload(f)
+            if (entry['Signal'] == signal
+                    and now - entry['Time'] < cache['ttl']):
+                log.debug('using cached report for account %s: %s',
+                        account['Name'], cache_file)
+                return entry['Records']
+        except (yaml.YAMLError, KeyError, TypeError) as e:
+            log.debug('ignoring unusable cache file %s: %s', cache_file, e)
+    records = list(query_func(credentials, **qf_args))
+    entry = dict(Signal=signal, Time=now, Records=records)
+    tmp_file = '%s.%s' % (cache_file, threading.current_thread().ident)
+    with open(tmp_file, 'w') as f:
+        yaml.dump(entry, f, Dumper=YamlDumper, default_flow_style=False,
+                sort_keys=False)
+    os.replace(tmp_file, cache_file)
+    return records
+
+
+@traced
+def report_maker(log, accounts, role, query_func, report_header=None,
+        fmt='yaml', sort=False, cache=None, snapshot=None,
+        account_credentials=None, **qf_args):
     """
     Generate a report by running a arbitrary query function in each account.
-    The query function must return a list of strings.
+    The query function must return or yield records, i.e. dictionaries of
+    the form dict(Type=str, Item=obj).  Each account's records are rendered
+    by the REPORT_FORMATS formatter named by 'fmt' and written out as soon as
+    the account completes.  If 'sort' is set, rendered accounts are spooled
+    to temporary files and written in account name order once all accounts
+    are done.  If 'cache' is supplied, query results are cached per account
+    (see cached_query()).  If 'snapshot' (an open file) is supplied, records
+    are also written to it as snapshot lines.  Set 'fmt' to None to only
+    write the snapshot.  'account_credentials' is an optional dict of
+    {Id: credentials} already assumed for the accounts.
     """
+    formatter = REPORT_FORMATS.get(fmt)
+    snapshot_lock = threading.Lock()
+    name = report_name(query_func, qf_args)
+
     # Thread worker function to gather report for each account
-    def make_account_report(account, report, role):
-        messages = []
-        messages.append(overbar("Account:    %s" % account['Name']))
-        credentials = get_assume_role_credentials(account['Id'], role)
+    def make_account_report(account, role, spool):
+        credentials = (account_credentials or {}).get(account['Id'])
+        if credentials is None:
+            credentials = get_assume_role_credentials(account['Id'], role)
         if isinstance(credentials, RuntimeError):
-            messages.append(credentials)
+            records = [dict(Type='Error', Item=str(credentials))]
+        elif cache:
+            records = cached_query(log, account, credentials, query_func,
+                    qf_args, cache)
         else:
-            messages += query_func(credentials, **qf_args)
-        report[account['Name']] = messages
-    # gather report data from accounts
-    report = {}
-    queue_threads(
-            log, accounts,
-            make_account_report,
-            f_args=(report, role),
-            thread_count=10)
-    # process the reports
-    if report_header:
-        log.info("\n\n%s" % overbar(report_header))
-    for account, messages in sorted(report.items()):
-        for msg in messages:
-            log.info(msg)
+            records = list(query_func(credentials, **qf_args))
+        if snapshot is not None:
+            lines = [snapshot_line(name, account['Name'], r)
+                    for r in records]
+            with snapshot_lock:
+                snapshot.writelines(lines)
+        if formatter is None:
+            return
+        output = formatter(account['Name'], records)
+        if not output:
+            return
+        if spool is None:
+            write_report_output(log, fmt, output)
+        else:
+            spool_file = os.path.join(spool['dir'], account['Id'])
+            with open(spool_file, 'w') as f:
+                f.write(output)
+            spool['files'][account['Name']] = spool_file
+
+    # shard processes after the first leave out the header
+    shard.start_section()
+    if shard.is_first():
+        if fmt == 'yaml' and report_header:
+            log.info("\n\n%s" % overbar(report_header))
+        elif fmt == 'csv':
+            write_report_output(log, fmt, 'Account,Type,Item')
+    if not sort:
+        queue_accounts(log, accounts, make_account_report,
+                f_args=(role, None), thread_count=10)
+        return
+    with tempfile.TemporaryDirectory() as spool_dir:
+        spool = dict(dir=spool_dir, files={})
+        queue_accounts(log, accounts, make_account_report,
+                f_args=(role, spool), thread_count=10)
+        for account_name in sorted(spool['files']):
+            with open(spool['files'][account_name]) as f:
+                write_report_output(log, fmt, f.read())
+
+
+# Report snapshots and diffs
+
+def snapshot_line(report_name, account_name, record):
+    """
+    Return a report record as a line of JSON for a snapshot file.
+    """
+    return json.dumps(dict(
+            Report=report_name,
+            Account=account_name,
+            Type=record['Type'],
+            Item=record['Item'],
+        ), default=str, sort_keys=True) + '\n'
+
+
+def snapshot_entity_key(item):
+    """
+    Return the identifying key of a report record item: the item itself
+    if it is a string, else its Arn, Id or Name.
+    """
+    if isinstance(item, str):
+        return item
+    for key in ['Arn', 'Id', 'Name', 'UserName']:
+        if key in item:
+            return item[key]
+    return json.dumps(item, default=str, sort_keys=True)
+
+
+def load_snapshot(snapshot_file):
+    """
+    Read a snapshot file.  Returns a dictionary mapping each entity to
+    a digest of its content.  Entities are keyed by the tuple
+    (Account, Report, Type, entity key).  Snapshot lines are written with
+    sorted keys, so the digest of the line itself identifies the content.
+    """
+    entities = {}
+    with open(snapshot_file) as f:
+        for line in f:
+            record = json.loads(line)
+            key = (record['Account'], record['Report'], record['Type'],
+                    snapshot_entity_key(record['Item']))
+            entities[key] = hashlib.sha1(line.encode()).digest()
+    return entities
+
+
+def diff_snapshots(old, new):
+    """
+    Compare two snapshots as returned by load_snapshot().  Returns
+    dict of {account_name: dict(Added=[], Removed=[], Changed=[])}.
+    Only accounts with changes are included.
+    """
+    diff = {}
+    def add(key, change):
+        account, report, record_type, entity = key
+        account_diff = diff.setdefault(account,
+                dict(Added=[], Removed=[], Changed=[]))
+        account_diff[change].append('%s: %s' % (record_type, entity))
+    old_keys = set(old)
+    new_keys = set(new)
+    for key in new_keys - old_keys:
+        add(key, 'Added')
+    for key in old_keys - new_keys:
+        add(key, 'Removed')
+    for key in old_keys & new_keys:
+        if old[key] != new[key]:
+            add(key, 'Changed')
+    return diff
+
+
+def display_snapshot_diff(log, diff):
+    """
+    Print the changes found by diff_snapshots() for each account.
+    """
+    if not diff:
+        log.info('No changes since snapshot')
+        return
+    for account_name in sorted(diff):
+        account_diff = diff[account_name]
+        log.info(overbar("Account:    %s" % account_name))
+        log.info(yamlfmt({change: sorted(set(entities))
+                for change, entities in account_diff.items() if entities}))
+
+
+def open_report_snapshot(log, args):
+    """
+    Return an open file for writing report records.  This is the
+    --snapshot file if given, else a temporary file if --diff was
+    requested, else None.
+    """
+    if args['--diff'] and not os.path.isfile(os.path.expanduser(args['--diff'])):
+        log.critical("snapshot file not found: %s" % args['--diff'])
+        sys.exit(1)
+    if args['--snapshot']:
+        return open(os.path.expanduser(args['--snapshot']), 'w')
+    if args['--diff']:
+        return tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False)
+    return None
+
+
+def close_report_snapshot(log, args, snapshot):
+    """
+    Close a file returned by open_report_snapshot().  If --diff was
+    requested, print the changes between the --diff snapshot and this one.
+    """
+    if snapshot is None:
+        return
+    snapshot.close()
+    if args['--diff']:
+        old = load_snapshot(os.path.expanduser(args['--diff']))
+        new = load_snapshot(snapshot.name)
+        if not args['--snapshot']:
+            os.remove(snapshot.name)
+        old_reports = sorted(set(key[1] for key in old))
+        new_reports = sorted(set(key[1] for key in new))
+        if old_reports != new_reports:
+            log.critical("snapshot %s was taken with different report "
+                    "options. it has reports: %s, not: %s" % (args['--diff'],
+                    ', '.join(old_reports), ', '.join(new_reports)))
+            sys.exit(1)
+        display_snapshot_diff(log, diff_snapshots(old, new))
+
 
-    
 # report_maker query functions
 
 def user_group_report(credentials, verbose=False):
@@ -78,181 +390,162 @@ def user_group_report(credentials, verbose=False):
     ISSUE: report access keys, ssh keys, mfa devices, http users
 
     """
-    messages = []
     iam_client = boto3.client('iam', **credentials)
-
-    user_info = []
-    users = get_iam_objects(iam_client.list_users, 'Users')
-    for u in users:
+    for u in get_iam_objects(iam_client.list_users, 'Users'):
         if verbose:
-            user_info.append(u)
+            yield dict(Type='Users', Item=u)
         else:
-            user_info.append(u['Arn'])
-    if user_info:
-        messages.append(yamlfmt(dict(Users=user_info)))
-
-    group_info = []
-    groups = get_iam_objects(iam_client.list_groups, 'Groups')
-    for g in groups:
+            yield dict(Type='Users', Item=u['Arn'])
+    for g in get_iam_objects(iam_client.list_groups, 'Groups'):
         if verbose:
-            group_info.append(g)
+            yield dict(Type='Groups', Item=g)
         else:
-            group_info.append(g['Arn'])
-    if group_info:
-        messages.append(yamlfmt(dict(Groups=group_info)))
-    #if groups:
-    #    messages.append("Groups:")
-    #    if verbose:
-    #        messages.append(yamlfmt(groups))
-    #    else:
-    #        messages += ["  %s" % group['Arn'] for group in groups]
-    return messages
+            yield dict(Type='Groups', Item=g['Arn'])
+
+
+@traced
+def generate_credential_reports(log, accounts, role, max_wait=300):
+    """
+    Make sure an IAM credential report is ready in every account before
+    running credentials_report.  Report generation is triggered in all
+    accounts concurrently.  Accounts still in progress are then polled
+    together, backing off between rounds, until all reports are complete
+    or 'max_wait' seconds have passed.  Returns dict of {Id: credentials}
+    for the accounts whose role could be assumed, to pass on to
+    report_maker().
+    """
+    # Thread worker function to (re)request report generation in an account
+    def generate_report(account, role, clients, states):
+        if account['Id'] not in clients:
+            credentials = get_assume_role_credentials(account['Id'], role)
+            if isinstance(credentials, RuntimeError):
+                log.error(credentials)
+                return
+            account_credentials[account['Id']] = credentials
+            clients[account['Id']] = boto3.client('iam', **credentials)
+        iam_client = clients[account['Id']]
+        try:
+            response = iam_client.generate_credential_report()
+        except ClientError as e:
+            log.error("cannot generate credential report in account %s: %s" %
+                    (account['Name'], e))
+            states.pop(account['Id'], None)
+            return
+        states[account['Id']] = response['State']
+
+    account_credentials = {}
+    clients = {}
+    states = {}
+    pending = accounts
+    delay = 1
+    waited = 0
+    while True:
+        queue_accounts(log, pending, generate_report,
+                f_args=(role, clients, states), thread_count=10)
+        pending = [a for a in pending if a['Id'] in states
+                and states[a['Id']] != 'COMPLETE']
+        if not pending:
+            break
+        if waited >= max_wait:
+            log.warn("credential report not ready after %s seconds in "
+                    "accounts: %s" % (waited, [a['Name'] for a in pending]))
+            break
+        log.debug('%s credential reports in progress. polling again in %s '
+                'seconds', len(pending), delay)
+        time.sleep(delay)
+        waited += delay
+        delay = min(delay * 2, 30)
+    return account_credentials
 
 
 def credentials_report(credentials):
     """
     A report_maker query function.
-    IAM Credential report in an account
-
-    ISSUES:
-      Clean up exception handling:
-      botocore.errorfactory.CredentialReportNotPresentException: An error occurred (ReportNotPresent) when calling the GetCredentialReport operation: Unknown
+    IAM Credential report in an account.  Run generate_credential_reports()
+    first so the report is ready in every account.
     """
-
-    messages = []
     iam_client = boto3.client('iam', **credentials)
     try:
         response = iam_client.get_credential_report()
-    except Exception as e:
-        response = iam_client.generate_credential_report()
-        messages.append(yamlfmt(response))
-        return messages
-
-    report_file_object = io.StringIO(response['Content'].decode())
-    reader = csv.DictReader(report_file_object)
-    user_info = []
-    for row in reader:
-        user = dict()
-        for key in reader.fieldnames:
-            user['UserName'] = row['user']
-            user['Arn'] = row['arn']
-            if (key not in ['user', 'arn'] and 
-                    row[key] not in ['N/A', 'not_supported', 'no_information', 'false']):
-                user[key] = row[key]
-        user_info.append(user)
-
-    if user_info:
-        messages.append(yamlfmt(dict(Users=user_info)))
-    return messages
+    except ClientError as e:
+        yield dict(Type='Error', Item="credential report not available: %s" %
+                e.response['Error']['Code'])
+        return
+    for row in scan_credential_report(response['Content']):
+        user = dict(UserName=row['user'], Arn=row['arn'])
+        for key, value in row.items():
+            if (key not in ['user', 'arn'] and
+                    value not in ['N/A', 'not_supported', 'no_information', 'false']):
+                user[key] = value
+        yield dict(Type='Users', Item=user)
+
+
+def default_policy_document(policy_detail):
+    """
+    Return the default version policy document from a managed policy
+    as returned by get_account_authorization_details.
+    """
+    for version in policy_detail['PolicyVersionList']:
+        if version['IsDefaultVersion']:
+            return version['Document']
 
 
 def role_report(credentials, verbose=False):
     """
     A report_maker query function.
-    Reports IAM custom policies and roles in an account.
+    Reports IAM custom policies and roles in an account.  The terse report
+    uses the list_policies and list_roles output as is.  The verbose report
+    gets policy documents and role attachments from a single
+    get_account_authorization_details sweep.
     """
-    messages = []
     iam_client = boto3.client('iam', **credentials)
-    iam_resource = boto3.resource('iam', **credentials)
-
-    policy_info = []
-    custom_policies = get_iam_objects(iam_client.list_policies, 'Policies', 
-            dict(Scope='Local'))
-    for p in custom_policies:
-        if verbose:
-            policy_version_id = iam_resource.Policy(p['Arn']).default_version_id
-            policy_info.append(dict(
-                Arn=p['Arn'],
-                Statement=iam_resource.PolicyVersion(
-                    p['Arn'], 
-                    policy_version_id
-                ).document['Statement'],
-            ))
-        else:
-            policy_info.append(p['Arn'])
-    if policy_info:
-        messages.append(yamlfmt(dict(CustomPolicies=policy_info)))
-
-    role_info = []
-    roles = get_iam_objects(iam_client.list_roles, 'Roles')
-    for r in roles:
-        role = iam_resource.Role(r['RoleName'])
-        if verbose:
-            role_info.append(dict(
-                Arn=role.arn,
-                Statement=role.assume_role_policy_document['Statement'],
-                AttachedPolicies=[p.policy_name for p in list(role.attached_policies.all())],
-            ))
-        else:
-            role_info.append(role.arn)
-    if role_info:
-        messages.append(yamlfmt(dict(Roles=role_info)))
-    return messages
-
 
-def account_authorization_report(credentials, verbose=False):
+    if not verbose:
+        custom_policies = get_iam_objects(iam_client.list_policies, 'Policies',
+                dict(Scope='Local'))
+        for p in custom_policies:
+            yield dict(Type='CustomPolicies', Item=p['Arn'])
+        for r in get_iam_objects(iam_client.list_roles, 'Roles'):
+            yield dict(Type='Roles', Item=r['Arn'])
+        return
+
+    details = get_authorization_details(iam_client,
+            ['Role', 'LocalManagedPolicy'])
+    for p in details['Policies']:
+        yield dict(Type='CustomPolicies', Item=dict(
+            Arn=p['Arn'],
+            Statement=default_policy_document(p)['Statement'],
+        ))
+    for r in details['RoleDetailList']:
+        yield dict(Type='Roles', Item=dict(
+            Arn=r['Arn'],
+            Statement=r['AssumeRolePolicyDocument']['Statement'],
+            AttachedPolicies=[p['PolicyName'] for p in r['AttachedManagedPolicies']],
+        ))
+
+
+def account_authorization_report(credentials, verbose=False, compact=False):
     """
     A report_maker query function.
-    IAM Account Authorization Reporting
-
+    IAM Account Authorization Reporting.  Users, groups, roles and custom
+    policies are collected in a single get_account_authorization_details
+    sweep.  When 'verbose' and 'compact' are both set, bulky fields are
+    dropped from the details (see compact_detail()).
     """
-    messages = []
     iam_client = boto3.client('iam', **credentials)
-
-    user_info = []
-    users = get_iam_objects(
-            iam_client.get_account_authorization_details, 
-            'UserDetailList',
-            dict(Filter=['User']))
-    for u in users:
-        if verbose:
-            user_info.append(u)
-        else:
-            user_info.append(u['Arn'])
-    if user_info:
-        messages.append(yamlfmt(dict(Users=user_info)))
-
-    group_info = []
-    groups = get_iam_objects(
-            iam_client.get_account_authorization_details, 
-            'GroupDetailList',
-            dict(Filter=['Group']))
-    for u in groups:
-        if verbose:
-            group_info.append(u)
-        else:
-            group_info.append(u['Arn'])
-    if group_info:
-        messages.append(yamlfmt(dict(Groups=group_info)))
-
-    role_info = []
-    roles = get_iam_objects(
-            iam_client.get_account_authorization_details, 
-            'RoleDetailList',
-            dict(Filter=['Role']))
-    for u in roles:
-        if verbose:
-            role_info.append(u)
-        else:
-            role_info.append(u['Arn'])
-    if role_info:
-        messages.append(yamlfmt(dict(Roles=role_info)))
-
-    policy_info = []
-    policies = get_iam_objects(
-            iam_client.get_account_authorization_details, 
-            'Policies',
-            dict(Filter=['LocalManagedPolicy']))
-    for u in policies:
-        if verbose:
-            policy_info.append(u)
-        else:
-            policy_info.append(u['Arn'])
-    if policy_info:
-        messages.append(yamlfmt(dict(CustomPolicies=policy_info)))
-
-
-    return messages
+    details = get_authorization_details(iam_client,
+            ['User', 'Group', 'Role', 'LocalManagedPolicy'],
+            compact=(verbose and compact))
+    for record_type, object_key in [
+            ('Users', 'UserDetailList'),
+            ('Groups', 'GroupDetailList'),
+            ('Roles', 'RoleDetailList'),
+            ('CustomPolicies', 'Policies')]:
+        for d in details[object_key]:
+            if verbose:
+                yield dict(Type=record_type, Item=d)
+            else:
+                yield dict(Type=record_type, Item=d['Arn'])
 
 
 
@@ -280,7 +573,8 @@ def display_provisioned_users(log, args, deployed, auth_spec, credentials):
             user = validate_user(name, credentials)
             if user:
                 login_profile = validate_login_profile(user)
-                user_report(log, aliases, user, login_profile)
+                user_report(log, aliases, user, login_profile,
+                        deployed['groups'])
         else:
             spacer = ' ' * (12 - len(name))
             log.info("%s%s\t%s" % (name, spacer, arn))
@@ -290,28 +584,26 @@ def display_provisioned_groups(log, args, deployed, credentials):
     """
     Print report of currently deployed IAM groups in Auth account.
     List group memebers, attached policies and delegation assume role
-    profiles.
+    profiles.  Expects deployed['groups'] as returned by
+    scan_auth_account_details().
     """
-    # Thread worker function to assemble lines of a group report
-    def display_group(group_name, report, iam_resource):
-        log.debug('group_name: %s' % group_name)
+    def display_group(group):
         messages = []
-        group = iam_resource.Group(group_name)
-        members = list(group.users.all())
-        attached_policies = list(group.attached_policies.all())
-        assume_role_resources = [p.policy_document['Statement'][0]['Resource']
-                for p in list(group.policies.all()) if
-                p.policy_document['Statement'][0]['Action'] == 'sts:AssumeRole']
+        group_name = group['GroupName']
+        members = group.get('Members', [])
+        attached_policies = group.get('AttachedManagedPolicies', [])
+        assume_role_resources = list_assume_role_resources(group)
         overbar = '_' * (8 + len(group_name))
         messages.append('\n%s' % overbar)
         messages.append("%s\t%s" % ('Name:', group_name))
-        messages.append("%s\t%s" % ('Arn:', group.arn))
+        messages.append("%s\t%s" % ('Arn:', group['Arn']))
         if members:
             messages.append("Members:")
-            messages.append("\n".join(["  %s" % u.name for u in members]))
+            messages.append("\n".join(["  %s" % u for u in members]))
         if attached_policies:
             messages.append("Policies:")
-            messages.append("\n".join(["  %s" % p.arn for p in attached_policies]))
+            messages.append("\n".join(["  %s" % p['PolicyArn']
+                    for p in attached_policies]))
         if assume_role_resources:
             messages.append("Assume role profiles:")
             messages.append("  Account\tRole ARN")
@@ -323,23 +615,18 @@ def display_provisioned_groups(log, args, deployed, credentials):
                     profiles[account_name] = role_arn
             for account_name in sorted(profiles.keys()):
                 messages.append("  %s:\t%s" % (account_name, profiles[account_name]))
-        report[group_name] = messages
+        return messages
 
     group_names = sorted([g['GroupName'] for g in deployed['groups']])
-    log.debug('group_names: %s' % group_names)
+    log.debug('group_names: %s', group_names)
     header = "Provisioned IAM Groups in Auth Account:"
     overbar = '_' * len(header)
     log.info("\n\n%s\n%s" % (overbar, header))
 
     # log report
     if args['--full']:
-        # gather report data from groups
-        report = {}
-        iam_resource = boto3.resource('iam', **credentials)
-        queue_threads(log, group_names, display_group, f_args=(report, iam_resource),
-                thread_count=10)
-        for group_name, messages in sorted(report.items()):
-            for msg in messages:
+        for group in sorted(deployed['groups'], key=lambda g: g['GroupName']):
+            for msg in display_group(group):
                 log.info(msg)
     else:
         # just print the arns
@@ -397,7 +684,7 @@ def display_roles_in_accounts(log, args, deployed, auth_spec):
 
     # gather report data from accounts
     report = {}
-    queue_threads(log, deployed['accounts'], display_role, f_args=(report, auth_spec),
+    queue_accounts(log, deployed['accounts'], display_role, f_args=(report, auth_spec),
             thread_count=10)
     # process the reports
     header = "Provisioned IAM Roles in all Org Accounts:"
@@ -0,0 +1,190 @@
+"""Split the per-account part of a run across forked processes.
+
+run_shards() forks one process per shard once the spec is validated and
+deployed state is scanned, so every shard starts with the same spec,
+state and credentials.  Accounts are sorted by name and cut into
+contiguous shards.  In a shard process, queue_accounts() only runs tasks
+for accounts in that shard, and work outside the per-account fan-outs
+is left to the first shard.
+
+Shard processes write their log records to temporary files, one for
+stdout and one for stderr.  When all shards are done, the parent merges
+their output in a fixed order and exits with the highest shard exit status, or 1 if a shard was killed
+by a signal:
+
+  - Records logged before the first report are plan and error messages.
+    They are written shard by shard, in the order each shard logged them.
+    A record the first shard also logged, such as a warning about the
+    spec, is only written once.
+  - Each report section is written shard by shard.  Shards print
+    accounts in name order, so the merged report is in account name
+    order too.
+
+Sharding uses os.fork() and so only runs on Unix.
+"""
+
+import os
+import sys
+import logging
+import collections
+import tempfile
+import traceback
+
+
+# appended to each log record written by a shard process
+RECORD_END = '\x1e\n'
+# record marking the start of a report section
+SECTION_MARK = '\x1d'
+
+# shard index and account names of a shard process, else None
+_index = None
+_names = None
+
+
+def split_accounts(accounts, count):
+    """Return accounts sorted by name and cut into count contiguous lists"""
+    accounts = sorted(accounts, key=lambda a: a['Name'])
+    return [accounts[i * len(accounts) // count:
+            (i + 1) * len(accounts) // count] for i in range(count)]
+
+
+def sharded():
+    """Return True in a shard process"""
+    return _index is not None
+
+
+def is_first():
+    """Return True unless this is a shard process other than the first"""
+    return _index in (None, 0)
+
+
+def select(accounts):
+    """Return the accounts in this process's shard"""
+    if _names is None:
+        return accounts
+    return [a for a in accounts if a['Name'] in _names]
+
+
+def start_section():
+    """Mark the start of a report section in shard output"""
+    if sharded():
+        sys.stdout.write(SECTION_MARK + RECORD_END)
+        sys.stdout.flush()
+
+
+def record_end():
+    """Return the line end of log records and report output"""
+    if sharded():
+        return RECORD_END
+    return '\n'
+
+
+def become_shard(index, accounts, out, err):
+    """
+    Set up a forked process to run shard index, writing output to out and
+    log records sent to stderr to err.
+    """
+    global _index, _names
+    _index = index
+    _names = set(a['Name'] for a in accounts)
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.StreamHandler):
+            if handler.stream is sys.stderr:
+                handler.setStream(err)
+            else:
+                handler.setStream(out)
+            handler.terminator = RECORD_END
+    sys.stdout = out
+
+
+def parse_output(output):
+    """Return list of report sections, each a list of log records"""
+    sections = [[]]
+    records = output.split(RECORD_END)
+    # anything after the last record end was not written by a log handler
+    if records[-1]:
+        sections[0].append(records[-1].rstrip('\n'))
+    for record in records[:-1]:
+        if record == SECTION_MARK:
+            sections.append([])
+        else:
+            sections[-1].append(record)
+    return sections
+
+
+def merge_output(outputs):
+    """Merge the output of all shards in shard order.  Returns a string"""
+    shards = [parse_output(output) for output in outputs]
+    records = list(shards[0][0])
+    for sections in shards[1:]:
+        # drop records the first shard also logged, keeping repeats
+        seen = collections.Counter(shards[0][0])
+        for record in sections[0]:
+            if seen[record]:
+                seen[record] -= 1
+            else:
+                records.append(record)
+    for i in range(1, max(len(sections) for sections in shards)):
+        for sections in shards:
+            if i < len(sections):
+                records += sections[i]
+    return ''.join('%s\n' % record for record in records)
+
+
+def run_shards(log, accounts, count, func, f_args=()):
+    """
+    Run func(*f_args) in count forked shard processes, each responsible
+    for a shard of accounts.  Write the merged output of all shards.
+    Returns the highest shard exit status, or 1 if a shard was killed.
+    """
+    shards = split_accounts(accounts, count)
+    log.debug('running %s shards of %s', count, [len(s) for s in shards])
+    sys.stdout.flush()
+    sys.stderr.flush()
+    children = []
+    for index, shard_accounts in enumerate(shards):
+        out = tempfile.TemporaryFile('w+')
+        err = tempfile.TemporaryFile('w+')
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 1
+            try:
+                become_shard(index, shard_accounts, out, err)
+                func(*f_args)
+                exit_code = 0
+            except SystemExit as e:
+                if e.code is None or isinstance(e.code, int):
+                    exit_code = e.code or 0
+                else:
+                    sys.stderr.write('%s\n' % e.code)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                err.flush()
+                os._exit(exit_code)
+        children.append((pid, out, err))
+    exit_code = 0
+    outputs = []
+    errors = []
+    for index, (pid, out, err) in enumerate(children):
+        _, status = os.waitpid(pid, 0)
+        code = os.waitstatus_to_exitcode(status)
+        if code < 0:
+            log.error('shard %s (pid %s) killed by signal %s. its accounts '
+                    'are missing from the output: %s', index, pid, -code,
+                    ', '.join(a['Name'] for a in shards[index]))
+            code = 1
+        exit_code = max(exit_code, code)
+        out.seek(0)
+        outputs.append(out.read())
+        out.close()
+        err.seek(0)
+        errors.append(err.read())
+        err.close()
+    sys.stderr.write(merge_output(errors))
+    sys.stderr.flush()
+    sys.stdout.write(merge_output(outputs))
+    sys.stdout.flush()
+    return exit_code
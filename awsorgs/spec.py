@@ -1,17 +1,24 @@
 import sys
 import os
+import json
+import hashlib
+import logging
+import threading
+import concurrent.futures
 import yaml
 
-import boto3
 from botocore.exceptions import ClientError
-from cerberus import Validator, schema_registry
 
 from awsorgs.utils import *
-from awsorgs.validator import file_validator, spec_validator
+import awsorgs
+from awsorgs.trace import traced
+import awsorgs.warmcache
+from awsorgs.validator import file_validator, spec_validator, SCHEMA_VERSION
 
 # Spec parser defaults
 DEFAULT_CONFIG_FILE = '~/.awsorgs/config.yaml'
 DEFAULT_SPEC_DIR = '~/.awsorgs/spec.d'
+DEFAULT_SPEC_CACHE_DIR = '~/.awsorgs/cache/spec'
 
 
 
@@ -24,17 +31,17 @@ def scan_config_file(log, args):
     if not os.path.isfile(config_file):
         log.error("config_file not found: {}".format(config_file))
         return None
-    log.debug("loading config file: {}".format(config_file))
+    log.debug("loading config file: %s", config_file)
     with open(config_file) as f:
         try:
-            config = yaml.load(f.read())
+            config = yamlload(f)
         except (yaml.scanner.ScannerError, UnicodeDecodeError):
             log.error("{} not a valid yaml file".format(config_file))
             return None
         except Exception as e:
             log.error("cant load config_file '{}': {}".format(config_file, e))
             return None
-    log.debug("config: {}".format(config))
+    log.debug("config: %s", config)
     return config
 
 
@@ -59,7 +66,7 @@ def get_master_account_id(log, args, config):
         except ClientError as e:
             log.critical("can not determine master_account_id: {}".format(e))
             sys.exit(1)
-    log.debug("master_account_id: %s" % master_account_id)
+    log.debug("master_account_id: %s", master_account_id)
     return master_account_id
 
 
@@ -75,10 +82,11 @@ def get_spec_dir(log, args, config):
     else:
         spec_dir = DEFAULT_SPEC_DIR
     spec_dir = os.path.expanduser(spec_dir)
-    log.debug("spec_dir: %s" % spec_dir)
+    log.debug("spec_dir: %s", spec_dir)
     return spec_dir
 
 
+@traced
 def load_config(log, args):
     """
     Assemble config options from various sources: cli options, config_file 
@@ -100,28 +108,157 @@ def load_config(log, args):
     return args
 
 
-def validate_spec_file(log, spec_file, validator, errors):
+# file validator of a spec worker process.  see init_spec_worker()
+_worker_validator = None
+
+
+def init_spec_worker():
+    """Process pool initializer: build one file validator per worker"""
+    global _worker_validator
+    _worker_validator = file_validator(logging.getLogger(__name__))
+
+
+def validate_spec_file(spec_file, validator=None):
+    """
+    Load and validate a single spec file.  Does no logging so it can run
+    in a worker process.  If validator is None use the worker's validator.
+    Returns tuple (spec_from_file, problem).  problem is None on success,
+    otherwise a tuple (level, message, validator_errors).  Only a 'failed'
+    problem counts as a validation error.
+    """
+    if validator is None:
+        validator = _worker_validator
     with open(spec_file) as f:
         try:
-            spec_from_file = yaml.load(f.read())
+            spec_from_file = yamlload(f)
         except (yaml.scanner.ScannerError, UnicodeDecodeError):
-            log.warn("{} not a valid yaml file. skipping".format(spec_file))
-            return (None, errors)
+            return (None, ('warning',
+                    "{} not a valid yaml file. skipping".format(spec_file), None))
         except Exception as e:
-            log.error("cant load spec_file '{}': {}".format(spec_file, e))
-            return (None, errors)
+            return (None, ('error',
+                    "cant load spec_file '{}': {}".format(spec_file, e), None))
     if validator.validate(spec_from_file):
-        return (spec_from_file, errors)
+        return (spec_from_file, None)
+    return (None, ('failed',
+            "schema validation failed for spec_file: {}".format(spec_file),
+            validator.errors))
+
+
+def validate_spec_files(log, spec_files, validator, jobs=None):
+    """
+    Load and validate spec_files.  If jobs is more than 1, spread the work
+    over a pool of that many processes, each with its own validator.
+    Otherwise validate in this process with validator.  Returns list of
+    (spec_file, spec_from_file, problem) in spec_files order.
+    """
+    if jobs and jobs > 1 and len(spec_files) > 1:
+        log.debug("validating %s spec files in %s processes",
+                len(spec_files), jobs)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs,
+                initializer=init_spec_worker) as pool:
+            results = list(pool.map(validate_spec_file, spec_files))
+    else:
+        results = [validate_spec_file(f, validator) for f in spec_files]
+    return [(f,) + result for f, result in zip(spec_files, results)]
+
+
+def scan_spec_files(spec_dir):
+    """
+    Return list of (spec_file, digest) tuples for all files in spec_dir
+    and its subdirectories in the order they are merged, which is sorted
+    by path.  digest is the sha1 of the file content.
+    """
+    spec_files = []
+    for root, dirnames, filenames in os.walk(spec_dir):
+        dirnames.sort()
+        for f in sorted(filenames):
+            spec_file = os.path.join(root, f)
+            with open(spec_file, 'rb') as fh:
+                digest = hashlib.sha1(fh.read()).hexdigest()
+            spec_files.append((spec_file, digest))
+    return spec_files
+
+
+def spec_schema_version():
+    """Identify the schemas and code used to validate spec files"""
+    return '%s:%s' % (SCHEMA_VERSION, awsorgs.__version__)
+
+
+def spec_cache_key(spec_files):
+    """
+    Return a digest over the schema version and the names, content and
+    merge order of all spec files.
+    """
+    key = hashlib.sha1(spec_schema_version().encode())
+    for spec_file, digest in spec_files:
+        key.update(('\n%s:%s' % (spec_file, digest)).encode())
+    return key.hexdigest()
+
+
+def spec_cache_file(cache_dir, spec_dir):
+    """Return path to the validated spec cache file for spec_dir"""
+    dir_hash = hashlib.sha1(os.path.abspath(spec_dir).encode()).hexdigest()[:12]
+    return os.path.join(cache_dir, 'spec-%s.json' % dir_hash)
+
+
+def load_spec_cache(log, cache_file):
+    """
+    Return the cache entry stored in cache_file, or an empty entry if
+    there is no usable cache or it was made with different schemas.
+    """
+    entry = dict(Key=None, Schema=spec_schema_version(), Files={})
+    if os.path.isfile(cache_file):
+        try:
+            with open(cache_file) as f:
+                cached = json.load(f)
+            if cached['Schema'] == entry['Schema']:
+                entry.update(Key=cached['Key'], Files=cached['Files'])
+        except (ValueError, KeyError, TypeError) as e:
+            log.debug('ignoring unusable spec cache file %s: %s', cache_file, e)
+    return entry
+
+
+def save_spec_cache(log, cache_file, entry):
+    """
+    Atomically write a validated spec cache entry to cache_file.  The cache
+    is json rather than yaml as it is only read by us and loads much faster.
+    """
+    try:
+        os.makedirs(os.path.dirname(cache_file), mode=0o700, exist_ok=True)
+        tmp_file = '%s.%s.%s' % (cache_file, os.getpid(),
+                threading.current_thread().ident)
+        with open(tmp_file, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_file, cache_file)
+    except (OSError, TypeError, ValueError) as e:
+        log.debug('could not write spec cache file %s: %s', cache_file, e)
+
+
+def log_spec_problem(log, problem):
+    """Log a problem returned by validate_spec_file()"""
+    level, message, validator_errors = problem
+    if level == 'warning':
+        log.warn(message)
     else:
-        log.error("schema validation failed for spec_file: {}".format(spec_file))
-        log.debug("validator errors:\n{}".format(yamlfmt(validator.errors)))
-        errors += 1
-        return (None, errors)
+        log.error(message)
+    if validator_errors:
+        log.debug("validator errors:\n%s", LazyYaml(validator_errors))
 
 
-def validate_spec(log, args):
+@traced
+def validate_spec(log, args, cache_dir=DEFAULT_SPEC_CACHE_DIR):
     """
-    Load all spec files in spec_dir and validate against spec schema
+    Load all spec files in spec_dir and validate against spec schema.
+    If args['--spec-jobs'] is set, changed spec files are parsed and
+    validated in that many processes.
+
+    Validated results are cached in cache_dir (set to None, or pass
+    --no-spec-cache, to disable).  Warnings for skipped files are cached
+    with them and logged again on every run.  If neither the spec files
+    nor the schemas have changed since the last run, the cached
+    spec_object is returned without parsing or validating anything.
+    Otherwise only spec files whose content changed are parsed and
+    validated again.
     """
 
     # validate spec_files
@@ -129,28 +266,75 @@ def validate_spec(log, args):
     if not os.path.isdir(spec_dir):
         log.error("spec_dir not found or not a directory: {}".format(spec_dir))
         sys.exit(1)
+    spec_files = scan_spec_files(spec_dir)
+    key = spec_cache_key(spec_files)
+    # spec_object kept in memory by awsorgs-daemon
+    warm_key = ('validate_spec', os.path.abspath(spec_dir), key)
+    spec_object = awsorgs.warmcache.get(warm_key)
+    if spec_object is not awsorgs.warmcache.MISS:
+        log.debug("using warm spec_object")
+        return spec_object
+    if args.get('--no-spec-cache'):
+        cache_dir = None
+    if cache_dir:
+        cache_file = spec_cache_file(os.path.expanduser(cache_dir), spec_dir)
+        cache = load_spec_cache(log, cache_file)
+        if cache['Key'] == key:
+            log.debug("using cached spec_object: %s", cache_file)
+            spec_object = {}
+            for spec_file, _ in spec_files:
+                entry = cache['Files'].get(spec_file, {})
+                if entry.get('Problem'):
+                    log_spec_problem(log, entry['Problem'])
+                spec_object.update(entry.get('Spec') or {})
+            awsorgs.warmcache.put(warm_key, spec_object, awsorgs.warmcache.SESSION)
+            return spec_object
+    else:
+        cache = dict(Key=None, Schema=spec_schema_version(), Files={})
+    changed_files = [f for f, digest in spec_files
+            if cache['Files'].get(f, {}).get('Digest') != digest]
+    jobs = args.get('--spec-jobs')
     validator = file_validator(log)
+    results = {f: (spec_from_file, problem) for f, spec_from_file, problem
+            in validate_spec_files(log, changed_files, validator,
+                    jobs and int(jobs))}
     spec_object = {}
-    errors = 0
-    for root, _, filenames in os.walk(spec_dir):
-        for f in filenames:
-            log.debug("considering file {}".format(f))
-            spec_from_file, errors = validate_spec_file(log,
-                    os.path.join(spec_dir, f), validator, errors)
-            if spec_from_file:
-                spec_object.update(spec_from_file)
-    if errors:
-        log.critical("schema validation failed for {} spec files. run in debug mode for details".format(errors))
+    validated_files = {}
+    failed = []
+    for spec_file, digest in spec_files:
+        log.debug("considering file %s", spec_file)
+        if spec_file in results:
+            spec_from_file, problem = results[spec_file]
+        else:
+            spec_from_file = cache['Files'][spec_file]['Spec']
+            problem = cache['Files'][spec_file].get('Problem')
+        if problem:
+            log_spec_problem(log, problem)
+            if problem[0] == 'failed':
+                failed.append(spec_file)
+                continue
+        validated_files[spec_file] = dict(Digest=digest, Spec=spec_from_file,
+                Problem=problem)
+        if spec_from_file:
+            spec_object.update(spec_from_file)
+    if failed:
+        log.critical("schema validation failed for {} spec files. "
+                "run in debug mode for details:\n  {}".format(
+                len(failed), '\n  '.join(failed)))
         sys.exit(1)
-    log.debug("spec_object:\n{}".format(yamlfmt(spec_object)))
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("spec_object:\n%s", LazyYaml(spec_object))
 
     # validate aggregated spec_object
     validator = spec_validator(log)
     if validator.validate(spec_object):
         log.debug("spec_object validation succeeded")
+        if cache_dir:
+            save_spec_cache(log, cache_file,
+                    dict(Key=key, Schema=cache['Schema'], Files=validated_files))
+        awsorgs.warmcache.put(warm_key, spec_object, awsorgs.warmcache.SESSION)
         return spec_object
     else:
         log.critical("spec_object validation failed:\n{}".format(
                 yamlfmt(validator.errors)))
         sys.exit(1)
-
@@ -0,0 +1,128 @@
+"""Wall clock tracing of awsorgs run phases.
+
+Set AWSORGS_TRACE to a file path to record a span for each traced
+function call.  Traced functions include config loading, spec
+validation, scans, manage_* functions and each queue_threads task.
+The trace is written when the process exits, in Chrome trace event
+format.  Load it in chrome://tracing, Perfetto or speedscope.  Each span
+records the thread it ran in, so slow workers and serial sections show
+up per thread.
+
+    AWSORGS_TRACE=/tmp/awsauth.json awsauth delegations
+
+When AWSORGS_TRACE is not set, traced functions run with the cost of one
+extra function call.
+"""
+
+import os
+import json
+import time
+import atexit
+import functools
+import threading
+
+
+TRACE_ENV_VAR = 'AWSORGS_TRACE'
+
+# list of trace events while tracing is on, else None
+_events = None
+_trace_file = None
+_thread_names = {}
+_lock = threading.Lock()
+
+
+def start_trace(trace_file):
+    """Start recording spans to be written to trace_file"""
+    global _events, _trace_file
+    with _lock:
+        _events = []
+        _trace_file = trace_file
+        _thread_names.clear()
+
+
+def stop_trace():
+    """Stop recording and write the trace file.  Returns its path"""
+    global _events, _trace_file
+    with _lock:
+        if _events is None:
+            return None
+        events, trace_file = _events, _trace_file
+        _events = _trace_file = None
+        thread_names = dict(_thread_names)
+    pid = os.getpid()
+    metadata = [dict(name='thread_name', ph='M', pid=pid, tid=tid,
+            args=dict(name=name)) for tid, name in thread_names.items()]
+    with open(os.path.expanduser(trace_file), 'w') as f:
+        json.dump(dict(traceEvents=metadata + events,
+                displayTimeUnit='ms'), f)
+    return trace_file
+
+
+def tracing():
+    """Return True if spans are being recorded"""
+    return _events is not None
+
+
+def record(name, start, end, args=None):
+    """Record a complete span.  start and end are perf_counter() seconds"""
+    thread = threading.current_thread()
+    tid = thread.ident
+    event = dict(name=name, ph='X', pid=os.getpid(), tid=tid,
+            ts=round(start * 1e6, 3), dur=round((end - start) * 1e6, 3))
+    if args:
+        event['args'] = args
+    with _lock:
+        if _events is not None:
+            _events.append(event)
+            _thread_names.setdefault(tid, thread.name)
+
+
+class span(object):
+    """
+    Context manager recording the enclosed block as a span:
+
+        with span('manage_ou', ou=ou_spec['Name']):
+            ...
+    """
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, **args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if _events is not None:
+            args = self.args
+            if exc_type is not None:
+                args = dict(args, error=exc_type.__name__)
+            record(self.name, self.start, time.perf_counter(), args)
+        return False
+
+
+def item_label(item):
+    """Return a short label for a queue_threads item"""
+    if isinstance(item, dict):
+        for key in ('Name', 'RoleName', 'UserName', 'GroupName', 'Id'):
+            if key in item:
+                return item[key]
+    return str(item)[:80]
+
+
+def traced(func):
+    """Decorator recording each call of func as a span"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _events is None:
+            return func(*args, **kwargs)
+        with span(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+if os.environ.get(TRACE_ENV_VAR):
+    start_trace(os.environ[TRACE_ENV_VAR])
+    atexit.register(stop_trace)
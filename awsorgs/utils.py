@@ -1,21 +1,61 @@
 """Utility functions used by the various awsorgs modules"""
 
+import io
 import os
 import sys
 import re
-import pkg_resources
+import csv
+import time
 import difflib
+import importlib
 import threading
 try:
     import queue
 except ImportError:
     import Queue as queue
 
-import boto3
 from botocore.exceptions import ClientError
 import yaml
 import logging
 
+from awsorgs.trace import traced, tracing, span, item_label
+from awsorgs.warmcache import warm, SESSION
+from awsorgs import shard
+
+# Use the LibYAML C bindings when PyYAML was built with them
+try:
+    from yaml import CSafeLoader as YamlLoader, CSafeDumper as YamlDumper
+except ImportError:
+    from yaml import SafeLoader as YamlLoader, SafeDumper as YamlDumper
+
+
+class LazyModule(object):
+    """
+    Stand-in for a module which is only imported the first time one of its
+    attributes is accessed.  Keeps heavy imports out of CLI startup.
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
+    def __setattr__(self, attr, value):
+        if attr == '_name':
+            object.__setattr__(self, attr, value)
+        else:
+            setattr(importlib.import_module(self._name), attr, value)
+
+
+# boto3 pulls in all of botocore and s3transfer.  Defer that until we
+# actually create a client or resource.
+boto3 = LazyModule('boto3')
+
+
+# lookup() default for missing keys.  Never equal to a real value.
+_MISSING = object()
+
 
 def lookup(dlist, lkey, lvalue, rkey=None):
     """
@@ -29,9 +69,7 @@ def lookup(dlist, lkey, lvalue, rkey=None):
         lvalue:  value to use as lookup criteria
         rkey:    (optional) name of key referencing a value to return
     """
-    items = [d for d in dlist
-             if lkey in d
-             and d[lkey] == lvalue]
+    items = [d for d in dlist if d.get(lkey, _MISSING) == lvalue]
     if not items:
         return None
     if len(items) > 1:
@@ -39,28 +77,31 @@ def lookup(dlist, lkey, lvalue, rkey=None):
             "Data Error: lkey:lvalue lookup matches multiple items in dlist"
         )
     if rkey:
-        if rkey in items[0]:
-            return items[0][rkey]
-        return None
+        return items[0].get(rkey)
     return items[0]
 
 
 def search_spec(spec, search_key, recurse_key):
     """
-    Recursively scans spec structure and returns a list of values
+    Recursively scans spec structure and returns a sorted list of values
     keyed with 'search_key' or and empty list.  Assumes values
     are either list or str.
     """
     value = []
-    if search_key in spec and spec[search_key]:
-        if isinstance(spec[search_key], str):
-            value.append(spec[search_key])
-        else:
-            value += spec[search_key]
-    if recurse_key in spec and spec[recurse_key]:
-        for child_spec in spec[recurse_key]:
-            value += search_spec(child_spec, search_key, recurse_key)
-    return sorted(value)
+    stack = [spec]
+    while stack:
+        spec = stack.pop()
+        found = spec.get(search_key)
+        if found:
+            if isinstance(found, str):
+                value.append(found)
+            else:
+                value += found
+        children = spec.get(recurse_key)
+        if children:
+            stack += children
+    value.sort()
+    return value
 
 
 def ensure_absent(spec):
@@ -108,7 +149,12 @@ def get_logger(args):
     if not args['--debug'] == 2:
         logging.getLogger('botocore').propagate = False
         logging.getLogger('boto3').propagate = False
-    logging.basicConfig(stream=sys.stdout, format=log_format, level=log_level)
+    # keep log messages apart from machine readable report records
+    stream = sys.stdout
+    if (args['report'] and args.get('--format') in ('jsonl', 'csv')
+            and not args.get('--diff')):
+        stream = sys.stderr
+    logging.basicConfig(stream=stream, format=log_format, level=log_level)
     log = logging.getLogger(__name__)
     return log
 
@@ -152,26 +198,73 @@ def queue_threads(log, sequence, func, f_args=(), thread_count=20):
     """generalized abstraction for running queued tasks in a thread pool"""
 
     def worker(*args):
-        log.debug('%s: q.empty: %s' % (threading.current_thread().name, q.empty()))
+        debug = log.isEnabledFor(logging.DEBUG)
+        if debug:
+            log.debug('%s: q.empty: %s', threading.current_thread().name, q.empty())
         while not q.empty():
-            log.debug('%s: task: %s' % (threading.current_thread().name, func))
             item = q.get()
-            log.debug('%s: processing item: %s' % (threading.current_thread().name, item))
-            func(item, *args)
-            q.task_done()
+            if debug:
+                log.debug('%s: task: %s', threading.current_thread().name, func)
+                log.debug('%s: processing item: %s',
+                        threading.current_thread().name, item)
+            try:
+                if tracing():
+                    with span(func.__name__, item=item_label(item)):
+                        func(item, *args)
+                else:
+                    func(item, *args)
+            except Exception:
+                log.exception('%s failed for item: %s', func.__name__,
+                        item_label(item))
+            finally:
+                q.task_done()
 
     q = queue.Queue()
+    debug = log.isEnabledFor(logging.DEBUG)
     for item in sequence:
-        log.debug('queuing item: %s' % item)
+        if debug:
+            log.debug('queuing item: %s', item)
         q.put(item)
-    log.debug('queue length: %s' % q.qsize())
-    for i in range(thread_count):
+    log.debug('queue length: %s', q.qsize())
+    for i in range(min(thread_count, q.qsize())):
         t = threading.Thread(target=worker, args=f_args)
         t.setDaemon(True)
         t.start()
     q.join()
 
 
+# overrides the thread count of per-account tasks
+CONCURRENCY_ENV_VAR = 'AWSORGS_CONCURRENCY'
+
+
+def queue_accounts(log, accounts, func, f_args=(), thread_count=20):
+    """
+    queue_threads() for tasks run once per account.  Set AWSORGS_CONCURRENCY
+    to run them in more threads in a large org.  In a shard process only
+    accounts in the shard are queued (see awsorgs.shard).
+    """
+    accounts = shard.select(accounts)
+    thread_count = int(os.environ.get(CONCURRENCY_ENV_VAR) or thread_count)
+    queue_threads(log, accounts, func, f_args, thread_count)
+
+
+# assume_role credentials last an hour by default
+CREDENTIALS_MAX_AGE = 45 * 60
+
+
+def client_identity(client):
+    """
+    Return the access key id a boto3 client signs its requests with.
+    Used in warm cache keys to tell apart clients for different accounts.
+    """
+    credentials = client._request_signer._credentials
+    return credentials.access_key if credentials else None
+
+
+@traced
+@warm(lambda account_id, role_name, region_name=None:
+        (account_id, role_name, region_name),
+        scope=SESSION, max_age=CREDENTIALS_MAX_AGE)
 def get_assume_role_credentials(account_id, role_name, region_name=None):
     """
     Get temporary sts assume_role credentials for account.
@@ -204,6 +297,8 @@ def get_assume_role_credentials(account_id, role_name, region_name=None):
                 region_name=region_name)
 
 
+@traced
+@warm(lambda log, org_client: (client_identity(org_client),))
 def scan_deployed_accounts(log, org_client):
     """
     Query AWS Organization for deployed accounts.
@@ -219,6 +314,7 @@ def scan_deployed_accounts(log, org_client):
     return [d for d in deployed_accounts if 'Name' in d ]
 
 
+@traced
 def scan_created_accounts(log, org_client):
     """
     Query AWS Organization for accounts with creation status of 'SUCCEEDED'.
@@ -235,6 +331,110 @@ def scan_created_accounts(log, org_client):
     return created_accounts
         
 
+def compact_detail(detail):
+    """
+    Strip bulky fields from a get_account_authorization_details entity:
+    policy versions other than the default, and instance profiles (which
+    embed a full copy of their roles).
+    """
+    detail.pop('InstanceProfileList', None)
+    if 'PolicyVersionList' in detail:
+        detail['PolicyVersionList'] = [v for v in detail['PolicyVersionList']
+                if v['IsDefaultVersion']]
+    return detail
+
+
+def get_authorization_details(iam_client, filters, compact=False):
+    """
+    Page through get_account_authorization_details once for all entity
+    types in 'filters'.  Returns a dictionary of detail lists keyed by
+    response key (UserDetailList, GroupDetailList, RoleDetailList,
+    Policies).  If 'compact' is set, each entity is passed through
+    compact_detail() as its page arrives.
+    """
+    keys = ['UserDetailList', 'GroupDetailList', 'RoleDetailList', 'Policies']
+    details = {key: [] for key in keys}
+    f_args = dict(Filter=filters)
+    while True:
+        response = iam_client.get_account_authorization_details(**f_args)
+        for key in keys:
+            if compact:
+                details[key] += [compact_detail(d) for d in response.get(key, [])]
+            else:
+                details[key] += response.get(key, [])
+        if not response['IsTruncated']:
+            return details
+        f_args['Marker'] = response['Marker']
+
+
+@traced
+@warm(lambda log, iam_client: (client_identity(iam_client),))
+def scan_auth_account_details(log, iam_client):
+    """
+    Query IAM for users, groups, group membership and group policies in
+    a single paginated get_account_authorization_details sweep.
+    Returns dict(users=[...], groups=[...]).  Each group dictionary
+    gets a 'Members' key listing the user names of its members.
+    """
+    log.debug('running')
+    details = get_authorization_details(iam_client, ['User', 'Group'])
+    users = details['UserDetailList']
+    groups = details['GroupDetailList']
+    members = {}
+    for user in users:
+        for group_name in user['GroupList']:
+            members.setdefault(group_name, []).append(user['UserName'])
+    for group in groups:
+        group['Members'] = sorted(members.get(group['GroupName'], []))
+    return dict(users=users, groups=groups)
+
+
+def list_assume_role_resources(group):
+    """
+    Return the role arns referenced by sts:AssumeRole inline policies
+    in a group dictionary as returned by scan_auth_account_details().
+    """
+    resources = []
+    for policy in group.get('GroupPolicyList', []):
+        statement = policy['PolicyDocument']['Statement'][0]
+        if statement['Action'] == 'sts:AssumeRole':
+            resources.append(statement['Resource'])
+    return resources
+
+
+@traced
+def get_credential_report(log, iam_client, max_wait=300):
+    """
+    Return the get_credential_report response for an account.  Calls
+    generate_credential_report, backing off between polls, until the
+    report is COMPLETE.  Raises RuntimeError after 'max_wait' seconds.
+    """
+    delay = 1
+    waited = 0
+    while iam_client.generate_credential_report()['State'] != 'COMPLETE':
+        if waited >= max_wait:
+            raise RuntimeError("credential report not ready after %s seconds"
+                    % waited)
+        log.debug('credential report not ready. retrying in %s seconds', delay)
+        time.sleep(delay)
+        waited += delay
+        delay = min(delay * 2, 30)
+    return iam_client.get_credential_report()
+
+
+def scan_credential_report(content):
+    """
+    Parse the csv 'Content' of an IAM credential report one line at a
+    time.  Yields a dictionary for each user row.
+    """
+    lines = io.TextIOWrapper(io.BytesIO(content), encoding='utf-8', newline='')
+    for row in csv.DictReader(lines):
+        yield row
+
+
+@traced
+@warm(lambda log, deployed_accounts, role:
+        (role, tuple(a['Id'] for a in deployed_accounts)))
 def get_account_aliases(log, deployed_accounts, role):
     """
     Return dict of {Id:Alias} for all deployed accounts.
@@ -254,9 +454,9 @@ def get_account_aliases(log, deployed_accounts, role):
                 aliases[account['Id']] = response[0]
     # call workers
     aliases = {}
-    queue_threads(log, deployed_accounts, get_account_alias,
+    queue_accounts(log, deployed_accounts, get_account_alias,
             f_args=(log, role, aliases), thread_count=10)
-    log.debug(yamlfmt(aliases))
+    log.debug('%s', LazyYaml(aliases))
     return aliases
 
 
@@ -266,7 +466,7 @@ def merge_aliases(log, deployed_accounts, aliases):
     """
     for account in deployed_accounts:
         account['Alias'] = aliases.get(account['Id'], '')
-        log.debug(account)
+        log.debug('%s', account)
     return deployed_accounts
 
 
@@ -281,7 +481,29 @@ def string_differ(string1, string2):
 
 def yamlfmt(dict_obj):
     """Convert a dictionary object into a yaml formated string"""
-    return yaml.dump(dict_obj, default_flow_style=False)
+    return yaml.dump(dict_obj, Dumper=YamlDumper, default_flow_style=False)
+
+
+class LazyYaml(object):
+    """
+    Defer yamlfmt() of an object until the object is converted to str.
+    Pass as a logging argument so the yaml is only rendered if the log
+    record is actually emitted:
+
+        log.debug('spec_object:\n%s', LazyYaml(spec_object))
+    """
+    __slots__ = ('obj',)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return yamlfmt(self.obj)
+
+
+def yamlload(stream):
+    """Parse a yaml string or file object into python objects"""
+    return yaml.load(stream, Loader=YamlLoader)
 
 
 def overbar(string):
@@ -294,36 +516,6 @@ def overbar(string):
     return "%s\n%s" % ('_' * len(string), string)
 
 
-def report_maker(log, accounts, role, query_func, report_header=None, **qf_args):
-    """
-    Generate a report by running a arbitrary query function in each account.
-    The query function must return a list of strings.
-    """
-    # Thread worker function to gather report for each account
-    def make_account_report(account, report, role):
-        messages = []
-        messages.append(overbar("Account:    %s" % account['Name']))
-        credentials = get_assume_role_credentials(account['Id'], role)
-        if isinstance(credentials, RuntimeError):
-            messages.append(credentials)
-        else:
-            messages += query_func(credentials, **qf_args)
-        report[account['Name']] = messages
-    # gather report data from accounts
-    report = {}
-    queue_threads(
-            log, accounts,
-            make_account_report,
-            f_args=(report, role),
-            thread_count=10)
-    # process the reports
-    if report_header:
-        log.info("\n\n%s" % overbar(report_header))
-    for account, messages in sorted(report.items()):
-        for msg in messages:
-            log.info(msg)
-
-
 def get_iam_objects(iam_client_function, object_key, f_args=dict()):
     """
     users = get_iam_objects(iam_client.list_users, 'Users')
@@ -4,10 +4,9 @@ Spec validator schema data
 ISSUES:
     place regex rule on email addresses, domain name
 """
-import yaml
+import hashlib
 
-from cerberus import Validator, schema_registry
-from awsorgs.utils import yamlfmt
+from awsorgs.utils import yamlload
 
 
 # Schema for validating spec files.  Since spec is accumulated from multiple
@@ -414,24 +413,59 @@ Ensure:
 """
 
 
+# Digest of all schemas.  Changes whenever any schema is edited, so
+# it can be used to invalidate cached validation results.
+SCHEMA_VERSION = hashlib.sha1(''.join([
+        SPEC_FILE_SCHEMA,
+        SPEC_SCHEMA,
+        ORGANIZATIONAL_UNIT_SCHEMA,
+        SC_POLICY_SCHEMA,
+        TEAM_SCHEMA,
+        ACCOUNT_SCHEMA,
+        USER_SCHEMA,
+        GROUP_SCHEMA,
+        LOCAL_USER_SCHEMA,
+        DELEGATION_SCHEMA,
+        CUSTOM_POLICY_SCHEMA,
+]).encode()).hexdigest()
+
+
+# Schemas parsed into python structures once at import time
+COMPILED_SPEC_FILE_SCHEMA = yamlload(SPEC_FILE_SCHEMA)
+COMPILED_SPEC_SCHEMA = yamlload(SPEC_SCHEMA)
+COMPILED_SUBSCHEMAS = dict(
+    organizational_unit=yamlload(ORGANIZATIONAL_UNIT_SCHEMA),
+    sc_policy=yamlload(SC_POLICY_SCHEMA),
+    team=yamlload(TEAM_SCHEMA),
+    account=yamlload(ACCOUNT_SCHEMA),
+    user=yamlload(USER_SCHEMA),
+    group=yamlload(GROUP_SCHEMA),
+    local_user=yamlload(LOCAL_USER_SCHEMA),
+    delegation=yamlload(DELEGATION_SCHEMA),
+    custom_policy=yamlload(CUSTOM_POLICY_SCHEMA),
+)
+
+# Validator instances are built once per process and then reused
+_validators = {}
+
+
 def file_validator(log):
-    schema_registry.add('organizational_unit', yaml.load(ORGANIZATIONAL_UNIT_SCHEMA))
-    schema_registry.add('sc_policy', yaml.load(SC_POLICY_SCHEMA))
-    schema_registry.add('team', yaml.load(TEAM_SCHEMA))
-    schema_registry.add('account', yaml.load(ACCOUNT_SCHEMA))
-    schema_registry.add('user', yaml.load(USER_SCHEMA))
-    schema_registry.add('group', yaml.load(GROUP_SCHEMA))
-    schema_registry.add('local_user', yaml.load(LOCAL_USER_SCHEMA))
-    schema_registry.add('delegation', yaml.load(DELEGATION_SCHEMA))
-    schema_registry.add('custom_policy', yaml.load(CUSTOM_POLICY_SCHEMA))
-    log.debug("adding subschema to schema_registry: {}".format(
-            schema_registry.all().keys()))
-    vfile = Validator(yaml.load(SPEC_FILE_SCHEMA))
-    log.debug("file_validator_schema: {}".format(vfile.schema))
+    vfile = _validators.get('file')
+    if vfile is None:
+        # cerberus is only imported when we actually validate a spec
+        from cerberus import Validator, schema_registry
+        schema_registry.extend(COMPILED_SUBSCHEMAS)
+        log.debug("adding subschema to schema_registry: %s",
+                schema_registry.all().keys())
+        vfile = _validators['file'] = Validator(COMPILED_SPEC_FILE_SCHEMA)
+        log.debug("file_validator_schema: %s", vfile.schema)
     return vfile
 
 
 def spec_validator(log):
-    vspec = Validator(yaml.load(SPEC_SCHEMA))
-    log.debug("spec_validator_schema: {}".format(vspec.schema))
+    vspec = _validators.get('spec')
+    if vspec is None:
+        from cerberus import Validator
+        vspec = _validators['spec'] = Validator(COMPILED_SPEC_SCHEMA)
+        log.debug("spec_validator_schema: %s", vspec.schema)
     return vspec
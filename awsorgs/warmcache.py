@@ -0,0 +1,122 @@
+"""In-process caches kept warm between requests by awsorgs-daemon.
+
+Functions decorated with @warm cache their results here while caching
+is enabled.  Caching is off by default, so a normal run of a console
+script goes to AWS every time, exactly as before.  awsorgs-daemon turns
+it on.  Each entry expires after the daemon's ttl.  Entries can set a
+shorter max_age, as credentials do.  Entries in the 'state' scope hold
+deployed resources and are dropped after any request that makes changes.
+Entries in the 'session' scope, such as assumed role credentials, are
+kept until they expire.
+
+Cached values are deep copied on the way in and out, so callers are free
+to modify what they get back.
+"""
+
+import copy
+import time
+import functools
+import threading
+
+
+STATE = 'state'
+SESSION = 'session'
+
+# returned by get() for missing or expired keys
+MISS = object()
+
+# dict of key: (expires, scope, value) while caching is on, else None
+_entries = None
+_ttl = None
+_lock = threading.Lock()
+
+
+def enable(ttl):
+    """Start caching.  Entries expire after ttl seconds"""
+    global _entries, _ttl
+    with _lock:
+        _entries = {}
+        _ttl = ttl
+
+
+def disable():
+    global _entries, _ttl
+    with _lock:
+        _entries = _ttl = None
+
+
+def enabled():
+    return _entries is not None
+
+
+def clear(scope=None):
+    """Drop all entries in scope, or all entries.  Returns number dropped"""
+    with _lock:
+        if _entries is None:
+            return 0
+        keys = [k for k, (_, s, _) in _entries.items()
+                if scope is None or s == scope]
+        for key in keys:
+            del _entries[key]
+    return len(keys)
+
+
+def get(key):
+    """Return a copy of the cached value for key, or MISS"""
+    with _lock:
+        if _entries is None or key not in _entries:
+            return MISS
+        expires, _, value = _entries[key]
+        if expires <= time.monotonic():
+            del _entries[key]
+            return MISS
+    return copy.deepcopy(value)
+
+
+def put(key, value, scope=STATE, max_age=None):
+    """Cache a copy of value under key, if caching is on"""
+    if _entries is None:
+        return
+    value = copy.deepcopy(value)
+    with _lock:
+        if _entries is None:
+            return
+        age = _ttl if max_age is None else min(_ttl, max_age)
+        _entries[key] = (time.monotonic() + age, scope, value)
+
+
+def stats():
+    """Return dict of {scope: number of live entries}"""
+    now = time.monotonic()
+    counts = {}
+    with _lock:
+        for expires, scope, _ in (_entries or {}).values():
+            if expires > now:
+                counts[scope] = counts.get(scope, 0) + 1
+    return counts
+
+
+def warm(key_func, scope=STATE, max_age=None):
+    """
+    Decorator caching results of the decorated function while caching is
+    on.  key_func is called with the same arguments and returns the part
+    of the cache key identifying the result.  Exceptions, raised or
+    returned, are not cached:
+
+        @warm(lambda log, org_client: (client_identity(org_client),))
+        def scan_deployed_accounts(log, org_client):
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _entries is None:
+                return func(*args, **kwargs)
+            key = (func.__module__, func.__name__, key_func(*args, **kwargs))
+            value = get(key)
+            if value is MISS:
+                value = func(*args, **kwargs)
+                if not isinstance(value, Exception):
+                    put(key, value, scope, max_age)
+            return value
+        return wrapper
+    return decorator
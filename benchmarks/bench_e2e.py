@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+"""End to end benchmark of each awsorgs console script mode.
+
+Usage:
+  bench_e2e.py [--sizes LIST] [--modes LIST] [--drift FRACTION]
+               [--latency SEC] [--output FILE] [--baseline FILE]
+               [--update-baseline] [--call-tolerance FRACTION]
+               [--time-tolerance FRACTION] [--rss-tolerance FRACTION]
+  bench_e2e.py --run-case SIZE MODE [--drift FRACTION] [--latency SEC]
+  bench_e2e.py --list-modes
+
+Options:
+  --sizes LIST                  Comma separated org sizes, in member
+                                accounts [default: 10,50].
+  --modes LIST                  Comma separated modes to run.  Default is all.
+  --drift FRACTION              Fraction of the spec not yet deployed [default: 0.1].
+  --latency SEC                 Simulated latency of each api call [default: 0].
+  --output FILE                 Write results as json to FILE.
+  --baseline FILE               Baseline results to compare against
+                                [default: benchmarks/baseline_e2e.json].
+  --update-baseline             Write results to the baseline file instead
+                                of comparing.
+  --call-tolerance FRACTION     Allowed growth in api calls per operation [default: 0.05].
+  --time-tolerance FRACTION     Allowed growth in wall time [default: 1.0].
+  --rss-tolerance FRACTION      Allowed growth in peak RSS [default: 0.5].
+  --run-case                    Run one case in this process and print its
+                                results as json.
+  --list-modes                  List the available modes.
+
+Each case runs in a fresh interpreter.  The case generates a synthetic
+organization of SIZE accounts with awsorgs.fakeorg, serves it from an
+in-process FakeBackend, and runs the console script main() in dry run
+mode.  Recorded for each case are wall time of main(), api calls per
+operation, peak RSS, and the number of threads started and peak threads
+alive.  Exits non-zero if any case regresses against the baseline.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import hashlib
+import shutil
+import resource
+import tempfile
+import threading
+import subprocess
+import contextlib
+
+from docopt import docopt
+
+
+# mode name -> (module, command line arguments)
+MODES = {
+    'awsorgs.report': ('awsorgs.orgs', ['report']),
+    'awsorgs.organization': ('awsorgs.orgs', ['organization']),
+    'awsaccounts.create': ('awsorgs.accounts', ['create']),
+    'awsaccounts.alias': ('awsorgs.accounts', ['alias']),
+    'awsauth.users': ('awsorgs.auth', ['users']),
+    'awsauth.delegations': ('awsorgs.auth', ['delegations']),
+    'awsauth.local-users': ('awsorgs.auth', ['local-users']),
+    'awsauth.delegations-by-account': ('awsorgs.auth',
+            ['delegations', '--by-account']),
+    'awsauth.local-users-by-account': ('awsorgs.auth',
+            ['local-users', '--by-account']),
+    'awsauth.report': ('awsorgs.auth', ['report']),
+    'awsloginprofile': ('awsorgs.loginprofile', []),
+}
+
+# generate_org() parameters used for every size
+ORG_PARAMS = dict(
+    ou_depth=3,
+    ou_fanout=3,
+    users=100,
+    groups=10,
+    delegations=10,
+    trust_all=0.5,
+    local_users=5,
+    local_all=0.5,
+    custom_policies=5,
+)
+
+CONFIG = """
+master_account_id: '%s'
+auth_account_id: '%s'
+org_access_role: %s
+spec_dir: %s
+"""
+
+
+class ThreadSampler(object):
+    """Count threads started and sample the peak number alive"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.started = 0
+        self.peak = threading.active_count()
+        self.done = threading.Event()
+        self.real_start = threading.Thread.start
+        sampler = self
+        def start(thread):
+            sampler.started += 1
+            return sampler.real_start(thread)
+        threading.Thread.start = start
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.real_start(self.thread)
+
+    def sample(self):
+        while not self.done.wait(self.interval):
+            # don't count the sampler thread
+            self.peak = max(self.peak, threading.active_count() - 1)
+
+    def stop(self):
+        self.done.set()
+        self.thread.join()
+        threading.Thread.start = self.real_start
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def output_digest(output):
+    """
+    Digest of distinct output lines, ignoring the order accounts finished
+    in and messages repeated for each delegation or shard.
+    """
+    lines = sorted(set(output.splitlines()))
+    return hashlib.sha1('\n'.join(lines).encode()).hexdigest()
+
+
+def run_case(size, mode, drift, latency, extra_argv=()):
+    """
+    Run one mode against a generated org, with extra_argv appended to its
+    command line.  Return dict of results
+    """
+    from awsorgs.fakeorg import (generate_org, write_spec_dir, load_backend,
+            ORG_ACCESS_ROLE)
+    import importlib
+
+    org = generate_org(accounts=size, drift=drift, **ORG_PARAMS)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        # keep spec and report caches out of the real home directory
+        os.environ['HOME'] = tmp_dir
+        spec_dir = os.path.join(tmp_dir, 'spec.d')
+        config_file = os.path.join(tmp_dir, 'config.yaml')
+        write_spec_dir(org, spec_dir)
+        with open(config_file, 'w') as f:
+            f.write(CONFIG % (org['master_account_id'], org['auth_account_id'],
+                    ORG_ACCESS_ROLE, spec_dir))
+        backend = load_backend(org, latency=latency)
+        module_name, argv = MODES[mode]
+        if module_name == 'awsorgs.loginprofile':
+            # login profiles are managed from the auth account
+            backend.install(org['auth_account_id'])
+            user = [u for u in org['state']['iam']['auth']['users']
+                    if u.get('LoginProfile')][0]
+            argv = [user['Name']]
+        else:
+            backend.install()
+        module = importlib.import_module(module_name)
+        sys.argv = [mode] + argv + list(extra_argv) + ['--config', config_file]
+        rss_before = peak_rss_kb()
+        stdout = io.StringIO()
+        sampler = ThreadSampler()
+        exit_code = 0
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(stdout):
+                module.main()
+        except SystemExit as e:
+            exit_code = e.code
+        finally:
+            elapsed = time.perf_counter() - start
+            sampler.stop()
+        report = backend.call_report()
+        return dict(
+            wall_time=round(elapsed, 3),
+            exit_code=exit_code,
+            output_lines=len(stdout.getvalue().splitlines()),
+            output_digest=output_digest(stdout.getvalue()),
+            total_calls=report['total_calls'],
+            calls=report['calls'],
+            errors=report['errors'],
+            peak_rss_kb=peak_rss_kb(),
+            peak_child_rss_kb=resource.getrusage(
+                    resource.RUSAGE_CHILDREN).ru_maxrss,
+            rss_before_kb=rss_before,
+            threads_started=sampler.started,
+            peak_threads=sampler.peak,
+        )
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def run_cases(sizes, modes, drift, latency):
+    """Run each case in a subprocess.  Return results keyed by size and mode"""
+    results = {}
+    for size in sizes:
+        for mode in modes:
+            proc = subprocess.run([sys.executable, __file__, '--run-case',
+                    str(size), mode, '--drift', str(drift),
+                    '--latency', str(latency)],
+                    stdout=subprocess.PIPE, universal_newlines=True)
+            if proc.returncode:
+                sys.exit("case %s %s failed" % (size, mode))
+            result = json.loads(proc.stdout)
+            results.setdefault(str(size), {})[mode] = result
+            print('%8s %-32s%10.3f%10d%12d%8d%8d' % (size, mode,
+                    result['wall_time'], result['total_calls'],
+                    result['peak_rss_kb'], result['threads_started'],
+                    result['peak_threads']))
+    return results
+
+
+def compare(results, baseline, call_tolerance, time_tolerance, rss_tolerance):
+    """Return list of regressions of results against baseline"""
+    regressions = []
+    def check(case, metric, value, base, tolerance):
+        if value > base * (1 + tolerance) and value > base:
+            regressions.append('%s: %s %s > baseline %s' % (
+                    case, metric, value, base))
+    for size, modes in sorted(results.items()):
+        for mode, result in sorted(modes.items()):
+            base = baseline.get(size, {}).get(mode)
+            if base is None:
+                continue
+            case = '%s %s' % (size, mode)
+            for op in sorted(set(result['calls']) | set(base['calls'])):
+                check(case, op, result['calls'].get(op, 0),
+                        base['calls'].get(op, 0), call_tolerance)
+            check(case, 'wall_time', result['wall_time'], base['wall_time'],
+                    time_tolerance)
+            check(case, 'peak_rss_kb', result['peak_rss_kb'],
+                    base['peak_rss_kb'], rss_tolerance)
+    return regressions
+
+
+def main():
+    args = docopt(__doc__)
+    if args['--list-modes']:
+        print('\n'.join(sorted(MODES)))
+        return
+    drift = float(args['--drift'])
+    latency = float(args['--latency'])
+    if args['--run-case']:
+        json.dump(run_case(int(args['SIZE']), args['MODE'], drift, latency),
+                sys.stdout, sort_keys=True)
+        return
+
+    sizes = [int(s) for s in args['--sizes'].split(',')]
+    if args['--modes']:
+        modes = args['--modes'].split(',')
+        for mode in modes:
+            if mode not in MODES:
+                sys.exit("unknown mode '%s'" % mode)
+    else:
+        modes = list(MODES)
+    print('%8s %-32s%10s%10s%12s%8s%8s' % ('size', 'mode', 'time (s)',
+            'calls', 'rss (kB)', 'threads', 'peak'))
+    results = run_cases(sizes, modes, drift, latency)
+    if args['--output']:
+        with open(args['--output'], 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args['--update-baseline']:
+        with open(args['--baseline'], 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        return
+    if not os.path.isfile(args['--baseline']):
+        print('no baseline found at %s' % args['--baseline'])
+        return
+    with open(args['--baseline']) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, float(args['--call-tolerance']),
+            float(args['--time-tolerance']), float(args['--rss-tolerance']))
+    if regressions:
+        print('\nregressions against %s:' % args['--baseline'])
+        print('\n'.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
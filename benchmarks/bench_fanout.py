@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""Compare thread counts for per-account tasks.
+
+Usage:
+  bench_fanout.py [--sizes LIST] [--modes LIST] [--latency SEC]
+                  [--concurrency LIST] [--drift FRACTION]
+
+Options:
+  --sizes LIST          Comma separated org sizes, in member accounts
+                        [default: 50].
+  --modes LIST          Comma separated bench_e2e.py modes
+                        [default: awsauth.report,awsaccounts.alias,awsauth.delegations].
+  --latency SEC         Simulated latency of each api call [default: 0.2].
+  --concurrency LIST    Comma separated AWSORGS_CONCURRENCY values.  An
+                        empty value keeps the built in thread counts
+                        [default: ,100].
+  --drift FRACTION      Fraction of the spec not yet deployed [default: 0.1].
+
+Runs each bench_e2e.py case once for each AWSORGS_CONCURRENCY value.
+Reports wall time, threads and peak RSS, and the speedup over the first
+value.  Exits non-zero if thread counts make different api calls or
+print different output.
+"""
+
+import os
+import sys
+import json
+import subprocess
+
+from docopt import docopt
+
+import bench_e2e
+
+
+def run_concurrency(concurrency, size, mode, args):
+    env = dict(os.environ, AWSORGS_CONCURRENCY=concurrency)
+    proc = subprocess.run([sys.executable, bench_e2e.__file__, '--run-case',
+            str(size), mode, '--drift', args['--drift'],
+            '--latency', args['--latency']],
+            env=env, stdout=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode:
+        sys.exit("case %s %s failed with AWSORGS_CONCURRENCY=%s" %
+                (size, mode, concurrency))
+    return json.loads(proc.stdout)
+
+
+def main():
+    args = docopt(__doc__)
+    modes = args['--modes'].split(',')
+    for mode in modes:
+        if mode not in bench_e2e.MODES:
+            sys.exit("unknown mode '%s'" % mode)
+    values = args['--concurrency'].split(',')
+    failed = False
+    print('%8s %-32s%-8s%10s%10s%8s%8s%12s%9s' % ('size', 'mode', 'threads',
+            'time (s)', 'calls', 'started', 'peak', 'rss (kB)', 'speedup'))
+    for size in [int(s) for s in args['--sizes'].split(',')]:
+        for mode in modes:
+            first = None
+            for concurrency in values:
+                result = run_concurrency(concurrency, size, mode, args)
+                if first is None:
+                    first = result
+                print('%8s %-32s%-8s%10.3f%10d%8d%8d%12d%8.1fx' % (size, mode,
+                        concurrency or 'default', result['wall_time'],
+                        result['total_calls'], result['threads_started'],
+                        result['peak_threads'], result['peak_rss_kb'],
+                        first['wall_time'] / max(result['wall_time'], 0.001)))
+                if result['calls'] != first['calls']:
+                    print('%s %s: AWSORGS_CONCURRENCY=%s made different api '
+                            'calls' % (size, mode, concurrency))
+                    failed = True
+                if result['output_digest'] != first['output_digest']:
+                    print('%s %s: AWSORGS_CONCURRENCY=%s printed different '
+                            'output' % (size, mode, concurrency))
+                    failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
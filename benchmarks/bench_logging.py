@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""Measure the cost of debug logging when running at INFO and DEBUG level.
+
+Usage:
+  bench_logging.py [--repeat N] [--ou-count N] [--items N]
+
+Options:
+  --repeat N      Number of timing runs per case [default: 5].
+  --ou-count N    Number of organizational units in the stub org [default: 200].
+  --items N       Number of items passed through queue_threads [default: 5000].
+
+Runs scan_deployed_ou() against an in memory organizations client and
+queue_threads() over a list of items, counting yaml.dump() calls and
+timing each case.  At INFO level no yaml should be rendered for debug
+messages; the script exits non-zero if any is.
+"""
+
+import io
+import sys
+import timeit
+import logging
+
+import yaml
+from docopt import docopt
+
+import awsorgs.utils
+from awsorgs.orgs import scan_deployed_ou
+
+
+class StubOrgClient(object):
+    """Minimal organizations client serving a flat tree of OUs under root"""
+
+    def __init__(self, ou_count):
+        self.children = {'r-root': [
+                dict(Id='ou-%04d' % i, Name='ou%04d' % i, Arn='arn:ou/%04d' % i)
+                for i in range(ou_count)]}
+        self.accounts = {'ou-%04d' % i: [
+                dict(Id='%012d' % (i * 10 + a), Name='account%05d' % (i * 10 + a),
+                        Email='account%05d@example.com' % (i * 10 + a),
+                        Status='ACTIVE')
+                for a in range(3)] for i in range(ou_count)}
+
+    def list_organizational_units_for_parent(self, ParentId, NextToken=None):
+        return dict(OrganizationalUnits=list(self.children.get(ParentId, [])))
+
+    def list_accounts_for_parent(self, ParentId, NextToken=None):
+        return dict(Accounts=list(self.accounts.get(ParentId, [])))
+
+
+def make_logger(level):
+    log = logging.getLogger('bench_logging')
+    log.handlers = [logging.StreamHandler(io.StringIO())]
+    log.propagate = False
+    log.setLevel(level)
+    return log
+
+
+def count_yaml_dumps():
+    """Wrap yaml.dump() so calls are counted.  Return the counter dict"""
+    counter = dict(calls=0)
+    real_dump = yaml.dump
+    def dump(*args, **kwargs):
+        counter['calls'] += 1
+        return real_dump(*args, **kwargs)
+    yaml.dump = dump
+    return counter
+
+
+def bench(repeat, ou_count, items):
+    client = StubOrgClient(ou_count)
+    sequence = list(range(items))
+    cases = [
+        ('scan_deployed_ou', lambda log:
+            scan_deployed_ou(log, client, 'r-root')),
+        ('queue_threads', lambda log:
+            awsorgs.utils.queue_threads(log, sequence, lambda item: None,
+                    thread_count=8)),
+    ]
+    counter = count_yaml_dumps()
+    failed = False
+    print('%-20s%8s%12s%12s' % ('case', 'level', 'time (s)', 'yaml dumps'))
+    for name, case in cases:
+        for level in (logging.INFO, logging.DEBUG):
+            log = make_logger(level)
+            counter['calls'] = 0
+            elapsed = min(timeit.repeat(lambda: case(log), number=1, repeat=repeat))
+            dumps = counter['calls'] // repeat
+            print('%-20s%8s%12.3f%12d' % (
+                    name, logging.getLevelName(level), elapsed, dumps))
+            if level == logging.INFO and dumps:
+                failed = True
+    if failed:
+        print('yaml was rendered for suppressed debug messages')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    bench(int(args['--repeat']), int(args['--ou-count']), int(args['--items']))
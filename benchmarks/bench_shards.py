@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""Compare awsauth runs split across processes with --shards.
+
+Usage:
+  bench_shards.py [--sizes LIST] [--modes LIST] [--shards LIST]
+                  [--latency SEC] [--drift FRACTION]
+  bench_shards.py --run-case SIZE MODE SHARDS [--latency SEC]
+                  [--drift FRACTION]
+
+Options:
+  --sizes LIST          Comma separated org sizes, in member accounts
+                        [default: 100].
+  --modes LIST          Comma separated bench_e2e.py awsauth modes
+                        [default: awsauth.report,awsauth.delegations].
+  --shards LIST         Comma separated shard counts to compare with an
+                        unsharded run [default: 2,4].
+  --latency SEC         Simulated latency of each api call [default: 0.05].
+  --drift FRACTION      Fraction of the spec not yet deployed [default: 0.1].
+  --run-case            Run one case in this process and print its
+                        results as json.
+
+Each case runs bench_e2e.py's run_case() in a fresh interpreter.  Shard
+processes are forked from it and so share its in-process FakeBackend.
+Their api calls are not counted.  Exits non-zero if a sharded run
+prints different output than the unsharded run.
+"""
+
+import sys
+import json
+import subprocess
+
+from docopt import docopt
+
+import bench_e2e
+
+
+SHARDED_MODES = ('awsauth.report', 'awsauth.delegations', 'awsauth.local-users')
+
+
+def run_shards(size, mode, shards, args):
+    proc = subprocess.run([sys.executable, __file__, '--run-case',
+            str(size), mode, str(shards), '--drift', args['--drift'],
+            '--latency', args['--latency']],
+            stdout=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode:
+        sys.exit("case %s %s with %s shards failed" % (size, mode, shards))
+    return json.loads(proc.stdout)
+
+
+def main():
+    args = docopt(__doc__)
+    if args['--run-case']:
+        json.dump(bench_e2e.run_case(int(args['SIZE']), args['MODE'],
+                float(args['--drift']), float(args['--latency']),
+                ['--shards', args['SHARDS']]), sys.stdout, sort_keys=True)
+        return
+    modes = args['--modes'].split(',')
+    for mode in modes:
+        if mode not in SHARDED_MODES:
+            sys.exit("mode '%s' can not be sharded" % mode)
+    failed = False
+    print('%8s %-22s%7s%10s%9s%12s%12s' % ('size', 'mode', 'shards',
+            'time (s)', 'speedup', 'rss (kB)', 'shard rss'))
+    for size in [int(s) for s in args['--sizes'].split(',')]:
+        for mode in modes:
+            base = None
+            for shards in [1] + [int(s) for s in args['--shards'].split(',')]:
+                result = run_shards(size, mode, shards, args)
+                if base is None:
+                    base = result
+                elif result['output_digest'] != base['output_digest']:
+                    print('%s %s: output with %s shards differs' % (size,
+                            mode, shards))
+                    failed = True
+                print('%8s %-22s%7s%10.3f%8.1fx%12d%12d' % (size, mode,
+                        shards, result['wall_time'],
+                        base['wall_time'] / max(result['wall_time'], 0.001),
+                        result['peak_rss_kb'], result['peak_child_rss_kb']))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
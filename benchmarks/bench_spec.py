@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""Time spec loading and validation with and without the spec cache.
+
+Usage:
+  bench_spec.py [--repeat N] [--users N] [--jobs N]
+
+Options:
+  --repeat N    Number of timing runs per case [default: 3].
+  --users N     Number of users and local_users in the generated spec [default: 5000].
+  --jobs N      Number of processes for the parallel case [default: 4].
+
+Generates a spec directory in a temporary location and times
+awsorgs.spec.validate_spec() uncached, uncached in a process pool, with
+a warm cache and after changing one spec file.
+"""
+
+import os
+import shutil
+import logging
+import tempfile
+import timeit
+
+import yaml
+from docopt import docopt
+
+from awsorgs.spec import validate_spec
+
+
+COMMON = dict(
+    master_account_id='111111111111',
+    auth_account_id='222222222222',
+    default_domain='example.com',
+    default_sc_policy='FullAWSAccess',
+    default_ou='root',
+    default_path='/awsauth/',
+    default_smtp_server='localhost',
+    org_admin_team='admins',
+)
+
+
+def write_spec_dir(spec_dir, users):
+    """Write a valid spec directory with one file per top level key"""
+    spec = dict(
+        common=COMMON,
+        organizational_units=dict(organizational_units=[
+                dict(Name='root', Accounts=['account%04d' % a for a in range(50)])]),
+        sc_policies=dict(sc_policies=[]),
+        teams=dict(teams=[dict(Name='admins', Description='administrators',
+                BusinessContacts=['user0000'], TechnicalContacts=['user0001'])]),
+        accounts=dict(accounts=[
+                dict(Name='account%04d' % a, Team='admins') for a in range(50)]),
+        users=dict(users=[dict(Name='user%04d' % u, Team='admins',
+                Email='user%04d@example.com' % u) for u in range(users)]),
+        groups=dict(groups=[dict(Name='group%02d' % g,
+                Members=['user%04d' % u for u in range(g, users, 20)])
+                for g in range(20)]),
+        delegations=dict(delegations=[]),
+        local_users=dict(local_users=[dict(Name='service%04d' % u,
+                Team='admins', Account='ALL', Policies=['ReadOnlyAccess'])
+                for u in range(users)]),
+        custom_policies=dict(custom_policies=[]),
+    )
+    for name, content in spec.items():
+        with open(os.path.join(spec_dir, '%s.yaml' % name), 'w') as f:
+            yaml.safe_dump(content, f, default_flow_style=False)
+
+
+def bench(repeat, users, jobs):
+    log = logging.getLogger('bench_spec')
+    log.addHandler(logging.NullHandler())
+    log.propagate = False
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        spec_dir = os.path.join(tmp_dir, 'spec.d')
+        cache_dir = os.path.join(tmp_dir, 'cache')
+        os.mkdir(spec_dir)
+        write_spec_dir(spec_dir, users)
+        args = {'--spec-dir': spec_dir}
+        changed_file = os.path.join(spec_dir, 'teams.yaml')
+
+        def changed():
+            with open(changed_file, 'a') as f:
+                f.write('\n')
+            validate_spec(log, args, cache_dir=cache_dir)
+
+        cases = [
+            ('uncached', lambda: validate_spec(log, args, cache_dir=None)),
+            ('uncached, %s jobs' % jobs, lambda: validate_spec(log,
+                    dict(args, **{'--spec-jobs': jobs}), cache_dir=None)),
+            ('cache hit', lambda: validate_spec(log, args, cache_dir=cache_dir)),
+            ('one file changed', changed),
+        ]
+        validate_spec(log, args, cache_dir=cache_dir)
+        print('%-20s%12s' % ('case', 'time (s)'))
+        for name, case in cases:
+            elapsed = min(timeit.repeat(case, number=1, repeat=repeat))
+            print('%-20s%12.3f' % (name, elapsed))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    bench(int(args['--repeat']), int(args['--users']), int(args['--jobs']))
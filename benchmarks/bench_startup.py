@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Time startup of each awsorgs console script.
+
+Usage:
+  bench_startup.py [--repeat N]
+
+Options:
+  --repeat N    Number of runs per entry point [default: 10].
+
+Runs each entry point with --version in a fresh interpreter and reports
+the best wall time, along with the time of a bare interpreter for
+reference.  Also reports which heavy modules each entry point imports
+at startup.
+"""
+
+import sys
+import time
+import subprocess
+
+from docopt import docopt
+
+
+ENTRY_POINTS = [
+    ('awsorgs', 'awsorgs.orgs'),
+    ('awsaccounts', 'awsorgs.accounts'),
+    ('awsauth', 'awsorgs.auth'),
+    ('awsloginprofile', 'awsorgs.loginprofile'),
+    ('awsorgs-accessrole', 'awsorgs.accessrole'),
+]
+
+HEAVY_MODULES = ['boto3', 'botocore.session', 'cerberus', 'pkg_resources']
+
+RUN_SCRIPT = """
+import sys
+sys.argv = [%r, '--version']
+from %s import main
+try:
+    main()
+except SystemExit:
+    pass
+print(','.join(m for m in %r if m in sys.modules), file=sys.stderr)
+"""
+
+
+def best_time(cmd, repeat):
+    """Return best wall time of cmd and the stderr of its last run"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run(cmd, stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE, universal_newlines=True)
+        times.append(time.perf_counter() - start)
+    return min(times), proc.stderr.strip()
+
+
+def bench(repeat):
+    print('%-20s%10s  %s' % ('entry point', 'time (s)', 'heavy modules loaded'))
+    elapsed, _ = best_time([sys.executable, '-c', 'pass'], repeat)
+    print('%-20s%10.3f' % ('python', elapsed))
+    for script, module in ENTRY_POINTS:
+        code = RUN_SCRIPT % (script, module, HEAVY_MODULES)
+        elapsed, loaded = best_time([sys.executable, '-c', code], repeat)
+        print('%-20s%10.3f  %s' % (script, elapsed, loaded.splitlines()[-1]
+                if loaded else ''))
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    bench(int(args['--repeat']))
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""Micro-benchmarks for awsorgs.utils helpers on hot paths.
+
+Usage:
+  bench_utils.py [--repeat N] [--accounts N]
+
+Options:
+  --repeat N      Number of timing runs per case [default: 5].
+  --accounts N    Number of accounts in the synthetic org [default: 5000].
+
+Times lookup(), search_spec(), munge_path(), yamlfmt() and
+validate_accounts_unique_in_org() against data from a synthetic org of
+the given size.  Each helper is compared with the implementation it
+replaced, kept here as a reference.  The script exits non-zero if the
+two give different results.
+"""
+
+import sys
+import timeit
+import logging
+
+from docopt import docopt
+
+from awsorgs.utils import lookup, search_spec, munge_path, yamlfmt
+from awsorgs.orgs import validate_accounts_unique_in_org
+from awsorgs.fakeorg import generate_org
+
+
+def reference_lookup(dlist, lkey, lvalue, rkey=None):
+    items = [d for d in dlist
+             if lkey in d
+             and d[lkey] == lvalue]
+    if not items:
+        return None
+    if len(items) > 1:
+        raise RuntimeError(
+            "Data Error: lkey:lvalue lookup matches multiple items in dlist"
+        )
+    if rkey:
+        if rkey in items[0]:
+            return items[0][rkey]
+        return None
+    return items[0]
+
+
+def reference_search_spec(spec, search_key, recurse_key):
+    value = []
+    if search_key in spec and spec[search_key]:
+        if isinstance(spec[search_key], str):
+            value.append(spec[search_key])
+        else:
+            value += spec[search_key]
+    if recurse_key in spec and spec[recurse_key]:
+        for child_spec in spec[recurse_key]:
+            value += reference_search_spec(child_spec, search_key, recurse_key)
+    return sorted(value)
+
+
+def reference_munge_path(default_path, spec):
+    if 'Path' in spec and spec['Path']:
+        if spec['Path'][0] == '/':
+            if spec['Path'][-1] != '/':
+                return spec['Path'] + '/'
+            return spec['Path']
+        return "/%s/%s/" % (default_path, spec['Path'])
+    return "/%s/" % default_path
+
+
+def reference_validate_accounts_unique_in_org(log, root_spec):
+    def map_accounts(spec, account_map={}):
+        if 'Accounts' in spec and spec['Accounts']:
+            for account in spec['Accounts']:
+                if account in account_map:
+                    account_map[account].append(spec['Name'])
+                else:
+                    account_map[account] = [(spec['Name'])]
+        if 'Child_OU' in spec and spec['Child_OU']:
+            for child_spec in spec['Child_OU']:
+                map_accounts(child_spec, account_map)
+        return account_map
+    for account, ou in list(map_accounts(root_spec).items()):
+        if len(ou) > 1:
+            log.error("Account '%s' set in multiple OU: %s" % (account, ou))
+
+
+def make_cases(accounts):
+    """Return list of (name, reference, current, workload) tuples"""
+    org = generate_org(accounts=accounts, ou_depth=4, ou_fanout=4, seed=1)
+    spec = dict((k, v) for f in org['spec'].values() for k, v in f.items())
+    deployed_accounts = org['state']['accounts']
+    names = [a['Name'] for a in deployed_accounts[::max(accounts // 200, 1)]]
+    root_spec = spec['organizational_units'][0]
+    path_specs = (spec['users'] + spec['groups'] + spec['delegations']
+            + [dict(Path='team/admin'), dict(Path='/abs/path'),
+               dict(Path='/abs/path/')]) * 20
+    docs = [dict(Version='2012-10-17', Statement=p['Statement'])
+            for p in spec['custom_policies']] * 20
+    log = logging.getLogger('bench_utils')
+    log.addHandler(logging.NullHandler())
+    log.propagate = False
+    return [
+        ('lookup', reference_lookup, lookup, lambda f:
+            [f(deployed_accounts, 'Name', name, 'Id') for name in names]),
+        ('search_spec', reference_search_spec, search_spec, lambda f:
+            [f(root_spec, 'Accounts', 'Child_OU'),
+             f(root_spec, 'Name', 'Child_OU')]),
+        ('munge_path', reference_munge_path, munge_path, lambda f:
+            [f('awsauth', s) for s in path_specs]),
+        ('yamlfmt', yamlfmt, yamlfmt, lambda f: [f(d) for d in docs]),
+        ('accounts_unique', reference_validate_accounts_unique_in_org,
+            validate_accounts_unique_in_org, lambda f: f(log, root_spec)),
+    ]
+
+
+def best_time(func, repeat):
+    """Return best time per call of func, over calls lasting 0.2s or more"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(number=number, repeat=repeat)) / number
+
+
+def bench(repeat, accounts):
+    failed = False
+    print('%-20s%14s%14s%10s' % ('case', 'reference (s)', 'current (s)',
+            'speedup'))
+    for name, reference, current, workload in make_cases(accounts):
+        if workload(reference) != workload(current):
+            print('%s: results differ from reference' % name)
+            failed = True
+        slow = best_time(lambda: workload(reference), repeat)
+        fast = best_time(lambda: workload(current), repeat)
+        print('%-20s%14.4f%14.4f%9.1fx' % (name, slow, fast, slow / fast))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    bench(int(args['--repeat']), int(args['--accounts']))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""Compare pure python and LibYAML serialization on awsorgs workloads.
+
+Usage:
+  bench_yaml.py [--repeat N]
+
+Options:
+  --repeat N    Number of timing runs per case [default: 5].
+
+Times parsing of the sample spec files and rendering of a full
+account_authorization_report with the pure python SafeLoader/SafeDumper
+and with the loader/dumper awsorgs.utils selected (CSafeLoader/CSafeDumper
+when PyYAML has LibYAML support).
+"""
+
+import os
+import datetime
+import timeit
+
+import yaml
+from docopt import docopt
+
+import awsorgs
+from awsorgs.utils import YamlLoader, YamlDumper
+
+
+SAMPLES = os.path.join(os.path.dirname(awsorgs.__file__), 'samples')
+
+
+def spec_text(copies=50):
+    """Concatenate the sample spec files as a list of yaml documents"""
+    texts = []
+    for name in sorted(os.listdir(SAMPLES)):
+        with open(os.path.join(SAMPLES, name)) as f:
+            texts.append(f.read())
+    return texts * copies
+
+
+def report_records(accounts=50, users=100):
+    """Synthetic verbose report data: user details for many accounts"""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return {'account%03d' % a: dict(Users=[dict(
+                UserName='user%04d' % u,
+                Arn='arn:aws:iam::%012d:user/awsauth/user%04d' % (a, u),
+                Path='/awsauth/',
+                CreateDate=now,
+                GroupList=['group%02d' % g for g in range(u % 5)],
+                AttachedManagedPolicies=[],
+            ) for u in range(users)]) for a in range(accounts)}
+
+
+def bench(repeat):
+    texts = spec_text()
+    records = report_records()
+    cases = [
+        ('spec parse', lambda loader, dumper:
+            [yaml.load(t, Loader=loader) for t in texts]),
+        ('report format', lambda loader, dumper:
+            [yaml.dump(r, Dumper=dumper, default_flow_style=False)
+                    for r in records.values()]),
+    ]
+    print('%-16s%12s%12s%10s' % ('case', 'python (s)', 'awsorgs (s)', 'speedup'))
+    for name, case in cases:
+        slow = min(timeit.repeat(
+                lambda: case(yaml.SafeLoader, yaml.SafeDumper),
+                number=1, repeat=repeat))
+        fast = min(timeit.repeat(
+                lambda: case(YamlLoader, YamlDumper),
+                number=1, repeat=repeat))
+        print('%-16s%12.3f%12.3f%9.1fx' % (name, slow, fast, slow / fast))
+    print('awsorgs loader: %s, dumper: %s' % (YamlLoader.__name__, YamlDumper.__name__))
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    bench(int(args['--repeat']))
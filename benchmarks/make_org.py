@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+"""Write a synthetic organization to disk.
+
+Usage:
+  make_org.py OUTPUT_DIR [--accounts N] [--users N] [--delegations N]
+                         [--local-users N] [--trust-all FRACTION]
+                         [--drift FRACTION] [--seed N]
+
+Options:
+  --accounts N            Number of member accounts [default: 100].
+  --users N               Number of users in the auth account [default: 200].
+  --delegations N         Number of delegations [default: 20].
+  --local-users N         Number of local users [default: 10].
+  --trust-all FRACTION    Fraction of delegations trusted by ALL accounts [default: 0.5].
+  --drift FRACTION        Fraction of resources not yet deployed [default: 0].
+  --seed N                Random seed [default: 0].
+
+Writes the spec files to OUTPUT_DIR/spec.d and the matching deployed
+state, as loaded by FakeBackend.load_state(), to OUTPUT_DIR/state.yaml.
+"""
+
+import os
+
+import yaml
+from docopt import docopt
+
+from awsorgs.fakeorg import generate_org, write_spec_dir
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    org = generate_org(
+        accounts=int(args['--accounts']),
+        users=int(args['--users']),
+        delegations=int(args['--delegations']),
+        local_users=int(args['--local-users']),
+        trust_all=float(args['--trust-all']),
+        drift=float(args['--drift']),
+        seed=int(args['--seed']),
+    )
+    write_spec_dir(org, os.path.join(args['OUTPUT_DIR'], 'spec.d'))
+    with open(os.path.join(args['OUTPUT_DIR'], 'state.yaml'), 'w') as f:
+        yaml.dump(org['state'], f, default_flow_style=False)
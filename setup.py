@@ -48,6 +48,7 @@ setup(
             'awsauth=awsorgs.auth:main',
             'awsloginprofile=awsorgs.loginprofile:main',
             'awsorgs-accessrole=awsorgs.accessrole:main',
+            'awsorgs-daemon=awsorgs.daemon:main',
         ],
     },
 